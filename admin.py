@@ -2,6 +2,7 @@ from functools import reduce
 
 import django.contrib.admin.models
 import django.forms as djforms
+import django.utils.timezone
 import requests
 from django.contrib import admin
 from django.contrib import messages
@@ -20,9 +21,12 @@ from django.utils.safestring import mark_safe
 import tracker.filters as filters
 from django.conf import settings
 
+import tracker.bulkutil as bulkutil
+import tracker.eventutil as eventutil
 import tracker.forms as forms
 import tracker.horaro as horaro
 import tracker.logutil as logutil
+import tracker.mergeutil as mergeutil
 import tracker.models
 import tracker.prizemail as prizemail
 import tracker.prizeutil as prizeutil
@@ -190,12 +194,9 @@ def bid_set_state_action(modeladmin, request, queryset, value, recursive=False):
     if unchanged.exists():
       messages.warning(request, '%d bid(s) possibly unchanged because you can only use the dropdown on top level bids.' % unchanged.count())
     queryset = queryset.filter(parent__isnull=True)
-  total = queryset.count()
-  for b in queryset:
-    b.state = value
-    b.clean()
-    b.save() # can't use queryset.update because that doesn't send the post_save signals
-    logutil.change(request, b, ['state'])
+  logger = logutil.BufferedAdminLogger(request)
+  total = bulkutil.set_bid_state(queryset, value, logger)
+  logger.flush()
   if total and not recursive:
     messages.success(request, '%d bid(s) changed to %s.' % (total,value))
   return total
@@ -310,10 +311,21 @@ def merge_bids_view(request, *args, **kwargs):
   if request.method == 'POST':
     objects = [int(x) for x in request.POST['objects'].split(',')]
     form = forms.MergeObjectsForm(model=tracker.models.Bid,objects=objects, data=request.POST)
-    if form.is_valid():
-      viewutil.merge_bids(form.cleaned_data['root'], form.cleaned_data['objects'])
-      logutil.change(request, form.cleaned_data['root'], 'Merged bid {0} with {1}'.format(form.cleaned_data['root'], ','.join([str(d) for d in form.cleaned_data['objects']])))
-      return HttpResponseRedirect(reverse('admin:tracker_bid_changelist'))
+    if form.is_valid() and 'preview' in request.POST:
+      try:
+        plan = mergeutil.plan_merge(form.cleaned_data['root'], form.cleaned_data['objects'])
+      except ValueError as e:
+        messages.error(request, str(e))
+      else:
+        return render(request, 'admin/merge_bids.html', context={'form': form, 'plan': plan.describe()})
+    elif form.is_valid():
+      try:
+        viewutil.merge_bids(form.cleaned_data['root'], form.cleaned_data['objects'])
+      except ValueError as e:
+        messages.error(request, str(e))
+      else:
+        logutil.change(request, form.cleaned_data['root'], 'Merged bid {0} with {1}'.format(form.cleaned_data['root'], ','.join([str(d) for d in form.cleaned_data['objects']])))
+        return HttpResponseRedirect(reverse('admin:tracker_bid_changelist'))
   else:
     objects = [int(x) for x in request.GET['objects'].split(',')]
     form = forms.MergeObjectsForm(model=tracker.models.Bid,objects=objects)
@@ -376,7 +388,9 @@ class DonationInline(CustomStackedInline):
   readonly_fields = ('edit_link',)
 
 def mass_assign_action(self, request, queryset, field, value):
-  queryset.update(**{ field: value })
+  logger = logutil.BufferedAdminLogger(request)
+  bulkutil.assign(queryset, field, value, logger)
+  logger.flush()
   self.message_user(request, "Updated %s to %s" % (field, value))
 
 class PrizeTicketInline(CustomStackedInline):
@@ -670,13 +684,20 @@ def merge_donors_view(request, *args, **kwargs):
   if request.method == 'POST':
     objects = [int(x) for x in request.POST['objects'].split(',')]
     form = forms.MergeObjectsForm(model=tracker.models.Donor,objects=objects, data=request.POST)
-    if form.is_valid():
+    if form.is_valid() and 'preview' in request.POST:
+      try:
+        plan = mergeutil.plan_merge(form.cleaned_data['root'], form.cleaned_data['objects'])
+      except ValueError as e:
+        messages.error(request, str(e))
+      else:
+        return render(request, 'admin/merge_donors.html', context={'form': form, 'plan': plan.describe()})
+    elif form.is_valid():
       viewutil.merge_donors(form.cleaned_data['root'], form.cleaned_data['objects'])
       logutil.change(request, form.cleaned_data['root'], 'Merged donor {0} with {1}'.format(form.cleaned_data['root'], ','.join([str(d) for d in form.cleaned_data['objects']])))
       return HttpResponseRedirect(reverse('admin:tracker_donor_changelist'))
   else:
-    donors = [int(x) for x in request.GET['objects'].split(',')]
-    form = forms.MergeObjectsForm(model=tracker.models.Donor,donors=donors)
+    objects = [int(x) for x in request.GET['objects'].split(',')]
+    form = forms.MergeObjectsForm(model=tracker.models.Donor,objects=objects)
   return render(request, 'admin/merge_donors.html', context={'form': form})
 
 def google_flow(request):
@@ -811,10 +832,21 @@ class PostbackURLAdmin(CustomModelAdmin):
   form = PostbackURLForm
   search_fields = ('url',)
   list_filter = ('event',)
-  list_display = ('url', 'event')
+  list_display = ('url', 'event', 'coalesce')
   fieldsets = [
-    (None, { 'fields': ['event', 'url'] })
+    (None, { 'fields': ['event', 'url', 'coalesce'] }),
+    ('Deliveries', { 'fields': ['delivery_stats'] }),
   ]
+  readonly_fields = ('delivery_stats',)
+  def delivery_stats(self, instance):
+    if not instance.id:
+      return ''
+    stats = eventutil.postback_delivery_stats(tracker.models.PostbackURL.objects.filter(id=instance.id))[instance.id]
+    result = '{delivered} delivered, {pending} pending, {failed} failed'.format(**stats)
+    if stats['latency_avg'] is not None:
+      result += ', latency {latency_avg:.0f}ms average ({latency_min:.0f}ms - {latency_max:.0f}ms)'.format(**stats)
+    return result
+  delivery_stats.short_description = 'Delivery Stats'
   def get_queryset(self, request):
     event = viewutil.get_selected_event(request)
     if event:
@@ -822,6 +854,40 @@ class PostbackURLAdmin(CustomModelAdmin):
     else:
       return tracker.models.PostbackURL.objects.all()
 
+def requeue_ipn_action(modeladmin, request, queryset):
+  updated = queryset.filter(state__in=('FAILED', 'PENDING')).update(state='PENDING', attempts=0, nextattempt=django.utils.timezone.now())
+  modeladmin.message_user(request, '{0} IPNs queued for processing.'.format(updated))
+requeue_ipn_action.short_description = 'Retry selected IPNs'
+
+class QueuedIPNAdmin(CustomModelAdmin):
+  search_fields = ('txn_id',)
+  list_filter = ('state', 'payment_status')
+  list_display = ('id', 'txn_id', 'payment_status', 'state', 'attempts', 'received', 'processed')
+  readonly_fields = ('txn_id', 'payment_status', 'ipn', 'attempts', 'received', 'processed', 'body', 'querystring', 'secure', 'ipaddress', 'lasterror')
+  fieldsets = [
+    (None, { 'fields': ['state', 'nextattempt', 'txn_id', 'payment_status', 'ipn', 'attempts', 'received', 'processed', 'lasterror'] }),
+    ('Raw Request', { 'classes': ['collapse'], 'fields': ['body', 'querystring', 'secure', 'ipaddress'] }),
+  ]
+  actions = [requeue_ipn_action]
+  def has_add_permission(self, request, obj=None):
+    return False
+
+def retry_delivery_action(modeladmin, request, queryset):
+  updated = queryset.filter(state__in=('FAILED', 'PENDING')).update(state='PENDING', attempts=0, nextattempt=django.utils.timezone.now())
+  modeladmin.message_user(request, '{0} deliveries queued for sending.'.format(updated))
+retry_delivery_action.short_description = 'Retry selected deliveries'
+
+class PostbackDeliveryAdmin(CustomModelAdmin):
+  list_filter = ('state', 'postback')
+  list_display = ('id', 'postback', 'state', 'attempts', 'created', 'delivered', 'latency')
+  readonly_fields = ('postback', 'payload', 'attempts', 'created', 'delivered', 'latency', 'lasterror')
+  fieldsets = [
+    (None, { 'fields': ['postback', 'state', 'nextattempt', 'attempts', 'created', 'delivered', 'latency', 'lasterror', 'payload'] }),
+  ]
+  actions = [retry_delivery_action]
+  def has_add_permission(self, request, obj=None):
+    return False
+
 class PrizeForm(djforms.ModelForm):
   event = make_ajax_field(tracker.models.Prize, 'event', 'event', initial=latest_event_id)
   startrun = make_ajax_field(tracker.models.Prize, 'startrun', 'run')
@@ -1161,7 +1227,7 @@ def show_completed_bids(request):
 @admin_auth(('tracker.change_donor','tracker.change_donation'))
 def process_donations(request):
   currentEvent = viewutil.get_selected_event(request)
-  return render(request, 'admin/process_donations.html', { 'user_can_approve': request.user.has_perm('tracker.send_to_reader'), currentEvent: currentEvent })
+  return render(request, 'admin/process_donations.html', { 'user_can_approve': request.user.has_perm('tracker.send_to_reader'), 'currentEvent': currentEvent })
 
 @admin_auth(('tracker.change_donor','tracker.change_donation'))
 def read_donations(request):
@@ -1299,6 +1365,8 @@ admin.site.register(tracker.models.Event, EventAdmin)
 admin.site.register(tracker.models.SpeedRun, SpeedRunAdmin)
 admin.site.register(tracker.models.Runner, RunnerAdmin)
 admin.site.register(tracker.models.PostbackURL, PostbackURLAdmin)
+admin.site.register(tracker.models.PostbackDelivery, PostbackDeliveryAdmin)
+admin.site.register(tracker.models.QueuedIPN, QueuedIPNAdmin)
 admin.site.register(tracker.models.Submission, SubmissionAdmin)
 admin.site.register(tracker.models.Prize, PrizeAdmin)
 admin.site.register(tracker.models.PrizeTicket, PrizeTicketAdmin)
@@ -1331,6 +1399,7 @@ def get_urls():
            path('process_prize_submissions', process_prize_submissions, name='process_prize_submissions'),
            path('process_pending_bids', process_pending_bids, name='process_pending_bids'),
            path('search_objects', views.search, name='search_objects'),
+           path('moderation_stream', views.moderation_stream, name='moderation_stream'),
            path('edit_object', views.edit, name='edit_object'),
            path('add_object', views.add, name='add_object'),
            path('delete_object', views.delete, name='delete_object'),
@@ -0,0 +1,77 @@
+"""
+Lets a batch of writes put off the aggregate bookkeeping the model signals do after every save (donor caches and bid
+totals), and do it once per donor and bid at the end instead.
+"""
+import contextlib
+import threading
+
+_state = threading.local()
+
+
+def deferring():
+    """
+    :return: whether aggregates are being deferred in this thread
+    :rtype: bool
+    """
+    return getattr(_state, 'pending', None) is not None
+
+
+def defer_donor(event_id, donor_id):
+    """
+    Records that the donor's caches need recomputing, if aggregates are being deferred.
+
+    :return: whether it was deferred, otherwise the caller should recompute right away
+    :rtype: bool
+    """
+    if not deferring():
+        return False
+    _state.pending['donors'].add((event_id, donor_id))
+    return True
+
+
+def defer_bids(bid_ids):
+    """
+    Records that the totals of the bids need recomputing, if aggregates are being deferred.
+
+    :return: whether it was deferred, otherwise the caller should recompute right away
+    :rtype: bool
+    """
+    if not deferring():
+        return False
+    _state.pending['bids'].update(bid_ids)
+    return True
+
+
+@contextlib.contextmanager
+def deferred_aggregates():
+    """
+    Defers donor cache and bid total updates until the end of the block. Nested blocks are folded into the
+    outermost one. If the block raises, the pending updates are dropped along with it, since the transaction
+    they belong to is being rolled back anyway.
+    """
+    if deferring():
+        yield
+        return
+    _state.pending = {'donors': set(), 'bids': set()}
+    try:
+        yield
+        pending = _state.pending
+    finally:
+        _state.pending = None
+    flush(pending)
+
+
+def flush(pending):
+    from tracker import importutil
+    from tracker.models import Bid, Event
+
+    byEvent = {}
+    for event_id, donor_id in pending['donors']:
+        byEvent.setdefault(event_id, set()).add(donor_id)
+    events = Event.objects.in_bulk(byEvent.keys())
+    for event_id, donorIds in byEvent.items():
+        if event_id in events:
+            importutil.update_donor_caches(events[event_id], donorIds)
+    # saving a bid saves its parents too, which recomputes them from this one
+    for bid in Bid.objects.filter(pk__in=pending['bids']).order_by('-level'):
+        bid.save()
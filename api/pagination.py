@@ -0,0 +1,13 @@
+"""Define pagination for the REST API."""
+
+from rest_framework.pagination import CursorPagination
+
+
+class TrackerCursorPagination(CursorPagination):
+    """Page through results by primary key. Unlike page numbers, a cursor never skips or repeats rows when rows are
+    added while a client is paging, and every page is a single indexed range query no matter how deep it is.
+    """
+    ordering = 'id'
+    page_size = 100
+    page_size_query_param = 'limit'
+    max_page_size = 500
@@ -2,9 +2,13 @@
 
 import logging
 
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import prefetch_related_objects
 from rest_framework import serializers
 
+from tracker.models import Bid, Donation, Prize, PrizeWinner
 from tracker.models.event import Event, Runner, SpeedRun
+from tracker.views import api as legacy_api
 
 log = logging.getLogger(__name__)
 
@@ -27,6 +31,8 @@ class ClassNameField(serializers.Field):
 
 class EventSerializer(serializers.ModelSerializer):
     type = ClassNameField()
+    # the pytz timezone itself is not JSON serializable
+    timezone = serializers.CharField()
 
     class Meta:
         model = Event
@@ -50,3 +56,197 @@ class SpeedRunSerializer(serializers.ModelSerializer):
         model = SpeedRun
         fields = ('type', 'id', 'event', 'name', 'display_name', 'description', 'category', 'console', 'runners',
                   'commentators', 'starttime', 'endtime', 'order', 'run_time')
+
+
+class SparseFieldsetSerializerMixin(object):
+    """Allow the fields being serialized to be narrowed down with a `fields` keyword argument. The type and id are
+    always included.
+
+    Unless authorized (see the `authorized` context flag), the representation goes through the same privacy filter
+    as the search API.
+    """
+    always_included = ('type', 'id')
+    # the search type the privacy filter is called with, and the filter itself
+    privacy_model = None
+    privacy_filter = None
+    # columns the privacy filter looks at, which have to be loaded even if they are not asked for
+    privacy_columns = ()
+
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        super(SparseFieldsetSerializerMixin, self).__init__(*args, **kwargs)
+        if fields:
+            for name in set(self.fields) - set(fields) - set(self.always_included):
+                self.fields.pop(name)
+
+    @classmethod
+    def columns(cls, fields):
+        """Return the model columns needed to serialize the given fields, for `.only()`."""
+        model = cls.Meta.model
+        declared = cls().fields
+        columns = {'id'} | set(cls.privacy_columns)
+        for name in fields:
+            field = declared.get(name)
+            if field is None:
+                continue
+            try:
+                model_field = model._meta.get_field(field.source)
+            except FieldDoesNotExist:
+                continue
+            if model_field.concrete and not model_field.many_to_many:
+                columns.add(model_field.name)
+        return sorted(columns)
+
+    def to_representation(self, instance):
+        data = super(SparseFieldsetSerializerMixin, self).to_representation(instance)
+        if self.privacy_filter is None or self.context.get('authorized', False):
+            return data
+        fields = dict(data)
+        for column in self.privacy_columns:
+            fields.setdefault(column, getattr(instance, column))
+        self.privacy_filter(self.privacy_model, fields)
+        for name in list(data.keys()):
+            if name in fields:
+                data[name] = fields[name]
+            else:
+                del data[name]
+        return data
+
+
+class DonationSerializer(SparseFieldsetSerializerMixin, serializers.ModelSerializer):
+    type = ClassNameField()
+    privacy_model = 'donation'
+    privacy_filter = staticmethod(legacy_api.donation_privacy_filter)
+    privacy_columns = ('commentstate',)
+
+    class Meta:
+        model = Donation
+        fields = '__all__'
+
+
+class BidSerializer(SparseFieldsetSerializerMixin, serializers.ModelSerializer):
+    """Bids with their place in the bid tree: `parent`, plus the MPTT `level`, `tree_id`, `lft` and `rght`."""
+    type = ClassNameField()
+
+    class Meta:
+        model = Bid
+        fields = '__all__'
+
+
+class PrizeSerializer(SparseFieldsetSerializerMixin, serializers.ModelSerializer):
+    type = ClassNameField()
+    privacy_model = 'prize'
+    privacy_filter = staticmethod(legacy_api.prize_privacy_filter)
+
+    class Meta:
+        model = Prize
+        fields = '__all__'
+
+
+class PrizeWinnerSerializer(SparseFieldsetSerializerMixin, serializers.ModelSerializer):
+    type = ClassNameField()
+    privacy_model = 'prizewinner'
+    privacy_filter = staticmethod(legacy_api.prizewinner_privacy_filter)
+
+    class Meta:
+        model = PrizeWinner
+        fields = '__all__'
+
+
+def related_paths(serializer, prefix='', prefetching=False):
+    """Find the relations a serializer walks into, so they can be fetched up front instead of once per object.
+
+    :param serializer: the (unbound) serializer instance to inspect, e.g. SpeedRunSerializer()
+    :param prefix: lookup path of the serializer from the root model
+    :param prefetching: whether the path already goes through a many relation
+    :return: paths for select_related and paths for prefetch_related
+    :rtype: tuple[list[str], list[str]]
+    """
+    selects = []
+    prefetches = []
+    for field in serializer.fields.values():
+        if isinstance(field, serializers.ManyRelatedField):
+            # a list of primary keys still takes a query per object unless prefetched
+            prefetches.append(prefix + field.source.replace('.', '__'))
+            continue
+        many = isinstance(field, serializers.ListSerializer)
+        nested = field.child if many else field
+        if not isinstance(nested, serializers.BaseSerializer) or field.source == '*':
+            continue
+        path = prefix + field.source.replace('.', '__')
+        if many or prefetching:
+            prefetches.append(path)
+        else:
+            selects.append(path)
+        nested_selects, nested_prefetches = related_paths(nested, path + '__', many or prefetching)
+        selects += nested_selects
+        prefetches += nested_prefetches
+    return selects, prefetches
+
+
+def optimize_queryset(queryset, serializer_class, exclude=()):
+    """Add the select_related and prefetch_related calls the serializer needs to the queryset.
+
+    :param exclude: names of top level fields whose relations should not be fetched
+    """
+    serializer = serializer_class()
+    selects, prefetches = related_paths(serializer)
+    excluded = tuple(serializer.fields[name].source + '__' for name in exclude if name in serializer.fields)
+    selects = [path for path in selects if not (path + '__').startswith(excluded)]
+    prefetches = [path for path in prefetches if not (path + '__').startswith(excluded)]
+    if selects:
+        queryset = queryset.select_related(*selects)
+    if prefetches:
+        queryset = queryset.prefetch_related(*prefetches)
+    return queryset
+
+
+class RelatedIdsField(serializers.Field):
+    """Stand-in for a sideloaded relation, giving the ids of the related objects from a precomputed mapping."""
+
+    def __init__(self, ids, **kwargs):
+        self.ids = ids
+        kwargs['read_only'] = True
+        kwargs['source'] = '*'
+        super(RelatedIdsField, self).__init__(**kwargs)
+
+    def to_representation(self, obj):
+        return self.ids.get(obj.pk, [])
+
+
+def fetch_related(model, source, objs, serializer_class):
+    """Fetch the objects a forward relation of the given objects points to, each once, in primary key order.
+
+    :param model: the model of the objects
+    :param source: name of the relation on the model
+    :param objs: the objects
+    :param serializer_class: the serializer the related objects will be serialized with
+    :return: the ids of the related objects of each object, by its primary key, and the distinct related objects
+    :rtype: tuple[dict[int, list[int]], list]
+    """
+    relation = model._meta.get_field(source)
+    related_model = relation.related_model
+    if relation.many_to_many and not relation.auto_created:
+        # one query on the join table, which brings the related objects along with it
+        through = relation.remote_field.through
+        from_field, to_field = relation.m2m_field_name(), relation.m2m_reverse_field_name()
+        links = through.objects.filter(**{from_field + '__in': [obj.pk for obj in objs]}).select_related(
+            to_field).order_by(to_field + '_id', from_field + '_id')
+        ids = {}
+        related = {}
+        for link in links:
+            target = getattr(link, to_field)
+            ids.setdefault(getattr(link, from_field + '_id'), []).append(target.pk)
+            related[target.pk] = target
+        related = list(related.values())
+        selects, prefetches = related_paths(serializer_class())
+        if selects or prefetches:
+            prefetch_related_objects(related, *(selects + prefetches))
+    elif relation.many_to_one or (relation.one_to_one and relation.concrete):
+        ids = {obj.pk: [getattr(obj, relation.attname)] for obj in objs if getattr(obj, relation.attname) is not None}
+        related = list(optimize_queryset(related_model.objects.filter(
+            pk__in={related_id for related_ids in ids.values() for related_id in related_ids}),
+            serializer_class).order_by('pk'))
+    else:
+        raise ValueError('{0} is not a forward relation of {1}'.format(source, model.__name__))
+    return ids, related
@@ -10,6 +10,10 @@ router = routers.DefaultRouter()
 router.register(r'events', views.EventViewSet)
 router.register(r'runners', views.RunnerViewSet)
 router.register(r'runs', views.SpeedRunViewSet)
+router.register(r'donations', views.DonationViewSet)
+router.register(r'bids', views.BidViewSet)
+router.register(r'prizes', views.PrizeViewSet)
+router.register(r'prizewinners', views.PrizeWinnerViewSet)
 
 # use the router-generated URLs, and also link to the browsable API
 urlpatterns = [
@@ -2,105 +2,253 @@
 
 import logging
 
+from django.core.cache import cache
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Q
+from django.utils import dateparse, timezone
 from django.shortcuts import get_object_or_404
-from rest_framework import viewsets
+from rest_framework import serializers, viewsets
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 
+from tracker import cacheutil, filters, viewutil
+from tracker.models import Bid, Donation, Prize, PrizeWinner
 from tracker.models.event import Event, Runner, SpeedRun
-from tracker.api.serializers import EventSerializer, RunnerSerializer, SpeedRunSerializer
+from tracker.api.pagination import TrackerCursorPagination
+from tracker.api.serializers import BidSerializer, DonationSerializer, EventSerializer, PrizeSerializer, \
+    PrizeWinnerSerializer, RelatedIdsField, RunnerSerializer, SpeedRunSerializer, fetch_related, optimize_queryset
 
 log = logging.getLogger(__name__)
 
+# cached pages are dropped as soon as anything in the event changes, so this only bounds how long unused pages linger
+API_CACHE_TIMEOUT = 60 * 60
+
 
 class FlatteningViewSetMixin(object):
     """Override a view set's data query methods in order to have a flat dictionary of objects
     rather than the REST default of a nested tree.
+
+    Each relation named in `?include=` is sideloaded at query time: the primary objects only carry the ids of the
+    related objects, which are fetched with one query per relation and serialized once each, in primary key order.
     """
 
+    def get_includes(self):
+        """Return the relations to sideload, in the order they were asked for."""
+        include = self.request.query_params.get('include', None) if self.request else None
+        if not include:
+            return []
+        includes = []
+        for which in include.split(','):
+            which = which.strip()
+            if which and which not in includes:
+                includes.append(which)
+        return includes
+
     def list(self, request):
         """Change the response type to be a dictionary if flat related objects have been requested."""
         log.debug("query params: %s", request.query_params)
-        flatten = request.query_params.get('include', None)
-
-        serializer = self.serializer_class(self.queryset, many=True)
-
-        log.debug(serializer.data)
-        # if we need to flatten, it's time to walk this dictionary
-        if flatten:
-            targets = flatten.split(',')
-            prepared_data = self._flatten_data(serializer.data, targets)
+        page = self.paginate_queryset(self.filter_queryset(self.get_queryset()))
+        includes = self.get_includes()
+        if includes:
+            prepared_data = self._sideload(page, includes)
         else:
-            prepared_data = serializer.data
+            prepared_data = self.get_serializer(page, many=True).data
 
         log.debug(prepared_data)
-        return Response(prepared_data)
+        return self.get_paginated_response(prepared_data)
 
     def retrieve(self, request, pk=None):
         """Change the response type to be a dictionary if flat related objects have been requested."""
         log.debug("query params: %s", request.query_params)
-        flatten = request.query_params.get('include', None)
-
-        obj = get_object_or_404(self.queryset, pk=pk)
-        serializer = self.serializer_class(obj)
-
-        log.debug(serializer.data)
-        # if we need to flatten, it's time to walk this dictionary
-        if flatten:
-            targets = flatten.split(',')
-            prepared_data = self._flatten_data([serializer.data], targets)
+        obj = get_object_or_404(self.get_queryset(), pk=pk)
+        includes = self.get_includes()
+        if includes:
+            prepared_data = self._sideload([obj], includes)
         else:
-            prepared_data = serializer.data
+            prepared_data = self.get_serializer(obj).data
 
         log.debug(prepared_data)
         return Response(prepared_data)
 
-    @staticmethod
-    def _flatten_data(initial_data, targets):
-        log.debug("targets for flattening: %s", targets)
-
-        primary_objs = list()
-        obj_label = None
-        for item in initial_data:
-            obj_label = '{0:s}s'.format(item['type'])
-            primary_objs.append(dict(item))
-
-        prepared_data = {
-            obj_label: primary_objs
-        }
-
-        for which in targets:
-            log.debug("searching for target %s", which)
-            target_objs = dict()
-            for item in primary_objs:
-                log.debug("searching in %s", item)
-                hits = item.get(which, [])
-                if hits:
-                    # winch this into a list if it isn't a many=True field)
-                    if not isinstance(hits, list):
-                        log.debug("winching %s into a list", hits)
-                        hits = [hits]
-
-                    new_hit_list = list()
-                    for hit in hits:
-                        log.debug("found a hit: %s", hit)
-                        target_objs[hit['id']] = hit
-                        new_hit_list.append(hit['id'])
-                    item[which] = new_hit_list
-            prepared_data[which] = list(target_objs.values())
-
+    def _sideload(self, objs, includes):
+        log.debug("targets for sideloading: %s", includes)
+        objs = list(objs)
+        serializer = self.get_serializer(objs, many=True)
+        model = serializer.child.Meta.model
+        prepared_data = {}
+        sideloaded = {}
+        for which in includes:
+            field = serializer.child.fields.get(which)
+            if not isinstance(field, serializers.BaseSerializer):
+                raise ValidationError({'include': '{0} cannot be included'.format(which)})
+            related_serializer = field.child if isinstance(field, serializers.ListSerializer) else field
+            try:
+                ids, related = fetch_related(model, field.source, objs, related_serializer.__class__)
+            except (FieldDoesNotExist, ValueError):
+                raise ValidationError({'include': '{0} cannot be included'.format(which)})
+            # the primary objects only carry the ids, always as a list
+            serializer.child.fields[which] = RelatedIdsField(ids)
+            sideloaded[which] = related_serializer.__class__(related, many=True,
+                                                              context=self.get_serializer_context()).data
+
+        prepared_data['{0:s}s'.format(model.__name__.lower())] = serializer.data
+        prepared_data.update(sideloaded)
         return prepared_data
 
 
-class EventViewSet(FlatteningViewSetMixin, viewsets.ReadOnlyModelViewSet):
+class EventScopedViewSetMixin(object):
+    """Paginate with a cursor, fetch everything the serializer needs up front, and allow filtering to a single
+    event with `?event=<id or short name>`.
+
+    Pages of an event are cached until the event's 'api' version changes (see cacheutil), which the model signals
+    bump whenever anything shown here changes.
+    """
+    pagination_class = TrackerCursorPagination
+    # lookup (or lookups, any of which may match) from the model to its event, or None if the model cannot be
+    # filtered by event
+    event_field = 'event'
+    # whether the lookup goes through a many relation, and so can match the same row more than once
+    event_distinct = False
+
+    def get_event(self):
+        """Return the event the request is filtered to, if any."""
+        if not hasattr(self, '_event'):
+            event = self.request.query_params.get('event', None)
+            self._event = viewutil.get_event(event) if event and self.event_field else None
+        return self._event
+
+    def get_queryset(self):
+        queryset = super(EventScopedViewSetMixin, self).get_queryset()
+        event = self.get_event()
+        if event:
+            lookups = (self.event_field,) if isinstance(self.event_field, str) else self.event_field
+            query = Q()
+            for lookup in lookups:
+                query |= Q(**{lookup: event.id})
+            queryset = queryset.filter(query)
+            if self.event_distinct:
+                queryset = queryset.distinct()
+        # sideloaded relations are fetched separately, see FlatteningViewSetMixin
+        return optimize_queryset(queryset, self.get_serializer_class(), exclude=self.get_includes())
+
+    def get_cache_key(self, request):
+        event = self.get_event()
+        if not event:
+            return None
+        version = cacheutil.get_version('api', event.id)
+        if version is None:
+            return None
+        # the full url, since the page links in the response are built from it, and whether private fields are shown
+        return 'tracker:api:{0}:{1}:{2}'.format(version, int(request.user.has_perm('tracker.can_search')),
+                                               request.build_absolute_uri())
+
+    def list(self, request):
+        key = self.get_cache_key(request)
+        if key:
+            data = cache.get(key)
+            if data is not None:
+                return Response(data)
+        response = super(EventScopedViewSetMixin, self).list(request)
+        if key and response.status_code == 200:
+            cache.set(key, response.data, API_CACHE_TIMEOUT)
+        return response
+
+
+class EventViewSet(EventScopedViewSetMixin, FlatteningViewSetMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Event.objects.all()
     serializer_class = EventSerializer
+    event_field = 'id'
 
 
-class RunnerViewSet(FlatteningViewSetMixin, viewsets.ReadOnlyModelViewSet):
+class RunnerViewSet(EventScopedViewSetMixin, FlatteningViewSetMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Runner.objects.all()
     serializer_class = RunnerSerializer
+    event_field = 'speedrun__event'
+    event_distinct = True
 
 
-class SpeedRunViewSet(FlatteningViewSetMixin, viewsets.ReadOnlyModelViewSet):
+class SpeedRunViewSet(EventScopedViewSetMixin, FlatteningViewSetMixin, viewsets.ReadOnlyModelViewSet):
     queryset = SpeedRun.objects.all()
     serializer_class = SpeedRunSerializer
+
+
+class SearchableViewSetMixin(object):
+    """Read the same rows the search API would show the user, with the same privacy rules for private fields.
+
+    `?fields=a,b` narrows the fields returned, and only loads the columns those fields need. `?since=` takes either
+    a primary key, to fetch only rows added after it, or a time, for models with a `since_field`.
+    """
+    # the search type, see filters.run_model_query
+    search_model = None
+    since_field = None
+
+    def is_authorized(self):
+        return self.request.user.has_perm('tracker.can_search')
+
+    def get_sparse_fields(self):
+        fields = self.request.query_params.get('fields', None) if self.request else None
+        if not fields:
+            return None
+        return [field.strip() for field in fields.split(',') if field.strip()]
+
+    def get_queryset(self):
+        queryset = filters.run_model_query(self.search_model, {}, user=self.request.user,
+                                           mode='admin' if self.is_authorized() else 'user')
+        since = self.request.query_params.get('since', None)
+        if since:
+            queryset = queryset.filter(self.get_since_filter(since))
+        fields = self.get_sparse_fields()
+        if fields:
+            queryset = queryset.only(*self.get_serializer_class().columns(fields))
+        return queryset
+
+    def get_since_filter(self, since):
+        if since.isdigit():
+            return Q(id__gt=int(since))
+        time = dateparse.parse_datetime(since) if self.since_field else None
+        if time is None:
+            raise ValidationError({'since': 'Expected an id{0}'.format(' or a time' if self.since_field else '')})
+        if timezone.is_naive(time):
+            time = timezone.make_aware(time, timezone.utc)
+        return Q(**{self.since_field + '__gte': time})
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs['fields'] = self.get_sparse_fields()
+        return super(SearchableViewSetMixin, self).get_serializer(*args, **kwargs)
+
+    def get_serializer_context(self):
+        context = super(SearchableViewSetMixin, self).get_serializer_context()
+        context['authorized'] = self.is_authorized()
+        return context
+
+
+class DonationViewSet(EventScopedViewSetMixin, FlatteningViewSetMixin, SearchableViewSetMixin,
+                      viewsets.ReadOnlyModelViewSet):
+    queryset = Donation.objects.all()
+    serializer_class = DonationSerializer
+    search_model = 'donation'
+    since_field = 'timereceived'
+
+
+class BidViewSet(EventScopedViewSetMixin, FlatteningViewSetMixin, SearchableViewSetMixin,
+                 viewsets.ReadOnlyModelViewSet):
+    queryset = Bid.objects.all()
+    serializer_class = BidSerializer
+    search_model = 'allbids'
+    since_field = 'revealedtime'
+    event_field = ('event', 'speedrun__event')
+
+
+class PrizeViewSet(EventScopedViewSetMixin, FlatteningViewSetMixin, SearchableViewSetMixin,
+                   viewsets.ReadOnlyModelViewSet):
+    queryset = Prize.objects.all()
+    serializer_class = PrizeSerializer
+    search_model = 'prize'
+
+
+class PrizeWinnerViewSet(EventScopedViewSetMixin, FlatteningViewSetMixin, SearchableViewSetMixin,
+                         viewsets.ReadOnlyModelViewSet):
+    queryset = PrizeWinner.objects.all()
+    serializer_class = PrizeWinnerSerializer
+    search_model = 'prizewinner'
+    event_field = 'prize__event'
@@ -0,0 +1,178 @@
+"""
+Retention for the tables that only ever grow: the tracker log and the PayPal IPNs.
+
+Rows older than their policy allows are moved out of the database in chunks, each chunk into its own gzipped JSON
+Lines file in the archive directory (the ARCHIVE_DIRECTORY setting), one serialized row per line. A chunk is only
+deleted once its file is completely written, so an interrupted run loses nothing; at worst the next run archives
+some rows a second time, and reading skips the copies.
+
+Every file is named after its policy and the time range of its rows, so reading back a range only opens the files
+that overlap it.
+"""
+import gzip
+import json
+import os
+import re
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core import serializers
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Count, Max, Min, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from paypal.standard.ipn.models import PayPalIPN
+
+import tracker.models as models
+
+ARCHIVE_CHUNK_SIZE = 1000
+_FILE_TIME_FORMAT = '%Y%m%dT%H%M%S'
+_FILE_NAME = re.compile(r'^(?P<policy>[a-z]+)-(?P<first>\d{8}T\d{6})-(?P<last>\d{8}T\d{6})-(?P<pk>\d+)\.jsonl\.gz$')
+
+
+class ArchivePolicy(object):
+    """
+    Which rows of a model are archived.
+
+    :ivar Model: the model to archive
+    :ivar timeField: the field that says how old a row is
+    :ivar age: rows older than this are archived
+    :ivar filter: only rows that also match this are archived
+    """
+
+    def __init__(self, Model, timeField, age, filter=None):
+        self.Model = Model
+        self.timeField = timeField
+        self.age = age
+        self.filter = filter or Q()
+
+    def queryset(self, olderThan=None):
+        cutoff = timezone.now() - (self.age if olderThan is None else olderThan)
+        return self.Model.objects.filter(self.filter, **{self.timeField + '__lt': cutoff})
+
+
+ARCHIVE_POLICIES = {
+    'log': ArchivePolicy(models.Log, 'timestamp', timedelta(days=365)),
+    # failed IPNs stay until someone has looked at them
+    'queuedipn': ArchivePolicy(models.QueuedIPN, 'received', timedelta(days=90),
+                               Q(state__in=('DONE', 'DUPLICATE'))),
+    'ipn': ArchivePolicy(PayPalIPN, 'created_at', timedelta(days=365)),
+}
+
+
+def archive_directory(directory=None):
+    directory = directory or getattr(settings, 'ARCHIVE_DIRECTORY', None)
+    if not directory:
+        raise ValueError('No archive directory given, and the ARCHIVE_DIRECTORY setting is not set')
+    return directory
+
+
+def _write_chunk(name, policy, rows, directory):
+    rows = sorted(rows, key=lambda row: (getattr(row, policy.timeField), row.pk))
+    times = [getattr(row, policy.timeField) for row in rows]
+    fileName = '{0}-{1}-{2}-{3}.jsonl.gz'.format(
+        name, min(times).astimezone(timezone.utc).strftime(_FILE_TIME_FORMAT),
+        max(times).astimezone(timezone.utc).strftime(_FILE_TIME_FORMAT), min(row.pk for row in rows))
+    path = os.path.join(directory, fileName)
+    # written under another name first, so that a file that is there is always complete
+    with gzip.open(path + '.tmp', 'wt', encoding='utf-8') as archive:
+        for row in serializers.serialize('python', rows):
+            archive.write(json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False))
+            archive.write('\n')
+    os.replace(path + '.tmp', path)
+    return path
+
+
+def archive(name, olderThan=None, directory=None, chunkSize=ARCHIVE_CHUNK_SIZE):
+    """
+    Moves the rows the policy says are old enough out of the database and into the archive.
+
+    :param name: one of ARCHIVE_POLICIES
+    :type name: str
+    :param olderThan: archive the rows older than this instead of the policy's age
+    :type olderThan: timedelta
+    :param directory: where to write the files, by default the ARCHIVE_DIRECTORY setting
+    :type directory: str
+    :param chunkSize: how many rows go in each file, and are deleted at once
+    :type chunkSize: int
+    :return: the number of rows archived
+    :rtype: int
+    """
+    policy = ARCHIVE_POLICIES[name]
+    directory = archive_directory(directory)
+    os.makedirs(directory, exist_ok=True)
+    archived = 0
+    while True:
+        # the ids are in about the order the rows were written in, and are indexed where the times may not be
+        ids = list(policy.queryset(olderThan).order_by('pk').values_list('pk', flat=True)[:chunkSize])
+        if not ids:
+            return archived
+        rows = list(policy.Model.objects.filter(pk__in=ids).order_by('pk'))
+        _write_chunk(name, policy, rows, directory)
+        with transaction.atomic():
+            policy.Model.objects.filter(pk__in=ids).delete()
+        archived += len(ids)
+
+
+def archive_stats(name, olderThan=None):
+    """
+    :return: how many rows would be archived, and the oldest and newest of their times
+    :rtype: dict
+    """
+    policy = ARCHIVE_POLICIES[name]
+    return policy.queryset(olderThan).aggregate(
+        count=Count('pk'), oldest=Min(policy.timeField), newest=Max(policy.timeField))
+
+
+def archive_files(name, directory=None, since=None, until=None):
+    """
+    :return: the paths of the archive files of the policy with rows in the time range, oldest first
+    :rtype: list[str]
+    """
+    directory = archive_directory(directory)
+    if not os.path.isdir(directory):
+        return []
+    files = []
+    for fileName in os.listdir(directory):
+        match = _FILE_NAME.match(fileName)
+        if not match or match.group('policy') != name:
+            continue
+        first, last = [timezone.make_aware(datetime.strptime(match.group(part), _FILE_TIME_FORMAT),
+                                           timezone.utc) for part in ('first', 'last')]
+        # the names are only precise to the second
+        if (since and last + timedelta(seconds=1) <= since) or (until and first > until):
+            continue
+        files.append((first, int(match.group('pk')), os.path.join(directory, fileName)))
+    return [path for first, pk, path in sorted(files)]
+
+
+def read_archive(name, directory=None, since=None, until=None, **fields):
+    """
+    Reads archived rows back, as unsaved model instances.
+
+    :param name: one of ARCHIVE_POLICIES
+    :type name: str
+    :param since: only rows at or after this time
+    :type since: datetime
+    :param until: only rows before this time
+    :type until: datetime
+    :param fields: only rows with these values, by the name of the field, e.g. event=1 or category='paypal'
+    :return: a generator of model instances, roughly oldest first
+    """
+    policy = ARCHIVE_POLICIES[name]
+    seen = set()
+    for path in archive_files(name, directory, since, until):
+        with gzip.open(path, 'rt', encoding='utf-8') as archived:
+            for line in archived:
+                row = json.loads(line)
+                if row['pk'] in seen:
+                    continue
+                if any(row['fields'].get(field) != value for field, value in fields.items()):
+                    continue
+                time = parse_datetime(row['fields'][policy.timeField])
+                if (since and time < since) or (until and time >= until):
+                    continue
+                seen.add(row['pk'])
+                for deserialized in serializers.deserialize('python', [row]):
+                    yield deserialized.object
@@ -1,4 +1,3 @@
-import post_office.mail
 import post_office.models
 from django.conf import settings
 from django.contrib.auth import get_user_model
@@ -124,9 +123,7 @@ def send_registration_mail(domain, user, template=None, sender=None, token_gener
     return send_auth_token_mail(domain, user, reverse('tracker:confirm_registration'), template, sender, token_generator, extra_context)
 
 
-def send_auth_token_mail(domain, user, viewURI, template, sender=None, token_generator=default_token_generator, extra_context=None):
-    if not sender:
-        sender = viewutil.get_default_email_from_user()
+def auth_token_mail_context(domain, user, viewURI, token_generator=default_token_generator, extra_context=None):
     reset_url = make_auth_token_url(domain, user, viewURI, token_generator)
     formatContext = {
         'user': user,
@@ -135,4 +132,11 @@ def send_auth_token_mail(domain, user, viewURI, template, sender=None, token_gen
     }
     if extra_context:
         formatContext.update(extra_context)
-    return post_office.mail.send(recipients=[user.email], sender=sender, template=template, context=formatContext)
+    return formatContext
+
+
+def send_auth_token_mail(domain, user, viewURI, template, sender=None, token_generator=default_token_generator, extra_context=None):
+    if not sender:
+        sender = viewutil.get_default_email_from_user()
+    formatContext = auth_token_mail_context(domain, user, viewURI, token_generator, extra_context)
+    return mailutil.send(recipients=[user.email], sender=sender, template=template, context=formatContext)
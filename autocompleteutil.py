@@ -0,0 +1,184 @@
+"""
+The search behind the admin's ajax-select autocompletes.
+
+Instead of the recursive `icontains` search of filters.model_general_filter, each channel matches the typed text
+against a few fields of its own: objects where a field equals the text rank first, then those where a field
+starts with it (on the indexed, normalized keys where the model has them), then those where a field merely
+contains it. At most AUTOCOMPLETE_MAX_RESULTS objects are returned.
+
+Each user's last search on a channel is cached for a short while. When the text is only extended, as it is
+while typing, and the last search found every match, the new results are picked out of the old ones without
+going back to the database.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+
+import tracker.filters as filters
+import tracker.util as util
+
+AUTOCOMPLETE_MAX_RESULTS = 20
+# how long the last search of a user is kept around for the next keystroke
+AUTOCOMPLETE_CACHE_TIMEOUT = 30
+
+EXACT = 0
+PREFIX = 1
+SUBSTRING = 2
+
+
+class AutocompleteFields(object):
+    """
+    :ivar keys: normalized key fields (see util.normalize_key), matched exactly or by prefix
+    :ivar names: text fields, matched exactly or by prefix regardless of case
+    :ivar substrings: text fields that the text may appear anywhere in
+    :ivar related: relations to select along with the results, for their labels
+    """
+
+    def __init__(self, keys=(), names=(), substrings=(), related=()):
+        self.keys = list(keys)
+        self.names = list(names)
+        self.substrings = list(substrings)
+        self.related = list(related)
+
+    @property
+    def columns(self):
+        return self.keys + self.names + self.substrings
+
+    def exact_filter(self, text):
+        query = Q(pk__in=[])
+        for field in self.keys:
+            query |= Q(**{field: text})
+        for field in self.names:
+            query |= Q(**{field + '__iexact': text})
+        return query
+
+    def prefix_filter(self, text):
+        query = Q(pk__in=[])
+        for field in self.keys:
+            query |= Q(**{field + '__startswith': text})
+        for field in self.names:
+            query |= Q(**{field + '__istartswith': text})
+        return query
+
+    def substring_filter(self, text):
+        query = Q(pk__in=[])
+        for field in self.substrings:
+            query |= Q(**{field + '__icontains': text})
+        return query
+
+    def rank(self, row, text):
+        """
+        :param row: the primary key and the values of `columns` of an object
+        :type row: list
+        :return: how well the object matches the normalized text, or None if it does not
+        :rtype: tuple|None
+        """
+        values = [(value or '').lower() for value in row[1:]]
+        prefixed = values[:len(self.keys) + len(self.names)]
+        for value in prefixed:
+            if value == text:
+                return EXACT, value, row[0]
+        matches = sorted(value for value in prefixed if value.startswith(text))
+        if matches:
+            return PREFIX, matches[0], row[0]
+        matches = sorted(value for value in values[len(prefixed):] if text in value)
+        if matches:
+            return SUBSTRING, matches[0], row[0]
+        return None
+
+
+_donorFields = ['email', 'alias', 'firstname', 'lastname', 'paypalemail']
+
+AUTOCOMPLETE_FIELDS = {
+    'donor': AutocompleteFields(
+        keys=['emailkey', 'aliaskey', 'paypalemailkey'], names=['firstname', 'lastname'], substrings=_donorFields),
+    'donation': AutocompleteFields(
+        keys=['donor__emailkey', 'donor__aliaskey', 'donor__paypalemailkey'],
+        names=['donor__firstname', 'donor__lastname'], substrings=['donor__' + field for field in _donorFields],
+        related=['donor']),
+    'event': AutocompleteFields(names=['short', 'name'], substrings=['short', 'name']),
+    'run': AutocompleteFields(names=['name'], substrings=['name']),
+    'runner': AutocompleteFields(names=['name'], substrings=['name', 'stream', 'twitter', 'youtube']),
+    'prize': AutocompleteFields(names=['name'], substrings=['name']),
+}
+for _bidModel in ('bid', 'allbids', 'bidtarget'):
+    AUTOCOMPLETE_FIELDS[_bidModel] = AutocompleteFields(
+        names=['name', 'speedrun__name'], substrings=['name', 'speedrun__name'], related=['speedrun', 'parent'])
+
+
+def _cache_key(user, model, params):
+    return 'tracker:autocomplete:{0}:{1}:{2}'.format(
+        getattr(user, 'pk', None), model, ':'.join('{0}={1}'.format(k, params[k]) for k in sorted(params)))
+
+
+def _ranked(fields, rows, text):
+    ranked = []
+    for row in rows:
+        rank = fields.rank(row, text)
+        if rank is not None:
+            ranked.append((rank, row))
+    ranked.sort(key=lambda item: item[0])
+    return [row for rank, row in ranked]
+
+
+def _rows(fields, queryset, query, limit):
+    # the default filters of some models join in other tables, so rows have to be made distinct; when there are
+    # more matches than fit, the newest objects are the ones kept
+    return list(queryset.filter(query).values_list('pk', *fields.columns).order_by('-pk').distinct()[:limit])
+
+
+def _search(fields, queryset, text, limit):
+    """
+    :return: the matching rows, best first, and whether that is every match there is
+    :rtype: tuple[list, bool]
+    """
+    rows = {}
+    for query in (fields.exact_filter(text), fields.prefix_filter(text)):
+        rows.update((row[0], row) for row in _rows(fields, queryset, query, limit))
+    complete = False
+    if len(rows) < limit:
+        # everything that matches at all contains the text, so this catches everything if it is not cut short
+        found = _rows(fields, queryset, fields.substring_filter(text), limit)
+        rows.update((row[0], row) for row in found)
+        complete = len(found) < limit
+    return _ranked(fields, list(rows.values()), text), complete
+
+
+def autocomplete(model, text, params=None, user=None):
+    """
+    Returns the objects matching the text the user typed, best matches first.
+
+    :param model: the filters name of the model being looked up
+    :type model: str
+    :param text: what the user typed
+    :type text: str
+    :param params: any other filters.run_model_query parameters, e.g. the event
+    :type params: dict
+    :param user: the user doing the search, whose searches are cached separately
+    :type user: User
+    :rtype: list[Model]
+    """
+    model = filters.normalize_model_param(model)
+    params = dict(params or {})
+    params.pop('q', None)
+    text = util.normalize_key(text)
+    if not text:
+        return []
+    fields = AUTOCOMPLETE_FIELDS.get(model, None)
+    if fields is None:
+        return list(filters.run_model_query(model, dict(params, q=text), user=user, mode='admin'))
+    queryset = filters.run_model_query(model, params, user=user, mode='admin')
+    limit = getattr(settings, 'AUTOCOMPLETE_MAX_RESULTS', AUTOCOMPLETE_MAX_RESULTS)
+
+    key = _cache_key(user, model, params)
+    last = cache.get(key)
+    if last and last['complete'] and text.startswith(last['text']):
+        rows, complete = _ranked(fields, last['rows'], text), True
+    else:
+        rows, complete = _search(fields, queryset, text, limit)
+    cache.set(key, {'text': text, 'rows': rows, 'complete': complete},
+              getattr(settings, 'AUTOCOMPLETE_CACHE_TIMEOUT', AUTOCOMPLETE_CACHE_TIMEOUT))
+
+    ids = [row[0] for row in rows[:limit]]
+    objects = queryset.model.objects.filter(pk__in=ids).select_related(*fields.related).in_bulk()
+    return [objects[pk] for pk in ids if pk in objects]
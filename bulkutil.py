@@ -0,0 +1,140 @@
+"""
+Set based state changes for the admin's mass actions. Saving each object one at a time runs every save signal
+for every row (for bids, re-saving the whole tree and re-aggregating it at each step), so these do the change
+with a handful of UPDATEs instead, and then do once what the signals would have done for each object.
+"""
+from datetime import datetime
+from functools import reduce
+
+import pytz
+from django.db import transaction
+from django.db.models import F, Q, Sum
+
+import tracker.cacheutil as cacheutil
+import tracker.models as models
+
+# states whose options are left out of the totals of their parent bid
+_HIDDEN_BID_STATES = ('HIDDEN', 'DENIED', 'PENDING')
+# option states that are kept when the state of their parent changes
+_OWN_BID_STATES = ('PENDING', 'DENIED')
+
+
+def _changed(Model, eventIds):
+    from tracker import tickerutil
+    for eventId in set(eventIds):
+        if eventId is None:
+            continue
+        if Model == models.Bid:
+            for namespace in ('bids', 'schedule', 'api'):
+                cacheutil.bump_version(namespace, eventId)
+            tickerutil.ticker_changed(eventId)
+        elif Model == models.Donation:
+            cacheutil.bump_version('api', eventId)
+            tickerutil.ticker_changed(eventId)
+        elif Model == models.Prize:
+            cacheutil.bump_version('prizes', eventId)
+            cacheutil.bump_version('api', eventId)
+
+
+def _subtrees(bids):
+    # every descendant of the bids, by their position in the tree
+    return reduce(lambda query, bid: query | Q(tree_id=bid.tree_id, lft__gt=bid.lft, rght__lt=bid.rght),
+                  bids, Q(pk__in=[]))
+
+
+def _update_bid_totals(bids):
+    """
+    Recomputes the totals of the bids that have options, and of every bid with options below them, from the
+    bottom up, from the totals the targets already have.
+    """
+    parents = models.Bid.objects.filter(Q(pk__in=[bid.pk for bid in bids]) | _subtrees(bids)).filter(
+        istarget=False).order_by('-level').values_list('id', flat=True)
+    for parentId in parents:
+        totals = models.Bid.objects.filter(parent_id=parentId).exclude(state__in=_HIDDEN_BID_STATES).aggregate(
+            total=Sum('total'), count=Sum('count'))
+        models.Bid.objects.filter(pk=parentId).update(total=totals['total'] or 0, count=totals['count'] or 0)
+
+
+@transaction.atomic
+def set_bid_state(queryset, state, logger=None):
+    """
+    Sets the state of the bids, and of their options the way Bid.clean would: every option that is not pending
+    or denied follows its parent.
+
+    The totals of a bid only count its visible options, so they are only recomputed for the trees where something
+    was or becomes hidden; otherwise opening and closing bids leaves every total as it is.
+
+    :param queryset: the bids to change
+    :type queryset: QuerySet
+    :param logger: where to log each changed bid, e.g. a logutil.BufferedAdminLogger
+    :type logger: logutil.AdminLogger
+    :return: how many of the bids were changed
+    :rtype: int
+    """
+    bids = list(queryset.exclude(state=state).select_related('event', 'speedrun', 'parent'))
+    if not bids:
+        return 0
+    ids = [bid.pk for bid in bids]
+    if state == 'OPENED':
+        models.Bid.objects.filter(pk__in=ids, state='HIDDEN').update(
+            revealedtime=datetime.utcnow().replace(tzinfo=pytz.utc))
+    descendants = models.Bid.objects.filter(_subtrees(bids)).exclude(state__in=_OWN_BID_STATES)
+    eventIds = set()
+    hiddenTrees = set()
+    for eventId, treeId, oldState in descendants.values_list('event_id', 'tree_id', 'state'):
+        eventIds.add(eventId)
+        if oldState == 'HIDDEN':
+            hiddenTrees.add(treeId)
+    hiding = [bid for bid in bids if state == 'HIDDEN' or bid.state == 'HIDDEN' or bid.tree_id in hiddenTrees]
+    descendants.update(state=state)
+    models.Bid.objects.filter(pk__in=ids).update(state=state)
+    if state == 'OPENED':
+        # challenges that already met their goal close straight away, as they would when saved
+        models.Bid.objects.filter(Q(pk__in=ids) | _subtrees(bids)).filter(
+            istarget=True, state='OPENED', goal__isnull=False, total__gte=F('goal')).update(state='CLOSED')
+    if hiding:
+        _update_bid_totals(hiding)
+        # the totals of whatever these are options of include them or not anymore as well
+        roots = [bid.parent.get_root() for bid in hiding if bid.parent]
+        if roots:
+            _update_bid_totals(roots)
+    for bid in bids:
+        eventIds.add(bid.event_id or (bid.speedrun.event_id if bid.speedrun else None))
+        if logger:
+            bid.state = state
+            logger.log_change(bid, ['state'])
+    _changed(models.Bid, eventIds)
+    return len(bids)
+
+
+@transaction.atomic
+def assign(queryset, field, value, logger=None):
+    """
+    Sets a field of every object in the queryset with one UPDATE, for fields that nothing is aggregated from
+    (the moderation states of donations, the state of prizes, etc.), so that none of the save signals that keep
+    the totals up to date need to run.
+
+    :param logger: where to log each changed object, e.g. a logutil.BufferedAdminLogger
+    :type logger: logutil.AdminLogger
+    :return: how many objects were changed
+    :rtype: int
+    """
+    Model = queryset.model
+    changed = queryset.exclude(**{field: value})
+    if Model == models.Donation:
+        # for the log entries, which name the donor
+        changed = changed.select_related('donor')
+    changed = list(changed)
+    if not changed:
+        return 0
+    ids = [obj.pk for obj in changed]
+    Model.objects.filter(pk__in=ids).update(**{field: value})
+    if Model == models.Donation:
+        models.DonationChange.objects.bulk_create(
+            models.DonationChange(donation_id=donation.pk, event_id=donation.event_id) for donation in changed)
+    for obj in changed:
+        if logger:
+            setattr(obj, field, value)
+            logger.log_change(obj, [field])
+    _changed(Model, (getattr(obj, 'event_id', None) for obj in changed))
+    return len(changed)
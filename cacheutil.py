@@ -0,0 +1,123 @@
+"""
+Helpers for keeping derived per-event data in sync across worker processes.
+
+Each kind of derived data (a "namespace") has a version number per event stored in the
+django cache. Model signals bump the version whenever the underlying rows change, and
+readers compare the version they built against with the current one to know when their
+copy has gone stale.
+
+The version keys only reach other processes through a shared cache backend, so local copies are also rebuilt
+after EVENT_CACHE_MAX_AGE seconds whatever their version says, and a system check warns about process-local
+backends.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import cache
+
+# backends that every process has its own copy of
+_PROCESS_LOCAL_BACKENDS = ('django.core.cache.backends.locmem.LocMemCache',)
+
+
+def _version_key(namespace, event_id):
+    return 'tracker:version:{0}:{1}'.format(namespace, event_id)
+
+
+def _initial_version():
+    # seeded from the clock so that a flushed or evicted key can never come back with a
+    # version number that some process already built against
+    return int(time.time() * 1000)
+
+
+def get_version(namespace, event_id):
+    """
+    Returns the current version of the given namespace for an event, or None if the
+    configured cache cannot hold it (e.g. the dummy backend), in which case callers
+    should treat any derived data as stale.
+
+    :param namespace: name of the derived data, e.g. 'prizes'
+    :type namespace: str
+    :param event_id: primary key of the event
+    :type event_id: int
+    :rtype: int|None
+    """
+    key = _version_key(namespace, event_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _initial_version(), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(namespace, event_id):
+    """
+    Marks all derived data in the namespace for the event as stale.
+
+    :param namespace: name of the derived data, e.g. 'prizes'
+    :type namespace: str
+    :param event_id: primary key of the event
+    :type event_id: int
+    :rtype: int|None
+    """
+    if event_id is None:
+        return None
+    key = _version_key(namespace, event_id)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.add(key, _initial_version(), None)
+        return cache.get(key)
+
+
+def max_age():
+    """
+    :return: the most seconds a process-local copy is used for, the EVENT_CACHE_MAX_AGE setting
+    :rtype: float
+    """
+    return getattr(settings, 'EVENT_CACHE_MAX_AGE', 30)
+
+
+@checks.register('caches')
+def check_shared_cache(app_configs, **kwargs):
+    backend = settings.CACHES.get('default', {}).get('BACKEND')
+    if backend in _PROCESS_LOCAL_BACKENDS:
+        return [checks.Warning(
+            'The default cache is process-local, so changes made in one process only reach the tracker caches of '
+            'the others once they expire, after EVENT_CACHE_MAX_AGE ({0}) seconds.'.format(max_age()),
+            hint='Use a shared cache backend, e.g. memcached or the database cache, when running more than one '
+                 'process (including workers such as process_ipn_queue).',
+            id='tracker.W001')]
+    return []
+
+
+class EventVersionedCache(object):
+    """
+    Process-local store of one derived value per event, rebuilt with `builder(event_id)`
+    whenever the namespace version for that event changes, or once it is older than
+    EVENT_CACHE_MAX_AGE seconds.
+    """
+
+    def __init__(self, namespace, builder):
+        self.namespace = namespace
+        self.builder = builder
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, event_id):
+        version = get_version(self.namespace, event_id)
+        entry = self._entries.get(event_id)
+        now = time.monotonic()
+        if entry is not None and version is not None and entry[0] == version and now - entry[2] < max_age():
+            return entry[1]
+        # the version is read before building, so a change that lands mid-build leaves
+        # the entry tagged with the older version and the next reader rebuilds it
+        value = self.builder(event_id)
+        with self._lock:
+            self._entries[event_id] = (version, value, now)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,80 @@
+import collections
+
+from django.db.models import Q
+
+import tracker.cacheutil as cacheutil
+import tracker.models as models
+
+
+class DonationMenuRun(object):
+    """A run on the donate page, or the event itself for bids that are not tied to a run."""
+
+    def __init__(self, id, name, run=None):
+        self.id = id
+        self.name = name
+        self.run = run
+        self.bid_list = []
+
+
+class DonationMenu(object):
+    """
+    Everything the donate pages need to know about an event's bids, built from a single query.
+
+    The bids are shared between requests and must be treated as read only. Each top level bid has an
+    `options_list` holding its open options, highest total first.
+
+    :ivar bids: open top level bids, in the usual bid order
+    :ivar runs: the open bids grouped per run, as `DonationMenuRun` objects
+    :ivar targets: open bids a donation can be put towards directly, including options, in the usual bid order
+    """
+
+    def __init__(self, event_id, bids):
+        self.event_id = event_id
+        bids = list(bids)
+        by_id = {bid.id: bid for bid in bids}
+        parent_field = models.Bid._meta.get_field('parent')
+        children = collections.defaultdict(list)
+        for bid in bids:
+            if bid.parent_id in by_id:
+                # link parents up front, so that labels and parent info never go back to the database
+                parent_field.set_cached_value(bid, by_id[bid.parent_id])
+                children[bid.parent_id].append(bid)
+        for bid in bids:
+            bid.options_list = sorted((option for option in children[bid.id] if option.state == 'OPENED'),
+                                      key=lambda option: (-option.total, option.name))
+
+        self.bids = [bid for bid in bids if bid.level == 0 and bid.state == 'OPENED']
+        self.targets = [bid for bid in bids
+                        if bid.state == 'OPENED' and (bid.allowuseroptions or (bid.istarget and not children[bid.id]))]
+        self.options = {option.id: option for bid in self.bids for option in bid.options_list}
+
+        runs = collections.OrderedDict()
+        for bid in self.bids:
+            if bid.speedrun_id not in runs:
+                if bid.speedrun:
+                    runs[bid.speedrun_id] = DonationMenuRun(bid.speedrun.id, bid.speedrun.name, bid.speedrun)
+                else:
+                    runs[bid.speedrun_id] = DonationMenuRun('event', 'Event Wide')
+            runs[bid.speedrun_id].bid_list.append(bid)
+        self.runs = list(runs.values())
+
+
+def _build_donation_menu(event_id):
+    bids = models.Bid.objects.filter(Q(event_id=event_id) | Q(speedrun__event_id=event_id)).select_related('speedrun').prefetch_related(
+        'suggestions').order_by(*models.Bid._meta.ordering)
+    return DonationMenu(event_id, bids)
+
+
+_donation_menus = cacheutil.EventVersionedCache('bids', _build_donation_menu)
+
+
+def get_donation_menu(event):
+    """
+    Returns the donation menu for the event, rebuilding it if any of the event's bids or runs have changed
+    since it was last built in this process.
+
+    :param event: the event or its primary key
+    :type event: Event|int
+    :rtype: DonationMenu
+    """
+    return _donation_menus.get(getattr(event, 'id', event))
@@ -0,0 +1,172 @@
+from django.db import IntegrityError, transaction
+
+import tracker.models as models
+import tracker.util as util
+
+ALIAS_MAX_LENGTH = models.Donor._meta.get_field('alias').max_length
+# how many values go into a single `__in` lookup when resolving donors in bulk
+RESOLVE_CHUNK_SIZE = 500
+
+
+def find_donor_by_alias(alias):
+    """
+    Case-insensitive donor lookup by alias, using the indexed alias key.
+
+    :rtype: Donor|None
+    """
+    key = util.normalize_key(alias)
+    return models.Donor.objects.filter(aliaskey=key).first() if key else None
+
+
+def find_donor_by_email(email):
+    """
+    Case-insensitive donor lookup by email address, using the indexed email key.
+
+    :rtype: Donor|None
+    """
+    key = util.normalize_key(email)
+    return models.Donor.objects.filter(emailkey=key).first() if key else None
+
+
+def find_donor_by_paypal_email(paypalemail):
+    """
+    Case-insensitive donor lookup by PayPal email address, using the indexed PayPal email key.
+
+    :rtype: Donor|None
+    """
+    key = util.normalize_key(paypalemail)
+    return models.Donor.objects.filter(paypalemailkey=key).first() if key else None
+
+
+def get_or_create_paypal_donor(paypalemail, defaults=None):
+    """
+    Returns the donor with the given PayPal email address, creating them with `defaults` if there is none.
+
+    :return: the donor, and whether they were created
+    :rtype: tuple[Donor, bool]
+    """
+    key = util.normalize_key(paypalemail)
+    donor = models.Donor.objects.filter(paypalemailkey=key).first()
+    if donor:
+        return donor, False
+    try:
+        with transaction.atomic():
+            donor = models.Donor(paypalemail=key, **(defaults or {}))
+            donor.save()
+            return donor, True
+    except IntegrityError:
+        # someone else created the donor in the meantime (the PayPal email is unique)
+        donor = models.Donor.objects.filter(paypalemailkey=key).first()
+        if donor is None:
+            raise
+        return donor, False
+
+
+def unique_alias(requested, exclude_donor=None):
+    """
+    Returns `requested` if no other donor is using it (ignoring case), otherwise the requested alias with the
+    smallest free number appended, shortened if needed to fit. Existing aliases are fetched in a single query.
+
+    :param requested: the alias the donor asked for
+    :type requested: str
+    :param exclude_donor: the donor the alias is for, whose own alias never counts as taken
+    :type exclude_donor: Donor
+    :rtype: str
+    """
+    requested = requested.strip()
+    key = util.normalize_key(requested)
+    if not key:
+        return requested
+    prefix = key[:ALIAS_MAX_LENGTH - 4]
+    taken = models.Donor.objects.filter(aliaskey__startswith=prefix)
+    if exclude_donor is not None and exclude_donor.pk is not None:
+        taken = taken.exclude(pk=exclude_donor.pk)
+    taken = set(taken.values_list('aliaskey', flat=True))
+    if key not in taken:
+        return requested
+    # every candidate below starts with the prefix, as long as the suffix stays under five digits
+    suffix = 1
+    while True:
+        candidate = requested[:ALIAS_MAX_LENGTH - len(str(suffix))] + str(suffix)
+        if candidate.lower() not in taken:
+            return candidate
+        suffix += 1
+
+
+def _chunks(values, size=RESOLVE_CHUNK_SIZE):
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def _fetch_by_key(field, keys):
+    found = {}
+    for chunk in _chunks(keys):
+        for donor in models.Donor.objects.filter(**{field + '__in': chunk}):
+            found.setdefault(getattr(donor, field), donor)
+    return found
+
+
+def resolve_donors(records, create=True):
+    """
+    Matches a batch of donor records to existing donors, in a handful of queries no matter how many there
+    are. Each record is a dict of Donor fields; records are matched on PayPal email first, then email, then
+    alias, all ignoring case. Unmatched records become new donors, created with a single bulk insert, unless
+    `create` is off.
+
+    :param records: the donor fields of each record
+    :type records: list[dict]
+    :param create: whether to create donors for records that match nobody
+    :type create: bool
+    :return: the donor for each record, in the same order (None for records that matched nobody and were
+        not created, or that have nothing to match on)
+    :rtype: list[Donor|None]
+    """
+    records = list(records)
+    keyed = [(util.normalize_key(record.get('paypalemail')),
+              util.normalize_key(record.get('email')),
+              util.normalize_key(record.get('alias'))) for record in records]
+    by_paypalemail = _fetch_by_key('paypalemailkey', {k[0] for k in keyed if k[0]})
+    by_email = _fetch_by_key('emailkey', {k[1] for k in keyed if k[1]})
+    by_alias = _fetch_by_key('aliaskey', {k[2] for k in keyed if k[2]})
+
+    result = []
+    new_donors = []
+    for record, (paypalemail, email, alias) in zip(records, keyed):
+        donor = ((paypalemail and by_paypalemail.get(paypalemail)) or (email and by_email.get(email)) or
+                 (alias and by_alias.get(alias)) or None)
+        if donor is None and create and (paypalemail or email or alias):
+            donor = models.Donor(**record)
+            donor.clean()
+            donor.update_keys()
+            new_donors.append(donor)
+            # later records with the same identity resolve to this donor rather than creating another
+            if paypalemail:
+                by_paypalemail[paypalemail] = donor
+            if email:
+                by_email[email] = donor
+            if alias:
+                by_alias[alias] = donor
+        result.append(donor)
+
+    if new_donors:
+        # bulk_create only fills in primary keys on some backends, so fetch them back by their keys if needed
+        created = models.Donor.objects.bulk_create(new_donors, batch_size=RESOLVE_CHUNK_SIZE)
+        if any(donor.pk is None for donor in created):
+            _fill_in_primary_keys(created)
+    return result
+
+
+def _fill_in_primary_keys(donors):
+    for field in ('paypalemailkey', 'emailkey', 'aliaskey'):
+        missing = {getattr(donor, field): donor for donor in donors if donor.pk is None and getattr(donor, field)}
+        if not missing:
+            continue
+        for key, pk in _fetch_pks_by_key(field, missing.keys()):
+            if key in missing and missing[key].pk is None:
+                missing[key].pk = missing[key].id = pk
+
+
+def _fetch_pks_by_key(field, keys):
+    for chunk in _chunks(keys):
+        yield from models.Donor.objects.filter(**{field + '__in': chunk}).order_by('-pk').values_list(field, 'pk')
@@ -1,26 +1,36 @@
 import json
+import threading
+import time
 import traceback
-import urllib.request, urllib.error, urllib.parse
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 
+import requests
 from django.conf import settings
 from django.core import serializers
-from django.db.models import Sum
-
+from django.db import connection, transaction
+from django.db.models import Avg, Count, F, Max, Min, Q, Sum
+from django.utils import timezone
 
 import tracker.filters as filters
 import tracker.models as models
 import tracker.viewutil as viewutil
 
-# TODO: this is 2018, we ought to be using requests
-
+# how long a worker may hold claimed deliveries before another worker is allowed to pick them up
+POSTBACK_LEASE = timedelta(minutes=5)
+POSTBACK_RETRY_BASE = timedelta(seconds=5)
+POSTBACK_RETRY_MAX = timedelta(minutes=10)
+POSTBACK_MAX_ATTEMPTS = 10
+POSTBACK_TIMEOUT = 5
 
-def post_donation_to_postbacks(donation):
-    event_donations = filters.run_model_query('donation',
-                                              {'event': donation.event.id})
-    total = event_donations.aggregate(amount=Sum('amount'))['amount']
 
-    data = {
-		'key': settings.SECRET_KEY,
+def get_donation_postback_data(donation, total=None):
+    if total is None:
+        event_donations = filters.run_model_query('donation',
+                                                  {'event': donation.event.id})
+        total = event_donations.aggregate(amount=Sum('amount'))['amount']
+    return {
         'id': donation.id,
         'timereceived': str(donation.timereceived),
         'comment': donation.comment,
@@ -31,19 +41,195 @@ def post_donation_to_postbacks(donation):
         'domain': donation.domain
     }
 
-    # XXX: django/urllib2 throws UnicodeDecideError when payloads contain
-    # unicode codepoints:
-    #   UnicodeDecodeError: 'ascii' codec can't decode byte 0xc5 in position 292: ordinal not in range(128)
+
+def post_donation_to_postbacks(donation):
+    """
+    Queues the donation for delivery to every postback URL of its event. The queue lives in the database,
+    so when called inside a transaction nothing goes out unless it commits. Delivery itself is done by
+    `deliver_postbacks`, normally from the deliver_postbacks management command, or right away if the
+    POSTBACK_QUEUE_EAGER setting is on.
+
+    :param donation: the donation that has just been completed
+    :type donation: Donation
+    :return: the queued deliveries
+    :rtype: list[PostbackDelivery]
+    """
+    postbacks = list(models.PostbackURL.objects.filter(event=donation.event_id))
+    if not postbacks:
+        return []
+    payload = json.dumps(get_donation_postback_data(donation), ensure_ascii=False,
+                         cls=serializers.json.DjangoJSONEncoder)
+    if getattr(settings, 'POSTBACK_QUEUE_EAGER', False):
+        # saved one at a time so they have ids, to send just these from the request and not the whole queue
+        deliveries = [models.PostbackDelivery.objects.create(postback=postback, payload=payload)
+                      for postback in postbacks]
+        ids = [delivery.id for delivery in deliveries]
+        transaction.on_commit(lambda: deliver_postbacks(concurrency=1, ids=ids))
+        return deliveries
+    return models.PostbackDelivery.objects.bulk_create(
+        [models.PostbackDelivery(postback=postback, payload=payload) for postback in postbacks])
+
+
+def claim_postback_deliveries(limit=200, ids=None):
+    """
+    Marks up to `limit` due deliveries as being sent by the caller and returns them, oldest first.
+
+    :param ids: only claim among these deliveries
+    :type ids: list[int]
+    :rtype: list[PostbackDelivery]
+    """
+    now = timezone.now()
+    due = models.PostbackDelivery.objects.filter(state__in=('PENDING', 'SENDING'), nextattempt__lte=now)
+    if ids is not None:
+        due = due.filter(pk__in=ids)
+    candidates = list(due.order_by('created').values_list('id', flat=True)[:limit])
+    # a single UPDATE claims the whole batch; anything another worker got to first fails the state check
+    claim_token = now + POSTBACK_LEASE
+    due.filter(pk__in=candidates).update(state='SENDING', nextattempt=claim_token, attempts=F('attempts') + 1)
+    return list(models.PostbackDelivery.objects.filter(pk__in=candidates, state='SENDING', nextattempt=claim_token)
+                .select_related('postback').order_by('created'))
+
+
+def postback_retry_delay(attempts):
+    return min(POSTBACK_RETRY_BASE * (2 ** (attempts - 1)), POSTBACK_RETRY_MAX)
+
+
+_local = threading.local()
+
+
+def _get_session(url):
+    """
+    One keep-alive session per host and worker thread, so repeated deliveries to the same overlay reuse
+    their connection instead of paying for a new handshake every time.
+    """
+    sessions = getattr(_local, 'sessions', None)
+    if sessions is None:
+        sessions = _local.sessions = {}
+    host = urllib.parse.urlsplit(url).netloc
+    if host not in sessions:
+        sessions[host] = requests.Session()
+    return sessions[host]
+
+
+def _postback_body(payload):
+    # the key is only added on the way out, so that it is never stored along with the queued payload
+    data = json.loads(payload)
+    return json.dumps(dict(key=settings.SECRET_KEY, **data), ensure_ascii=False)
+
+
+def _send_postback_group(postback, deliveries, maxAttempts):
+    """
+    Sends the deliveries queued for a single postback URL, either one request per delivery or, if the URL
+    is set to coalesce, one request with all of them. Returns the number delivered and failed.
+    """
+    session = _get_session(postback.url)
+    if postback.coalesce and len(deliveries) > 1:
+        payload = '[' + ','.join(_postback_body(delivery.payload) for delivery in deliveries) + ']'
+        batches = [(deliveries, payload)]
+    else:
+        batches = [([delivery], _postback_body(delivery.payload)) for delivery in deliveries]
+    delivered = failed = 0
+    for batch, payload in batches:
+        started = time.time()
+        try:
+            response = session.post(postback.url, data=payload.encode('utf-8'), timeout=POSTBACK_TIMEOUT,
+                                    headers={'Content-Type': 'application/json; charset=utf-8'})
+            response.raise_for_status()
+        except Exception:
+            error = traceback.format_exc()
+            for delivery in batch:
+                _finish_delivery(delivery, error=error, maxAttempts=maxAttempts)
+            failed += len(batch)
+        else:
+            latency = (time.time() - started) * 1000
+            for delivery in batch:
+                _finish_delivery(delivery, latency=latency)
+            delivered += len(batch)
+    return delivered, failed
+
+
+def _finish_delivery(delivery, latency=None, error=None, maxAttempts=POSTBACK_MAX_ATTEMPTS):
+    now = timezone.now()
+    if error is None:
+        delivery.state = 'DELIVERED'
+        delivery.delivered = now
+        delivery.latency = latency
+        delivery.lasterror = ''
+    else:
+        delivery.lasterror = error
+        if delivery.attempts >= maxAttempts:
+            delivery.state = 'FAILED'
+            viewutil.tracker_log('postback_url', 'Giving up on delivery #{0} to {1} after {2} attempts:\n{3}'.format(
+                delivery.id, delivery.postback.url, delivery.attempts, error), event=delivery.postback.event)
+        else:
+            delivery.state = 'PENDING'
+            delivery.nextattempt = now + postback_retry_delay(delivery.attempts)
+    delivery.save(update_fields=['state', 'delivered', 'latency', 'lasterror', 'nextattempt'])
+
+
+def _send_postback_group_in_thread(postback, deliveries, maxAttempts):
     try:
-        data_json = json.dumps(
-            data, ensure_ascii=False, cls=serializers.json.DjangoJSONEncoder).encode('utf-8')
-
-        postbacks = models.PostbackURL.objects.filter(event=donation.event)
-        for postback in postbacks:
-            opener = urllib.request.build_opener()
-            req = urllib.request.Request(postback.url, data_json,
-                                  headers={'Content-Type': 'application/json; charset=utf-8'})
-            response = opener.open(req, timeout=5)
-    except Exception as e:
-        viewutil.tracker_log(
-            'postback_url', traceback.format_exc(), event=donation.event)
\ No newline at end of file
+        return _send_postback_group(postback, deliveries, maxAttempts)
+    finally:
+        connection.close()
+
+
+def deliver_postbacks(concurrency=4, batchSize=200, maxAttempts=POSTBACK_MAX_ATTEMPTS, ids=None, executor=None):
+    """
+    Sends every due postback delivery. Deliveries are grouped per postback URL and each URL is handled by
+    one of `concurrency` threads, so a slow or dead endpoint only holds up its own deliveries.
+
+    :param concurrency: number of postback URLs to deliver to in parallel
+    :type concurrency: int
+    :param batchSize: number of deliveries to claim at a time
+    :type batchSize: int
+    :param maxAttempts: give up on a delivery after this many failed attempts
+    :type maxAttempts: int
+    :param ids: only send these deliveries, if they are due
+    :type ids: list[int]
+    :param executor: the threads to deliver with, so that a worker that calls this over and over keeps its threads,
+        and their keep-alive sessions, between calls. By default threads are started for this call only.
+    :type executor: ThreadPoolExecutor
+    :return: number of deliveries delivered and failed
+    :rtype: tuple[int, int]
+    """
+    if executor is None and concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            return deliver_postbacks(concurrency, batchSize, maxAttempts, ids, executor)
+    delivered = failed = 0
+    while True:
+        claimed = claim_postback_deliveries(limit=batchSize, ids=ids)
+        if not claimed:
+            break
+        groups = {}
+        for delivery in claimed:
+            groups.setdefault(delivery.postback_id, (delivery.postback, []))[1].append(delivery)
+        if executor is not None:
+            results = list(executor.map(lambda g: _send_postback_group_in_thread(g[0], g[1], maxAttempts),
+                                        groups.values()))
+        else:
+            results = [_send_postback_group(postback, deliveries, maxAttempts)
+                       for postback, deliveries in groups.values()]
+        delivered += sum(result[0] for result in results)
+        failed += sum(result[1] for result in results)
+    return delivered, failed
+
+
+def postback_delivery_stats(postbacks=None):
+    """
+    Delivery counts and latency of successful deliveries for each postback URL.
+
+    :param postbacks: the postback URLs to report on, defaults to all of them
+    :type postbacks: QuerySet
+    :return: mapping of postback URL id to its stats
+    :rtype: dict
+    """
+    if postbacks is None:
+        postbacks = models.PostbackURL.objects.all()
+    return {p['id']: p for p in postbacks.values('id', 'url').annotate(
+        delivered=Count('deliveries', filter=Q(deliveries__state='DELIVERED')),
+        pending=Count('deliveries', filter=Q(deliveries__state__in=('PENDING', 'SENDING'))),
+        failed=Count('deliveries', filter=Q(deliveries__state='FAILED')),
+        latency_avg=Avg('deliveries__latency'),
+        latency_min=Min('deliveries__latency'),
+        latency_max=Max('deliveries__latency')).order_by()}
@@ -0,0 +1,217 @@
+"""
+Exports of whole tables (donations, donors, bid totals, prize winners and runs) as CSV or XLSX, for the export
+command and view.
+
+Rows are read with QuerySet.iterator, a chunk at a time (through a server-side cursor where the database has them),
+and written out as they are read, so the size of an export does not depend on the size of the table. The same
+filters as the search API pick the rows, and the same privacy filters hide the fields the user may not see.
+"""
+import csv
+import datetime
+from decimal import Decimal
+from itertools import islice
+
+import tracker.filters as filters
+import tracker.models as models
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+EXPORT_CHUNK_SIZE = 2000
+_DONOR_FIELDS = ['public', 'alias', 'firstname', 'lastname', 'visibility', 'email', 'paypalemail',
+                 'addressstreet', 'addresscity', 'addressstate', 'addresszip', 'addresscountry']
+
+
+def _path(path):
+    def get(obj):
+        for attr in path.split('__'):
+            if obj is None:
+                return None
+            if attr == 'public':
+                # the name the search API shows for the object
+                obj = obj.visible_name() if isinstance(obj, models.Donor) else str(obj)
+            else:
+                obj = getattr(obj, attr)
+        return obj
+    return get
+
+
+def _bid_event(bid):
+    event = bid.event or (bid.speedrun.event if bid.speedrun else None)
+    return event.short if event else None
+
+
+def _runners(runs):
+    Runners = models.SpeedRun.runners.through
+    names = {}
+    for runId, name in Runners.objects.filter(speedrun__in=runs).order_by('runner__name').values_list(
+            'speedrun_id', 'runner__name'):
+        names.setdefault(runId, []).append(name)
+    return {run.pk: {'runners': ', '.join(names.get(run.pk, []))} for run in runs}
+
+
+class Export(object):
+    """
+    What one kind of export reads, and its columns.
+
+    :ivar searchtype: the model, as the search API names it, which picks the filters that apply
+    :ivar columns: the keys of the columns, named as the search API would, with a getter for any that are not a path
+        of attributes
+    :ivar related: what to select along with each row
+    :ivar extra: called with each chunk of rows, returns more columns for each of them by pk, for what cannot be
+        selected along with the rows
+    :ivar authorization: the permission that lets a user see every field, instead of just the public ones
+    """
+
+    def __init__(self, searchtype, columns, related=(), extra=None, authorization='tracker.can_search'):
+        self.searchtype = searchtype
+        self.columns = [column if isinstance(column, tuple) else (column, _path(column)) for column in columns]
+        self.related = related
+        self.extra = extra
+        self.authorization = authorization
+
+    def authorized(self, user):
+        # the command runs without a user, and sees everything
+        return user is None or user.has_perm(self.authorization)
+
+
+EXPORTS = {
+    'donation': Export('donation', [
+        'id', 'event__short', 'timereceived', 'amount', 'currency', 'transactionstate', 'readstate', 'commentstate',
+        'comment', 'commentlanguage', 'domain', 'domainId', 'fee', 'testdonation', 'donor__id', 'donor__public',
+        'donor__alias', 'donor__firstname', 'donor__lastname', 'donor__visibility', 'donor__email',
+    ], related=('event', 'donor')),
+    'donor': Export('donor', ['id'] + _DONOR_FIELDS, related=('addresscountry',)),
+    'bid': Export('allbids', [
+        'id', ('event__short', _bid_event), 'speedrun__name', 'parent__name', 'name', 'state', 'istarget', 'goal',
+        'total', 'count',
+    ], related=('event', 'speedrun', 'speedrun__event', 'parent')),
+    'prizewinner': Export('prizewinner', [
+        'id', 'prize__id', 'prize__name', 'winner__id'] + ['winner__' + field for field in _DONOR_FIELDS] + [
+        'pendingcount', 'acceptcount', 'declinecount', 'shippingstate', 'couriername', 'trackingnumber',
+        'shippingnotes',
+    ], related=('prize', 'winner', 'winner__addresscountry'), authorization='tracker.change_prizewinner'),
+    'run': Export('run', [
+        'id', 'event__short', 'order', 'name', 'display_name', 'category', 'console', 'release_year', 'starttime',
+        'endtime', 'run_time', 'setup_time', 'runners', 'commentators',
+    ], related=('event',), extra=_runners),
+}
+
+
+def _hide_private_fields(export, fields):
+    # the same filters the search API hides fields with
+    from tracker.views import api
+    api.donor_privacy_filter(export.searchtype, fields)
+    api.donation_privacy_filter(export.searchtype, fields)
+    api.prize_privacy_filter(export.searchtype, fields)
+    api.prizewinner_privacy_filter(export.searchtype, fields)
+
+
+def export_columns(name, user=None):
+    """
+    :return: the keys of the columns of the export the user may see
+    :rtype: list[str]
+    """
+    export = EXPORTS[name]
+    keys = [key for key, get in export.columns]
+    if export.authorized(user):
+        return keys
+    fields = dict.fromkeys(keys)
+    _hide_private_fields(export, fields)
+    return [key for key in keys if key in fields]
+
+
+def _format(value):
+    if value is None:
+        return ''
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, (bool, int, float, Decimal, str)):
+        return value
+    return str(value)
+
+
+def export_rows(name, params=None, user=None, chunkSize=EXPORT_CHUNK_SIZE):
+    """
+    The rows of an export, without the header, read chunkSize rows at a time.
+
+    :param name: one of EXPORTS
+    :param params: search API parameters that pick the rows, e.g. {'event': 1}
+    :param user: the user the export is for, which decides which rows and fields it has, or None for everything
+    :return: a generator of lists, one value for each of export_columns
+    """
+    export = EXPORTS[name]
+    authorized = export.authorized(user)
+    queryset = filters.run_model_query(export.searchtype, params or {}, user=user,
+                                       mode='admin' if authorized else 'user')
+    if export.searchtype == 'donor' and not authorized:
+        # the public donor filter joins their donations
+        queryset = queryset.distinct()
+    rows = queryset.select_related(*export.related).order_by('pk').iterator(chunk_size=chunkSize)
+    columns = export_columns(name, user)
+    while True:
+        chunk = list(islice(rows, chunkSize))
+        if not chunk:
+            return
+        extra = export.extra(chunk) if export.extra else {}
+        for obj in chunk:
+            fields = {key: get(obj) for key, get in export.columns if key not in extra.get(obj.pk, {})}
+            fields.update(extra.get(obj.pk, {}))
+            if not authorized:
+                _hide_private_fields(export, fields)
+            yield [_format(fields.get(key)) for key in columns]
+
+
+class _Echo(object):
+    # csv writes each row to this, which hands it straight back
+    def write(self, value):
+        return value
+
+
+def stream_csv(name, params=None, user=None):
+    """
+    The export as CSV, a line at a time, e.g. for a StreamingHttpResponse.
+    """
+    writer = csv.writer(_Echo())
+    yield writer.writerow(export_columns(name, user))
+    for row in export_rows(name, params, user):
+        yield writer.writerow(row)
+
+
+def write_csv(name, out, params=None, user=None):
+    """
+    :param out: a text file, opened with newline=''
+    :return: the number of rows written
+    :rtype: int
+    """
+    writer = csv.writer(out)
+    writer.writerow(export_columns(name, user))
+    count = 0
+    for row in export_rows(name, params, user):
+        writer.writerow(row)
+        count += 1
+    return count
+
+
+def write_xlsx(name, out, params=None, user=None):
+    """
+    Writes the export as an XLSX workbook, which needs openpyxl.
+
+    :param out: a file name, or a binary file
+    :return: the number of rows written
+    :rtype: int
+    """
+    if openpyxl is None:
+        raise ValueError('XLSX exports need openpyxl, which is not installed')
+    # write-only workbooks keep the rows in a temporary file rather than in memory
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet(name)
+    sheet.append(export_columns(name, user))
+    count = 0
+    for row in export_rows(name, params, user):
+        sheet.append([value if isinstance(value, (bool, int, float, Decimal)) else str(value) for value in row])
+        count += 1
+    workbook.save(out)
+    return count
@@ -6,6 +6,7 @@ from django.db.models import Q, F, Sum, Value
 from django.db.models.functions import Coalesce
 
 from tracker.models import *
+import tracker.scheduleutil as scheduleutil
 
 # TODO: fix these to make more sense, it should in general only be querying top-level bids
 
@@ -450,10 +451,13 @@ _DEFAULT_RUN_DELTA = timedelta(hours=6)
 _DEFAULT_RUN_MAX = 7
 _DEFAULT_RUN_MIN = 3
 
-def get_upcomming_runs(runs=None, includeCurrent=True, maxRuns=_DEFAULT_RUN_MAX, minRuns=_DEFAULT_RUN_MIN, delta=_DEFAULT_RUN_DELTA, queryOffset=None):
+def get_upcomming_runs(runs=None, includeCurrent=True, maxRuns=_DEFAULT_RUN_MAX, minRuns=_DEFAULT_RUN_MIN, delta=_DEFAULT_RUN_DELTA, queryOffset=None, schedule=None):
   offset = default_time(queryOffset)
   if runs == None:
     runs = SpeedRun.objects.all()
+  if schedule:
+    # the timeline picks the runs, so this is a single query with no count
+    return runs.filter(id__in=schedule.runs.upcoming_runs(offset, includeCurrent, maxRuns, minRuns, delta))
   if includeCurrent:
     runs = runs.filter(endtime__gte=offset)
   else:
@@ -474,7 +478,27 @@ def get_upcomming_runs(runs=None, includeCurrent=True, maxRuns=_DEFAULT_RUN_MAX,
 def get_future_runs(**kwargs):
   return get_upcomming_runs(includeCurrent=False, **kwargs)
 
-def upcomming_bid_filter(**kwargs):
+# the event's schedule timelines, if the feed can be answered from them: they only cover a single event, given by id,
+# and for the run feeds only when the runs are not filtered by anything else
+def get_feed_schedule(model, params):
+  event = params.get('event', None)
+  if isinstance(event, Event):
+    event = event.id
+  try:
+    event = int(event)
+  except (TypeError, ValueError):
+    return None
+  if model == 'run' and any(key != 'event' and (key in _SpecificFields['run'] or key in ('q', 'id')) for key in params):
+    return None
+  schedule = scheduleutil.get_event_schedule(event)
+  return schedule if schedule.ordered else None
+
+def _schedule_runs(timeline, includeCurrent=True, maxRuns=_DEFAULT_RUN_MAX, minRuns=_DEFAULT_RUN_MIN, delta=_DEFAULT_RUN_DELTA, queryOffset=None):
+  return timeline.upcoming_runs(default_time(queryOffset), includeCurrent, maxRuns, minRuns, delta)
+
+def upcomming_bid_filter(schedule=None, **kwargs):
+  if schedule:
+    return Q(speedrun__in=_schedule_runs(schedule.bidRuns, **kwargs))
   runs = [run.id for run in get_upcomming_runs(SpeedRun.objects.filter(Q(bids__state='OPENED')).distinct(), **kwargs)]
   return Q(speedrun__in=runs)
 
@@ -490,11 +514,12 @@ def get_completed_bids(querySet, queryOffset=None):
 
 # Gets all of the current prizes that are possible right now (and also _sepcific_ to right now)
 def concurrent_prizes_filter(runs):
-  runCount = runs.count()
-  if runCount == 0:
+  times = list(runs.values_list('starttime', 'endtime'))
+  if not times:
     return Q(id=None)
-  startTime = runs[0].starttime
-  endTime = runs.reverse()[0].endtime
+  return prize_window_filter(times[0][0], times[-1][1])
+
+def prize_window_filter(startTime, endTime):
   # yes, the filter query here is correct.  We want to get all prizes unwon prizes that _start_ before the last run in the list _ends_, and likewise all prizes that _end_ after the first run in the list _starts_.
   return Q(prizewinner__isnull=True) & (Q(startrun__starttime__lte=endTime, endrun__endtime__gte=startTime) | Q(starttime__lte=endTime, endtime__gte=startTime) | Q(startrun__isnull=True, endrun__isnull=True, starttime__isnull=True, endtime__isnull=True))
 
@@ -502,7 +527,10 @@ def current_prizes_filter(queryOffset=None):
   offset = default_time(queryOffset)
   return Q(prizewinner__isnull=True) & (Q(startrun__starttime__lte=offset, endrun__endtime__gte=offset) | Q(starttime__lte=offset, endtime__gte=offset) | Q(startrun__isnull=True, endrun__isnull=True, starttime__isnull=True, endtime__isnull=True))
 
-def upcomming_prizes_filter(**kwargs):
+def upcomming_prizes_filter(schedule=None, **kwargs):
+  if schedule:
+    span = schedule.runs.span(_schedule_runs(schedule.runs, **kwargs))
+    return prize_window_filter(*span) if span else Q(id=None)
   runs = get_upcomming_runs(**kwargs)
   return concurrent_prizes_filter(runs)
 
@@ -513,6 +541,15 @@ def todraw_prizes_filter(queryOffset=None):
   offset = default_time(queryOffset)
   return Q(state='ACCEPTED') & (Q(endrun__endtime__lte=offset) | Q(endtime__lte=offset) | (Q(endtime=None) & Q(endrun=None)))
 
+def toprocess_donations_filter():
+  return (Q(commentstate='PENDING') | Q(readstate='PENDING') | Q(bidstate='FLAGGED')) & Q(transactionstate='COMPLETED')
+
+def toread_donations_filter():
+  return Q(readstate='READY') & Q(transactionstate='COMPLETED')
+
+def toconfirm_donations_filter():
+  return Q(readstate='FLAGGED') & Q(transactionstate='COMPLETED')
+
 def run_model_query(model, params={}, user=None, mode='user'):
   model = normalize_model_param(model)
 
@@ -575,9 +612,9 @@ def apply_feed_filter(query, model, feedName, params, user=None, noslice=False):
         callParams['minDonations'] = None
       query = get_recent_donations(**callParams)
     elif feedName == 'toprocess':
-      query = query.filter((Q(commentstate='PENDING') | Q(readstate='PENDING') | Q(bidstate='FLAGGED')) & Q(transactionstate='COMPLETED'))
+      query = query.filter(toprocess_donations_filter())
     elif feedName == 'toread':
-      query = query.filter(Q(readstate='READY') & Q(transactionstate='COMPLETED'))
+      query = query.filter(toread_donations_filter())
   elif model in ['bid', 'bidtarget', 'allbids']:
     if feedName == 'open':
       query = query.filter(state='OPENED')
@@ -596,6 +633,7 @@ def apply_feed_filter(query, model, feedName, params, user=None, noslice=False):
         callParams['minRuns'] = None
       if 'offset' in params:
         callParams['queryOffset'] = default_time(params['offset'])
+      callParams['schedule'] = get_feed_schedule(model, params)
       query = query.filter(state='OPENED').filter(upcomming_bid_filter(**callParams))
     elif feedName == 'future':
       callParams = {}
@@ -607,16 +645,17 @@ def apply_feed_filter(query, model, feedName, params, user=None, noslice=False):
         callParams['maxRuns'] = None
         callParams['minRuns'] = None
       if 'delta' in params:
-        callParams['delta'] = timedelta(minutes=int(toks[1]))
+        callParams['delta'] = timedelta(minutes=int(params['delta']))
       if 'offset' in params:
         callParams['queryOffset'] = default_time(params['offset'])
+      callParams['schedule'] = get_feed_schedule(model, params)
       query = query.filter(future_bid_filter(**callParams))
     elif feedName == 'completed':
       query = get_completed_bids(query)
     elif feedName == 'suggested':
       query = query.filter(suggestions__isnull=False)
   elif model == 'run':
-    callParams = { 'runs': query }
+    callParams = { 'runs': query, 'schedule': get_feed_schedule(model, params) }
     if feedName == 'current':
       if 'maxRuns' in params:
         callParams['maxRuns'] = int(params['maxRuns'])
@@ -660,6 +699,7 @@ def apply_feed_filter(query, model, feedName, params, user=None, noslice=False):
         callParams['delta'] = timedelta(minutes=int(params['delta']))
       if 'offset' in params:
         callParams['queryOffset'] = default_time(params['offset'])
+      callParams['schedule'] = get_feed_schedule(model, params)
       x = upcomming_prizes_filter(**callParams)
       query = query.filter(x)
     elif feedName == 'won':
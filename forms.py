@@ -144,7 +144,8 @@ class DonationEntryFormV2(DonationEntryForm):
 
 
 class DonationBidFormV2(forms.Form):
-    """Revamped version of the bid selection form to allow for selecting all bids at once on new donate page layout."""
+    """Revamped version of the bid selection form to allow for selecting all bids at once on new donate page layout.
+    Expects the top level bids of a donation menu, see donateutil.get_donation_menu."""
 
     def __init__(self, amount=None, bids=None, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -169,7 +170,7 @@ class DonationBidFormV2(forms.Form):
                                                               'placeholder': 'Enter New Value'}))
 
                 # Add amount fields for any bid war options.
-                for option in bid.options.all():
+                for option in bid.options_list:
                     if option.istarget:
                         self.fields['bid_amt_{}'.format(option.id)] = forms.DecimalField(
                             decimal_places=2, max_digits=20, required=False, min_value=0,
@@ -204,7 +205,7 @@ class DonationBidFormV2(forms.Form):
                         bid_total += self.cleaned_data[amt_field]
 
                     # Add amount fields for any bid war options.
-                    for option in bid.options.all():
+                    for option in bid.options_list:
                         option_amt_field = 'bid_amt_{}'.format(option.id)
                         if option.istarget and self.cleaned_data.get(option_amt_field, None):
                             bid_total += self.cleaned_data[option_amt_field]
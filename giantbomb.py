@@ -0,0 +1,231 @@
+# GiantBomb functionality for looking up game info using their API.
+#
+# Every response is kept in the GiantBombResponse table, by the cleaned game name searched for or by the GiantBomb
+# id (each game a search returns is kept by its id too), so a sync only asks the API for what it has not seen
+# lately. Runs of the same game, in any event, share one lookup, and a run with no id reuses the id of another run
+# of the same name. What is left is fetched by a small pool of threads sharing a token bucket per API resource,
+# since the quota is per resource.
+
+import json
+import logging
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
+
+import requests
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+import tracker.util as util
+from tracker.models import GiantBombResponse, SpeedRun
+
+GIANTBOMB_URL = 'https://www.giantbomb.com/api/'
+SEARCH_PATH = 'search/'
+GAME_PATH = 'game/3030-{0}/'
+FIELD_LIST = 'id,name,original_release_date,platforms'
+# the free API allows 200 requests per resource an hour
+DEFAULT_RATE = 200.0 / (60 * 60)
+RESPONSE_MAX_AGE = timedelta(days=30)
+
+_cleaningExpression = re.compile('race|all bosses|\\w+%|\\w+ %')
+
+logger = logging.getLogger(__name__)
+
+
+class GiantBombError(Exception):
+    pass
+
+
+def clean_game_name(name):
+    """
+    :return: the run name without the category information that is often part of it
+    :rtype: str
+    """
+    return ' '.join(_cleaningExpression.sub('', name).split())
+
+
+class TokenBucket(object):
+    """
+    Lets through rate calls a second on average, and up to capacity at once after a quiet spell. Shared between
+    threads, each waits its turn in the order it asked.
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Blocks until a call may be made.
+
+        :return: the number of seconds waited
+        :rtype: float
+        """
+        if not self.rate:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # taken even if it is not there yet, so later callers queue up behind this one
+            self.tokens -= 1
+            wait = max(0.0, -self.tokens / self.rate)
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+def plan_lookups(runs, ignoreId=False):
+    """
+    Decides what to look up for each run, sharing lookups between runs of the same game.
+
+    :param runs: the runs to look up
+    :type runs: list[SpeedRun]
+    :param ignoreId: search for every run by name, even those that already have an id
+    :type ignoreId: bool
+    :return: for each run id, ('game', id) or ('search', cleaned name)
+    :rtype: dict[int, tuple[str, str]]
+    """
+    knownIds = {}
+    if not ignoreId:
+        for name, giantbombId in SpeedRun.objects.filter(giantbomb_id__isnull=False).values_list(
+                'name', 'giantbomb_id'):
+            knownIds.setdefault(util.normalize_key(clean_game_name(name)), set()).add(giantbombId)
+    lookups = {}
+    for run in runs:
+        if run.giantbomb_id and not ignoreId:
+            lookups[run.pk] = ('game', str(run.giantbomb_id))
+            continue
+        key = util.normalize_key(clean_game_name(run.name)) or ''
+        ids = knownIds.get(key, ())
+        # a name that went to more than one game is searched for again
+        if len(ids) == 1:
+            lookups[run.pk] = ('game', str(next(iter(ids))))
+        else:
+            lookups[run.pk] = ('search', key)
+    return lookups
+
+
+class GiantBombClient(object):
+    """
+    :ivar requests: how many requests were made to the API
+    """
+
+    def __init__(self, apiKey, rate=DEFAULT_RATE, burst=1, concurrency=4, limit=100, maxAge=RESPONSE_MAX_AGE,
+                 url=None):
+        """
+        :param rate: requests a second allowed to each resource, or None for no limit
+        :type rate: float
+        :param burst: requests allowed to each resource at once after a quiet spell
+        :type burst: int
+        :param concurrency: number of requests made in parallel
+        :type concurrency: int
+        :param limit: the maximum number of games a search returns
+        :type limit: int
+        :param maxAge: responses cached for longer than this are fetched again
+        :type maxAge: timedelta
+        :param url: the root of the API, by default the GIANTBOMB_API_URL setting, or GiantBomb itself
+        :type url: str
+        """
+        self.apiKey = apiKey
+        self.concurrency = concurrency
+        self.limit = limit
+        self.maxAge = maxAge
+        self.url = url or getattr(settings, 'GIANTBOMB_API_URL', GIANTBOMB_URL)
+        self.buckets = {'search': TokenBucket(rate, burst), 'game': TokenBucket(rate, burst)}
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._session = threading.local()
+
+    def _request(self, lookup):
+        resource, query = lookup
+        params = {'api_key': self.apiKey, 'format': 'json', 'field_list': FIELD_LIST}
+        if resource == 'search':
+            url = self.url + SEARCH_PATH
+            params.update(query=query, resources='game', limit=self.limit)
+        else:
+            url = self.url + GAME_PATH.format(query)
+        # sessions are not safe to share between threads, but keep their connections open between requests
+        session = getattr(self._session, 'session', None)
+        if session is None:
+            session = self._session.session = requests.Session()
+            # GiantBomb refuses requests without a user agent of their own
+            session.headers['User-Agent'] = 'donation-tracker'
+        self.buckets[resource].acquire()
+        with self._lock:
+            self.requests += 1
+        r = session.get(url, params=params, timeout=30)
+        if r.status_code != 200:
+            logger.error("Error getting {0} {1!r} - status {2}".format(resource, query, r.status_code))
+            raise GiantBombError(r.status_code)
+        data = r.json()
+        if data.get('error') != 'OK':
+            logger.error("Error getting {0} {1!r} - {2}".format(resource, query, data.get('error')))
+            raise GiantBombError(data.get('error'))
+        return data['results']
+
+    def cached(self, lookups):
+        """
+        :return: the results of the lookups with a response that is recent enough
+        :rtype: dict[tuple[str, str], list|dict]
+        """
+        lookups = set(lookups)
+        if not lookups:
+            return {}
+        queries = Q()
+        for resource in {resource for resource, query in lookups}:
+            queries |= Q(resource=resource, query__in=[query for r, query in lookups if r == resource])
+        responses = GiantBombResponse.objects.filter(queries, fetched__gte=timezone.now() - self.maxAge)
+        return {(response.resource, response.query): json.loads(response.results) for response in responses
+                if (response.resource, response.query) in lookups}
+
+    def fetch(self, lookups, refresh=False):
+        """
+        Looks up each of the lookups once, from the cache where it can.
+
+        :param lookups: ('game', id) or ('search', cleaned name) pairs, as from plan_lookups
+        :type lookups: iterable[tuple[str, str]]
+        :param refresh: ask the API for every lookup, even those with a recent response
+        :type refresh: bool
+        :return: the results for each lookup, and the error for each lookup that failed
+        :rtype: (dict, dict)
+        """
+        lookups = set(lookups)
+        results = {} if refresh else self.cached(lookups)
+        errors = {}
+        missing = sorted(lookups - set(results))
+        if not missing:
+            return results, errors
+        # only the requests are made in the threads, the responses are saved here as they come in, so that what was
+        # fetched is kept if the sync is interrupted
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            futures = {executor.submit(self._request, lookup): lookup for lookup in missing}
+            for future in as_completed(futures):
+                lookup = futures[future]
+                try:
+                    results[lookup] = future.result()
+                except (GiantBombError, requests.exceptions.RequestException, ValueError) as e:
+                    errors[lookup] = e
+                    continue
+                self._save(lookup, results[lookup])
+        return results, errors
+
+    def _save(self, lookup, results):
+        responses = {lookup: results}
+        if lookup[0] == 'search':
+            # searches return the same fields as games, so the runs they find can be looked up by id later for free
+            responses.update({('game', str(game['id'])): game for game in results})
+        with transaction.atomic():
+            for resource in {resource for resource, query in responses}:
+                GiantBombResponse.objects.filter(
+                    resource=resource, query__in=[query for r, query in responses if r == resource]).delete()
+            GiantBombResponse.objects.bulk_create(
+                GiantBombResponse(resource=resource, query=query, results=json.dumps(results))
+                for (resource, query), results in responses.items())
@@ -10,6 +10,7 @@ from django.utils import dateparse
 
 from tracker.models import SpeedRun, Runner
 from tracker.models.event import TimestampField
+import tracker.util as util
 
 EVENT_URL = 'https://horaro.org/-/api/v1/events/{event_id}'
 SCHEDULES_URL = 'https://horaro.org/-/api/v1/events/{event_id}/schedules'
@@ -219,7 +220,7 @@ def merge_event_schedule(event):
             current_runners = run.runners.all()
             for runner, url in runners:
                 try:
-                    u = Runner.objects.select_for_update().filter(name__iexact=runner).get()
+                    u = Runner.objects.select_for_update().filter(namekey=util.normalize_key(runner)).get()
                 except Runner.DoesNotExist:
                     u = Runner()
 
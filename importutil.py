@@ -0,0 +1,284 @@
+import time
+from decimal import Decimal, InvalidOperation
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Avg, Count, Max, Q, Sum
+from django.utils import dateparse, timezone
+
+import tracker.donorutil as donorutil
+import tracker.models as models
+
+DONOR_FIELDS = ('email', 'alias', 'firstname', 'lastname', 'paypalemail', 'visibility')
+CURRENCIES = {code for code, name in models.Donation._meta.get_field('currency').choices}
+DOMAINS = {code for code, name in models.Donation._meta.get_field('domain').choices}
+TRANSACTION_STATES = {code for code, name in models.Donation._meta.get_field('transactionstate').choices}
+VISIBILITIES = {code for code, name in models.Donor._meta.get_field('visibility').choices}
+
+
+def parse_allocations(value):
+    """
+    Reads bid or prize ticket allocations, either as a list of `{"id": ..., "amount": ...}` objects, a mapping
+    of id to amount (JSON Lines input) or a string like `12:5.00;13:2.50` (CSV input).
+
+    :return: list of (id, amount) pairs
+    :rtype: list[tuple[int, Decimal]]
+    """
+    if not value:
+        return []
+    if isinstance(value, dict):
+        value = [{'id': key, 'amount': amount} for key, amount in value.items()]
+    if isinstance(value, str):
+        value = [dict(zip(('id', 'amount'), part.split(':', 1))) for part in value.split(';') if part.strip()]
+    result = []
+    for allocation in value:
+        try:
+            result.append((int(allocation['id']), Decimal(str(allocation['amount']).strip())))
+        except (KeyError, ValueError, TypeError, InvalidOperation):
+            raise ValidationError('Could not read allocation {0!r}, expected an id and an amount'.format(allocation))
+    return result
+
+
+class ImportRow(object):
+    def __init__(self, line, donation, donor, bids, tickets):
+        self.line = line
+        self.donation = donation
+        self.donor = donor
+        self.bids = bids
+        self.tickets = tickets
+
+
+class DonationImport(object):
+    """
+    Imports donations into an event in chunks, with a fixed number of queries per chunk rather than per row.
+
+    Rows are plain dicts, as read from a CSV file or a JSON Lines file. Each needs a `domainId`, which makes
+    the import idempotent: rows whose domainId already exists are skipped, so an interrupted import can simply
+    be run again. Rows are validated in memory with the same rules as `Donation.clean` and the bid and ticket
+    `clean` methods; invalid rows are skipped and reported in `errors`.
+
+    Nothing goes through the model save signals. Donor caches and bid totals are recomputed once, in
+    `finish`, for every donor and bid the import touched.
+
+    :ivar created: number of donations created
+    :ivar skipped: number of rows skipped because their donation already exists
+    :ivar errors: list of (line, message) pairs for the rows that failed validation
+    """
+
+    def __init__(self, event, chunkSize=500, dryRun=False):
+        self.event = event
+        self.chunkSize = chunkSize
+        self.dryRun = dryRun
+        self.created = 0
+        self.skipped = 0
+        self.errors = []
+        self.started = time.time()
+        self._seen = set()
+        self._donors = set()
+        self._bids = set()
+        self._eventBids = {bid.id: bid for bid in models.Bid.objects.filter(
+            Q(event=event) | Q(speedrun__event=event))}
+        self._prizes = {prize.id: prize for prize in models.Prize.objects.filter(event=event)}
+
+    @property
+    def processed(self):
+        return self.created + self.skipped + len(self.errors)
+
+    @property
+    def rate(self):
+        """Rows processed per second so far"""
+        elapsed = time.time() - self.started
+        return self.processed / elapsed if elapsed > 0 else 0.0
+
+    def run(self, rows, progress=None):
+        """
+        Imports every row, then recomputes the totals.
+
+        :param rows: (line number, row) pairs, read lazily so the input never has to fit in memory
+        :type rows: iterable[tuple[int, dict]]
+        :param progress: called with this import after every chunk
+        :type progress: callable
+        """
+        chunk = []
+        for line, row in rows:
+            try:
+                chunk.append(self.read_row(line, row))
+            except ValidationError as e:
+                self.errors.append((line, '; '.join(e.messages)))
+            if len(chunk) >= self.chunkSize:
+                self.import_chunk(chunk)
+                chunk = []
+                if progress:
+                    progress(self)
+        if chunk:
+            self.import_chunk(chunk)
+        self.finish()
+        if progress:
+            progress(self)
+
+    def read_row(self, line, row):
+        """
+        Validates a row in memory and turns it into unsaved model instances.
+
+        :rtype: ImportRow
+        """
+        row = {key: value.strip() if isinstance(value, str) else value for key, value in row.items()}
+        domainId = row.get('domainId')
+        if not domainId:
+            raise ValidationError('Missing domainId')
+        if domainId in self._seen:
+            raise ValidationError('domainId {0} appears more than once'.format(domainId))
+        self._seen.add(domainId)
+
+        donor = {field: row[field] for field in DONOR_FIELDS if row.get(field)}
+        if donor.get('visibility', 'ANON') not in VISIBILITIES:
+            raise ValidationError('Unknown visibility {0}'.format(donor['visibility']))
+        if donor:
+            donor.setdefault('email', '')
+            donor.setdefault('visibility', 'ALIAS' if donor.get('alias') else 'ANON')
+
+        donation = models.Donation(event=self.event, domainId=domainId, domain=row.get('domain') or 'LOCAL',
+                                   transactionstate=row.get('transactionstate') or 'COMPLETED',
+                                   currency=row.get('currency') or self.event.paypalcurrency,
+                                   comment=row.get('comment') or '', modcomment=row.get('modcomment') or '',
+                                   testdonation=str(row.get('testdonation', '')).lower() in ('1', 'true', 'yes'),
+                                   readstate='PENDING')
+        try:
+            donation.amount = Decimal(str(row.get('amount', '')))
+            donation.fee = Decimal(str(row.get('fee') or '0'))
+        except InvalidOperation:
+            raise ValidationError('Could not read amount {0!r}'.format(row.get('amount')))
+        if donation.amount <= 0:
+            raise ValidationError('Donation amount must be positive')
+        if donation.fee < 0:
+            raise ValidationError('Donation fee cannot be negative')
+        if row.get('timereceived'):
+            donation.timereceived = dateparse.parse_datetime(row['timereceived'])
+            if donation.timereceived is None:
+                raise ValidationError('Could not read time {0!r}'.format(row['timereceived']))
+            if timezone.is_naive(donation.timereceived):
+                donation.timereceived = timezone.make_aware(donation.timereceived, self.event.timezone)
+        if donation.currency not in CURRENCIES:
+            raise ValidationError('Unknown currency {0}'.format(donation.currency))
+        if donation.domain not in DOMAINS:
+            raise ValidationError('Unknown domain {0}'.format(donation.domain))
+        if donation.transactionstate not in TRANSACTION_STATES:
+            raise ValidationError('Unknown transaction state {0}'.format(donation.transactionstate))
+        if donation.comment:
+            donation.commentstate = 'PENDING'
+
+        # the same rules as Donation.clean
+        if donation.domain == 'LOCAL':
+            if not donor:
+                raise ValidationError('Local donations must have a donor')
+            donation.transactionstate = 'COMPLETED'
+        if not donor and donation.transactionstate != 'PENDING' and donation.domain != 'TILTIFY':
+            raise ValidationError('Donation must have a donor when in a non-pending state')
+
+        bids = parse_allocations(row.get('bids'))
+        for bidId, amount in bids:
+            bid = self._eventBids.get(bidId)
+            if bid is None:
+                raise ValidationError('Bid {0} is not part of {1}'.format(bidId, self.event.short))
+            if not bid.istarget:
+                raise ValidationError('Target bid must be a leaf node')
+            if amount <= 0:
+                raise ValidationError('Bid amounts must be positive')
+        bidTotal = sum((amount for bidId, amount in bids), Decimal('0'))
+        if bidTotal > donation.amount:
+            raise ValidationError('Bid total is greater than donation amount: %s > %s' % (bidTotal, donation.amount))
+
+        tickets = parse_allocations(row.get('tickets'))
+        for prizeId, amount in tickets:
+            prize = self._prizes.get(prizeId)
+            if prize is None:
+                raise ValidationError('Prize {0} is not part of {1}'.format(prizeId, self.event.short))
+            if not prize.ticketdraw:
+                raise ValidationError('Cannot assign tickets to non-ticket prize')
+            if amount <= 0:
+                raise ValidationError('Ticket amounts must be positive')
+        ticketTotal = sum((amount for prizeId, amount in tickets), Decimal('0'))
+        if ticketTotal > donation.amount:
+            raise ValidationError('Prize ticket total is greater than donation amount: %s > %s' % (ticketTotal, donation.amount))
+
+        return ImportRow(line, donation, donor or None, bids, tickets)
+
+    def import_chunk(self, chunk):
+        """Inserts a chunk of validated rows, skipping the ones that were imported before."""
+        existing = dict(models.Donation.objects.filter(
+            domainId__in=[row.donation.domainId for row in chunk]).values_list('domainId', 'donor_id'))
+        if existing:
+            # a previous run may have stopped before recomputing these, so recompute them again at the end
+            self._donors.update(donorId for donorId in existing.values() if donorId)
+            self._bids.update(models.DonationBid.objects.filter(
+                donation__domainId__in=existing.keys()).values_list('bid_id', flat=True))
+            self.skipped += len([row for row in chunk if row.donation.domainId in existing])
+            chunk = [row for row in chunk if row.donation.domainId not in existing]
+        if not chunk:
+            return
+        if self.dryRun:
+            self.created += len(chunk)
+            return
+
+        with transaction.atomic():
+            withDonor = [row for row in chunk if row.donor]
+            for row, donor in zip(withDonor, donorutil.resolve_donors([row.donor for row in withDonor])):
+                row.donation.donor = donor
+            models.Donation.objects.bulk_create([row.donation for row in chunk], batch_size=self.chunkSize)
+            # not every backend hands back primary keys from a bulk insert
+            ids = dict(models.Donation.objects.filter(
+                domainId__in=[row.donation.domainId for row in chunk]).values_list('domainId', 'id'))
+            donationBids = []
+            tickets = []
+            for row in chunk:
+                donationId = ids[row.donation.domainId]
+                donationBids += [models.DonationBid(donation_id=donationId, bid_id=bidId, amount=amount)
+                                 for bidId, amount in row.bids]
+                tickets += [models.PrizeTicket(donation_id=donationId, prize_id=prizeId, amount=amount)
+                            for prizeId, amount in row.tickets]
+                if row.donation.donor_id:
+                    self._donors.add(row.donation.donor_id)
+                self._bids.update(bidId for bidId, amount in row.bids)
+            models.DonationBid.objects.bulk_create(donationBids, batch_size=self.chunkSize)
+            models.PrizeTicket.objects.bulk_create(tickets, batch_size=self.chunkSize)
+            # so that the moderation screens pick up the new donations
+            models.DonationChange.objects.bulk_create([models.DonationChange(donation_id=donationId, event=self.event)
+                                                       for donationId in ids.values()], batch_size=self.chunkSize)
+        self.created += len(chunk)
+
+    def finish(self):
+        """Recomputes the donor caches and bid totals for everything the import touched."""
+        if self.dryRun:
+            return
+        with transaction.atomic():
+            update_donor_caches(self.event, self._donors)
+            # saving a target also saves its parents, which recomputes their totals from the target's
+            for bid in models.Bid.objects.filter(pk__in=self._bids, istarget=True):
+                bid.save()
+
+
+def update_donor_caches(event, donorIds):
+    """
+    Rebuilds the event and all-event DonorCache rows of the given donors with one aggregate query each,
+    instead of the two queries per donor per donation the save signals would take.
+
+    :param event: the event the donations belong to
+    :type event: Event
+    :param donorIds: primary keys of the donors to update
+    :type donorIds: iterable[int]
+    """
+    donorIds = list(donorIds)
+    for i in range(0, len(donorIds), donorutil.RESOLVE_CHUNK_SIZE):
+        chunk = donorIds[i:i + donorutil.RESOLVE_CHUNK_SIZE]
+        for cacheEvent in (event, None):
+            donations = models.Donation.objects.filter(donor__in=chunk, transactionstate='COMPLETED')
+            if cacheEvent:
+                donations = donations.filter(event=cacheEvent)
+            aggregates = donations.values('donor').annotate(
+                total=Sum('amount'), count=Count('amount'), max=Max('amount'), avg=Avg('amount')).order_by()
+            models.DonorCache.objects.filter(donor__in=chunk, event=cacheEvent).delete()
+            models.DonorCache.objects.bulk_create([
+                models.DonorCache(event=cacheEvent, donor_id=aggregate['donor'], donation_total=aggregate['total'],
+                                  donation_count=aggregate['count'], donation_max=aggregate['max'],
+                                  donation_avg=aggregate['avg'])
+                for aggregate in aggregates if aggregate['count']])
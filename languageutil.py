@@ -0,0 +1,111 @@
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.cache import cache
+from django.db import transaction
+
+import tracker.models as models
+from tracker.models.donation import LanguageChoices
+
+try:
+    import cld
+except ImportError:
+    import warnings
+    warnings.warn('Could not import cld, chromium_compact_language_detector not installed, language detection will not function')
+    cld = None
+
+LANGUAGE_CODES = {code for code, name in LanguageChoices}
+# detection results never go stale, since a comment hash always maps to the same language
+LANGUAGE_CACHE_TIMEOUT = 60 * 60 * 24 * 30
+
+
+def comment_cache_key(comment):
+    return 'tracker:commentlanguage:' + hashlib.sha1(comment.encode('utf-8')).hexdigest()
+
+
+def detect_language(comment):
+    """
+    Detects the language of a comment, as one of the codes in LanguageChoices.
+
+    :rtype: str
+    """
+    if not comment or not cld:
+        return 'un'
+    detectedLangName, detectedLangCode, isReliable, textBytesFound, details = cld.detect(comment.encode('utf-8'),
+                                                                                          hintLanguageCode='en')
+    return detectedLangCode if detectedLangCode in LANGUAGE_CODES else 'un'
+
+
+def detect_languages(comments, concurrency=4):
+    """
+    Detects the language of each comment, skipping any comment that has been seen before.
+
+    :param comments: the comments to detect
+    :type comments: iterable[str]
+    :param concurrency: number of comments to detect in parallel
+    :type concurrency: int
+    :return: mapping of comment to language code
+    :rtype: dict[str, str]
+    """
+    keys = {comment: comment_cache_key(comment) for comment in set(comments)}
+    cached = cache.get_many(list(keys.values()))
+    result = {comment: cached[key] for comment, key in keys.items() if key in cached}
+    missing = [comment for comment in keys if comment not in result]
+    if missing:
+        if concurrency > 1:
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                detected = list(executor.map(detect_language, missing))
+        else:
+            detected = [detect_language(comment) for comment in missing]
+        result.update(zip(missing, detected))
+        cache.set_many({keys[comment]: language for comment, language in zip(missing, detected)},
+                       LANGUAGE_CACHE_TIMEOUT)
+    return result
+
+
+def detect_comment_languages(since=0, redetect=False, concurrency=4, batchSize=500):
+    """
+    Fills in the comment language of every donation with a comment whose language is unknown and that has not been
+    looked at since it was last changed, a batch at a time. Donations are written with one UPDATE per language per
+    batch, and the rest of the batch is marked as looked at with one more.
+
+    :param since: only look at donations with a primary key above this one
+    :type since: int
+    :param redetect: detect every comment again, not just the unknown ones that have not been looked at
+    :type redetect: bool
+    :param concurrency: number of comments to detect in parallel
+    :type concurrency: int
+    :param batchSize: number of donations to load at a time
+    :type batchSize: int
+    :return: the number of donations whose language changed, and the highest primary key looked at, to pass as
+        `since` next time
+    :rtype: tuple[int, int]
+    """
+    donations = models.Donation.objects.exclude(comment='')
+    if not redetect:
+        donations = donations.filter(commentlanguage='un', commentlanguagechecked=False)
+    updated = 0
+    while True:
+        batch = list(donations.filter(pk__gt=since).order_by('pk').values_list(
+            'pk', 'event_id', 'comment', 'commentlanguage')[:batchSize])
+        if not batch:
+            break
+        languages = detect_languages((comment for pk, eventId, comment, language in batch), concurrency=concurrency)
+        changes = {}
+        unchanged = []
+        for pk, eventId, comment, language in batch:
+            if languages[comment] != language:
+                changes.setdefault(languages[comment], []).append((pk, eventId))
+            else:
+                unchanged.append(pk)
+        with transaction.atomic():
+            # comments that could not be placed are not looked at again until they change
+            models.Donation.objects.filter(pk__in=unchanged).update(commentlanguagechecked=True)
+            for language, donationsChanged in changes.items():
+                updated += models.Donation.objects.filter(pk__in=[pk for pk, eventId in donationsChanged]).update(
+                    commentlanguage=language, commentlanguagechecked=True)
+                # the moderation screens partition by language, so let them know
+                models.DonationChange.objects.bulk_create([models.DonationChange(donation_id=pk, event_id=eventId)
+                                                           for pk, eventId in donationsChanged])
+        since = batch[-1][0]
+    return updated, since
@@ -1,9 +1,97 @@
+import logging
+import threading
+
+from django.conf import settings
 from django.contrib.admin import models
 from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
 from django.utils.encoding import force_text
 from django.utils.text import get_text_list
 from django.utils.translation import ugettext as _
 
+logger = logging.getLogger(__name__)
+
+
+class LogSink(object):
+    """
+    Collects log records (tracker Logs and admin LogEntries alike) and
+    writes them with one bulk_create per model, instead of one INSERT
+    each on whatever hot path logged them.
+
+    Records logged inside a transaction are written right after it
+    commits, together, and dropped along with it if it is rolled back,
+    just as they would have been if they had been saved on the spot.
+    Records logged outside of one are written right away, since the
+    changes they describe are already saved, and nothing should be left
+    waiting in memory for a worker that may be killed.
+
+    With the LOG_SINK_EAGER setting on, every record is saved right away.
+    """
+    def __init__(self):
+        self._local = threading.local()
+
+    def add(self, record):
+        """
+        Log a record, an unsaved model instance.
+        """
+        if getattr(settings, 'LOG_SINK_EAGER', False):
+            record.save()
+            return
+        conn = transaction.get_connection()
+        if conn.in_atomic_block:
+            self._transaction_batch(conn).append(record)
+        else:
+            self.write([record])
+
+    def _transaction_batch(self, conn):
+        # one batch per transaction and savepoint, so that rolling back a
+        # savepoint drops just the records logged inside of it
+        batch = getattr(self._local, 'batch', None)
+        savepoints = set(conn.savepoint_ids)
+        if batch is None or batch['savepoints'] != savepoints or \
+                not any(func is batch['commit'] for sids, func in conn.run_on_commit):
+            records = []
+            batch = {
+                'records': records,
+                'savepoints': savepoints,
+                'commit': lambda: self.write(records),
+            }
+            transaction.on_commit(batch['commit'])
+            self._local.batch = batch
+        return batch['records']
+
+    def write(self, records):
+        """
+        Write the records. Records that cannot be written are logged with
+        the logging module instead.
+        """
+        byModel = {}
+        for record in records:
+            byModel.setdefault(type(record), []).append(record)
+        for Model, modelRecords in byModel.items():
+            try:
+                Model.objects.bulk_create(modelRecords)
+            except Exception:
+                logger.exception('Could not write %d %s record(s): %s', len(modelRecords),
+                                 Model._meta.verbose_name, [force_text(record) for record in modelRecords])
+
+
+sink = LogSink()
+
+
+def entry(user_id, object, action_flag, object_repr=None, change_message=''):
+    """
+    An unsaved LogEntry about the object.
+    """
+    return models.LogEntry(
+        user_id=user_id,
+        content_type_id=ContentType.objects.get_for_model(object).pk,
+        object_id=str(object.pk),
+        object_repr=(object_repr or force_text(object))[:200],
+        action_flag=action_flag,
+        change_message=change_message
+    )
+
 
 def get_change_message(fields):
     """
@@ -15,13 +103,7 @@ def addition(request, object):
     """
     Log that an object has been successfully added.
     """
-    models.LogEntry.objects.log_action(
-        user_id=request.user.pk,
-        content_type_id=ContentType.objects.get_for_model(object).pk,
-        object_id=object.pk,
-        object_repr=force_text(object),
-        action_flag=models.ADDITION
-    )
+    sink.add(entry(request.user.pk, object, models.ADDITION))
 
 def change(request, object, message_or_fields):
     """
@@ -34,26 +116,13 @@ def change(request, object, message_or_fields):
         message = message_or_fields
     else:
         message = get_change_message(message_or_fields)
-    models.LogEntry.objects.log_action(
-        user_id=request.user.pk,
-        content_type_id=ContentType.objects.get_for_model(object).pk,
-        object_id=object.pk,
-        object_repr=force_text(object),
-        action_flag=models.CHANGE,
-        change_message=message
-    )
+    sink.add(entry(request.user.pk, object, models.CHANGE, change_message=message))
 
 def deletion(request, object, object_repr=None):
     """
     Log that an object will be deleted.
     """
-    models.LogEntry.objects.log_action(
-        user_id=request.user.id,
-        content_type_id=ContentType.objects.get_for_model(object).pk,
-        object_id=object.pk,
-        object_repr=object_repr or force_text(object),
-        action_flag=models.DELETION
-    )
+    sink.add(entry(request.user.id, object, models.DELETION, object_repr))
 
 def in_bulk(request, added, changed, deleted):
     """
@@ -109,6 +178,57 @@ class AdminLogger(AdminLogMixin):
         self.request = request
 
 
+class BufferedAdminLogger(AdminLogger):
+    """
+    An AdminLogger that keeps the log entries until they are flushed,
+    and then writes them all with one query.
+
+    The entries logged since a savepoint can be thrown away again, for
+    when the changes they describe are rolled back.
+    """
+    def __init__(self, request):
+        super(BufferedAdminLogger, self).__init__(request)
+        self.entries = []
+
+    def _entry(self, instance, action_flag, object_repr=None, message=''):
+        return entry(self.request.user.pk, instance, action_flag, object_repr, message)
+
+    def log_addition(self, instance):
+        self.entries.append(self._entry(instance, models.ADDITION))
+
+    def log_change(self, instance, message_or_fields):
+        if isinstance(message_or_fields, str):
+            message = message_or_fields
+        else:
+            message = get_change_message(message_or_fields)
+        self.entries.append(self._entry(instance, models.CHANGE, message=message))
+
+    def log_deletion(self, instance, instance_repr=None):
+        self.entries.append(self._entry(instance, models.DELETION, instance_repr))
+
+    def logall(self, added, changed, deleted):
+        for instance in added:
+            self.log_addition(instance)
+        for instance, fields in changed:
+            if fields:
+                self.log_change(instance, fields)
+        for instance in deleted:
+            self.log_deletion(instance)
+
+    def savepoint(self):
+        return len(self.entries)
+
+    def rollback(self, savepoint):
+        del self.entries[savepoint:]
+
+    def flush(self):
+        """
+        Write the buffered entries.
+        """
+        models.LogEntry.objects.bulk_create(self.entries)
+        self.entries = []
+
+
 class AdminLogCollector(object):
     """
     A class to collect logs that will be reported later.
@@ -1,4 +1,11 @@
 import post_office
+import post_office.mail
+import post_office.models
+import post_office.utils
+from django.template import Context, Template
+
+# compiled (subject, content, html_content) of each template, by its id and when it was last changed
+_compiledTemplates = {}
 
 def get_email_template(name, default=None):
     """Get an email template, or fall back to use the default template object (if provided)"""
@@ -24,3 +31,68 @@ def get_or_create_email_template(name, default):
         default.pk = oldPk
         default.id = oldId
 
+
+
+def compile_email_template(template):
+    """
+    The subject, plain and HTML bodies of the template, compiled. Saved templates are only compiled again once they
+    are changed, so a batch of mails parses its template once.
+
+    :param template: the template, or its name
+    :type template: post_office.models.EmailTemplate|str
+    :rtype: tuple[Template]
+    """
+    if isinstance(template, str):
+        template = post_office.utils.get_email_template(template)
+    key = (template.pk, template.last_updated)
+    compiled = _compiledTemplates.get(template.pk)
+    if compiled is None or compiled[0] != key:
+        compiled = (key, tuple(Template(source) for source in (template.subject, template.content, template.html_content)))
+        if template.pk is not None:
+            # only the latest version of each template is kept
+            _compiledTemplates[template.pk] = compiled
+    return compiled[1]
+
+
+def render_email(template, context):
+    """
+    Renders the template the way post_office would, from the compiled template.
+
+    :return: the subject, message and html_message arguments for post_office.mail.send
+    :rtype: dict
+    """
+    context = Context(context or {})
+    subject, message, htmlMessage = compile_email_template(template)
+    return dict(subject=subject.render(context), message=message.render(context), html_message=htmlMessage.render(context))
+
+
+def send(template=None, context=None, **kwargs):
+    """
+    post_office.mail.send, with the template rendered from the compiled template rather than parsed again.
+    """
+    if template is None:
+        return post_office.mail.send(context=context, **kwargs)
+    return post_office.mail.send(**dict(render_email(template, context), **kwargs))
+
+
+def send_many(mails):
+    """
+    Queues the mails with a single insert, through post_office.mail.send_many, with their templates rendered from
+    the compiled templates. post_office cannot send mails with the 'now' priority in bulk, so with that as its
+    default they are sent one at a time instead.
+
+    :param mails: the arguments of post_office.mail.send for each mail
+    :type mails: list[dict]
+    """
+    rendered = []
+    for mail in mails:
+        mail = dict(mail)
+        template = mail.pop('template', None)
+        if template is not None:
+            mail.update(render_email(template, mail.pop('context', None)))
+        rendered.append(mail)
+    if post_office.utils.parse_priority(None) == post_office.models.PRIORITY.now:
+        for mail in rendered:
+            post_office.mail.send(**mail)
+    else:
+        post_office.mail.send_many(rendered)
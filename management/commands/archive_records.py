@@ -0,0 +1,39 @@
+from datetime import timedelta
+
+from django.core.management.base import CommandError
+
+import tracker.archiveutil as archiveutil
+import tracker.commandutil as commandutil
+
+
+class Command(commandutil.TrackerCommand):
+    help = 'Move old tracker logs and PayPal IPNs out of the database into compressed archive files'
+    requires_system_checks = False
+
+    def add_arguments(self, parser):
+        parser.add_argument('-p', '--policy', help='only archive this table (default: all of them)',
+                            choices=sorted(archiveutil.ARCHIVE_POLICIES.keys()), action='append')
+        parser.add_argument('-a', '--age', help='archive rows older than this many days, instead of what the policy says',
+                            type=float)
+        parser.add_argument('-d', '--directory', help='where to write the archive files (default: the ARCHIVE_DIRECTORY setting)')
+        parser.add_argument('-c', '--chunk-size', help='number of rows to write to each file, and delete at once',
+                            type=int, default=archiveutil.ARCHIVE_CHUNK_SIZE)
+        parser.add_argument('-n', '--dry-run', help='only print how many rows would be archived',
+                            action='store_true')
+
+    def handle(self, *args, **options):
+        super(Command, self).handle(*args, **options)
+        olderThan = timedelta(days=options['age']) if options['age'] is not None else None
+
+        for name in options['policy'] or sorted(archiveutil.ARCHIVE_POLICIES.keys()):
+            if options['dry_run']:
+                stats = archiveutil.archive_stats(name, olderThan)
+                self.message('Would archive {count} {0} rows, from {oldest} to {newest}'.format(name, **stats), 0)
+                continue
+            try:
+                archived = archiveutil.archive(name, olderThan, options['directory'], options['chunk_size'])
+            except ValueError as e:
+                raise CommandError(str(e))
+            self.message('Archived {0} {1} rows'.format(archived, name))
+
+        self.message("Completed.", 2)
@@ -1,21 +1,15 @@
-import sys
-import time
-import json
-import urllib.request, urllib.parse, urllib.error
-import urllib.request, urllib.error, urllib.parse
-import datetime
-import dateutil.parser
 import re
-import math
-
-from django.core.management.base import BaseCommand, CommandError
+from datetime import timedelta
 
+import dateutil.parser
 from django.conf import settings
+from django.core.management.base import CommandError
 
+import tracker.commandutil as commandutil
+import tracker.giantbomb as giantbomb
 import tracker.models as models
-import tracker.viewutil as viewutil
 import tracker.util as util
-import tracker.commandutil as commandutil
+import tracker.viewutil as viewutil
 
 _settingsKey = 'GIANTBOMB_API_KEY'
 
@@ -25,16 +19,19 @@ class Command(commandutil.TrackerCommand):
 
     def __init__(self):
         super(Command, self).__init__()
-        self.compiledCleaningExpression = re.compile('race|all bosses|\\w+%|\\w+ %')
         self.foundAmbigiousSearched = False
 
     def add_arguments(self, parser):
         parser.add_argument('-k', '--api-key', help='specify the api key to use (You can also set "{0}" in settings.py)'.format(_settingsKey), required=False, default=None)
-        parser.add_argument('-t', '--throttle-rate', help='Number of seconds to put between requests. The default (non-paid) giantbomb api throttle is supposedly 200 requests per resrouce per hour.', default=(60.0*60.0)/200.0, required=False)
+        parser.add_argument('-t', '--throttle-rate', help='Number of seconds to put between requests to each resource (searches and games), 0 for none. The default (non-paid) giantbomb api throttle is supposedly 200 requests per resource per hour.', default=(60.0*60.0)/200.0, type=float, required=False)
+        parser.add_argument('-b', '--burst', help='Number of requests to each resource that may be made at once after a quiet spell', default=1, type=int, required=False)
+        parser.add_argument('-c', '--concurrency', help='Number of requests to make in parallel', default=4, type=int, required=False)
+        parser.add_argument('-m', '--max-age', help='Number of days a cached response is used for before it is fetched again', default=giantbomb.RESPONSE_MAX_AGE.days, type=float, required=False)
+        parser.add_argument('-R', '--refresh', help='Fetch every response again, even those that are cached', action='store_true', default=False, required=False)
         selectionGroup = parser.add_mutually_exclusive_group(required=True)
         selectionGroup.add_argument('-e', '--event', help='specify an event to synchronize')
         selectionGroup.add_argument('-r', '--run', help='Specify a specific run to synchronize', type=int)
-        selectionGroup.add_argument('-a', '--all', help='Synchronizes _all_ runs in the database (warning, due to giantbomb api throttling, this may take a long, long time.', action='store_true', default=False)
+        selectionGroup.add_argument('-a', '--all', help='Synchronizes _all_ runs in the database (games already looked up for other runs, or cached, are not fetched again)', action='store_true', default=False)
         parser.add_argument('-f', '--filter', help='A regex for game names to include (uses standard python regex syntax', required=False, default=None)
         parser.add_argument('-x', '--exclude', help='A regex for game names to exclude (a common one might be ".*setup.*"). Always case-insensitive', required=False, default=None)
         idGroup = parser.add_mutually_exclusive_group(required=False)
@@ -43,18 +40,6 @@ class Command(commandutil.TrackerCommand):
         parser.add_argument('-i', '--interactive', help='Run in interactive mode. Should be used with -s to avoid redundant queries', action='store_true', default=False, required=False)
         parser.add_argument('-l', '--limit', help='Specify the maximum number of runs to return in a search query', default=100, type=int, required=False)
 
-    def clean_game_name(self, name):
-        return self.compiledCleaningExpression.sub('', name)
-
-    def build_search_url(self, name):
-        # I am assuming a match will be found within the first 50 entries, if not, just edit it yourself (I'm too lazy to do a proper paging search right now)
-        searchUrlBase = "http://www.giantbomb.com/api/search/?api_key={key}&format=json&query={game}&resources=game&field_list=name,id,original_release_date,platforms&limit={limit}"
-        return searchUrlBase.format(**dict(key=self.apiKey, game=urllib.parse.quote(name), limit=self.queryLimit))
-
-    def build_query_url(self, id):
-        queryUrlBase = "http://www.giantbomb.com/api/game/3030-{game_id}/?api_key={key}&format=json&field_list=id,name,original_release_date,platforms"
-        return queryUrlBase.format(**dict(key=self.apiKey, game_id=id))
-
     def parse_query_results(self, searchResult):
         parsedReleaseDate = None
         if searchResult['original_release_date'] != None:
@@ -71,13 +56,13 @@ class Command(commandutil.TrackerCommand):
 
         if run.name != parsed['name']:
             self.message("Setting run {0} name to {1}".format(run.name, parsed['name']), 2)
-            if self.compiledCleaningExpression.search(run.name):
+            if giantbomb.clean_game_name(run.name) != run.name:
                 self.message('Detected run name {0} (id={1}) may have category information embedded in it.'.format(run.name, run.id), 0 if self.interactive else 1)
                 if self.interactive:
                     self.message('Please set a category for this run (hit enter to leave as {0})'.format(run.category), 0)
-                    input = input(' -> ')
-                    if input != '':
-                        run.category = input
+                    answer = input(' -> ')
+                    if answer != '':
+                        run.category = answer
             run.name = parsed['name']
 
         if run.giantbomb_id != parsed['giantbomb_id']:
@@ -90,10 +75,10 @@ class Command(commandutil.TrackerCommand):
                 val = None
                 while not isinstance(val, int):
                     self.message("Enter the release year (leave blank to leave as is): ", 0)
-                    input = input(' -> ')
-                    if input == '':
+                    answer = input(' -> ')
+                    if answer == '':
                         break
-                    val = util.try_parse_int(input)
+                    val = util.try_parse_int(answer)
                 if val != None:
                     run.release_year = val
             else:
@@ -121,13 +106,13 @@ class Command(commandutil.TrackerCommand):
                     for platform in parsed['platforms']:
                         self.message("{0}) {1}".format(i, platform), 0)
                         i += 1
-                    input = input(' -> ')
-                    if input != '':
-                        val = util.try_parse_int(input)
+                    answer = input(' -> ')
+                    if answer != '':
+                        val = util.try_parse_int(answer)
                         if val != None and val >= 1 and val <= platformCount:
                             run.console = parsed['platforms'][val-1]
                         else:
-                            run.console = input
+                            run.console = answer
             elif not run.console:
                     self.message("Multiple platforms found for {0}, leaving as is for now.".format(run.name), 0)
         else:
@@ -174,11 +159,11 @@ class Command(commandutil.TrackerCommand):
                 val = None
                 while not isinstance(val, int) or (val < 1 or val > numMatches):
                     self.message("Please select a value between 1 and {0} (enter a blank line to skip)".format(numMatches), 0)
-                    input = input(' -> ')
-                    if input == '':
+                    answer = input(' -> ')
+                    if answer == '':
                         val = None
                         break
-                    val = util.try_parse_int(input)
+                    val = util.try_parse_int(answer)
                 if val != None and val >= 1 and val <= numMatches:
                     self.process_query(run, potentialMatches[val-1])
                 else:
@@ -189,23 +174,16 @@ class Command(commandutil.TrackerCommand):
         else:
             self.process_query(run, potentialMatches[0])
 
-    def response_good(self, data):
-        if data['error'] == 'OK':
-            return True
-        else:
-            self.message("Error: {0}".format(data['error']))
-            return False
-
     def handle(self, *args, **options):
         super(Command, self).handle(*args, **options)
 
         self.message(str(options),3)
 
-        self.apiKey = options['api_key']
+        apiKey = options['api_key']
         if options['api_key'] == None:
-            self.apiKey = getattr(settings, _settingsKey, None)
+            apiKey = getattr(settings, _settingsKey, None)
 
-        if not self.apiKey:
+        if not apiKey:
             raise CommandError("No API key was supplied, and {0} was not set in settings.py, cannot continue.".format(_settingsKey))
 
         filterRegex = None
@@ -222,63 +200,51 @@ class Command(commandutil.TrackerCommand):
             try:
                 event = viewutil.get_event(options['event'])
             except:
-                CommandError("Error, event {0} does not exist".format(options['event']))
+                raise CommandError("Error, event {0} does not exist".format(options['event']))
             runlist = runlist.filter(event=event)
         elif options['run'] != None:
             runlist = runlist.filter(id=int(options['run']))
 
-        self.queryLimit = options['limit']
-        throttleFloat = float(options['throttle_rate'])
-        throttleSeconds = int(options['throttle_rate'])
-        throttleMicroseconds = int((throttleFloat - math.floor(throttleFloat))*(10**9))
-        throttleRate = datetime.timedelta(seconds=throttleSeconds, microseconds=throttleMicroseconds)
         self.ignoreId = options['ignore_id']
         self.interactive = options['interactive']
         self.skipWithId = options['skip_with_id']
 
-        lastApiCallTime = datetime.datetime.min
-
-        for run in runlist:
-            if (not filterRegex or filterRegex.match(run.name)) and (not excludeRegex or not excludeRegex.match(run.name)):
-                nextAPICallTime = lastApiCallTime + throttleRate
-                if nextAPICallTime > datetime.datetime.now():
-                    waitDelta = nextAPICallTime - datetime.datetime.now()
-                    waitTime = max(0.0, (waitDelta.seconds + waitDelta.microseconds/(10.0**9)))
-                    self.message("Wait {0} seconds for next url call".format(waitTime), 2)
-                    time.sleep(waitTime)
-                throttleNext = True
-                if run.giantbomb_id and not self.ignoreId:
-                    if not self.skipWithId:
-                        self.message("Querying id {0} for {1}".format(run.giantbomb_id, run))
-                        queryUrl = self.build_query_url(run.giantbomb_id)
-                        self.message("(url={0})".format(queryUrl), 2)
-                        data = json.loads(urllib.request.urlopen(queryUrl).read())
-                        lastApiCallTime = datetime.datetime.now()
-
-                        if self.response_good(data):
-                            self.process_query(run, data['results'])
-                    else:
-                        self.message("Skipping run {0} with giantbomb id {1}".format(run.name, run.giantbomb_id))
-                else:
-                    cleanedName = self.clean_game_name(run.name)
-                    searchUrl = self.build_search_url(cleanedName)
-                    if cleanedName != run.name:
-                        self.message("Cleaned {0} => {1}".format(run.name, cleanedName), 2)
-                    if self.ignoreId:
-                        self.message("Overriding giantbomb_id {0} for {1}".format(run.giantbomb_id, cleanedName))
-                    self.message("Searching for {0}".format(cleanedName))
-                    self.message("(url={0})".format(searchUrl), 2)
-                    data = json.loads(urllib.request.urlopen(searchUrl).read())
-                    lastApiCallTime = datetime.datetime.now()
-
-                    if self.response_good(data):
-                        self.process_search(run, cleanedName, data['results'])
-            else:
+        runs = []
+        for run in runlist.select_related('event'):
+            if (filterRegex and not filterRegex.match(run.name)) or (excludeRegex and excludeRegex.match(run.name)):
                 self.message('Run {0} does not match filters.'.format(run.name), 2)
+            elif run.giantbomb_id and self.skipWithId and not self.ignoreId:
+                self.message("Skipping run {0} with giantbomb id {1}".format(run.name, run.giantbomb_id))
+            else:
+                runs.append(run)
+
+        throttleRate = options['throttle_rate']
+        client = giantbomb.GiantBombClient(apiKey, rate=1.0 / throttleRate if throttleRate > 0 else None,
+                                           burst=options['burst'], concurrency=options['concurrency'],
+                                           limit=options['limit'], maxAge=timedelta(days=options['max_age']))
+        lookups = giantbomb.plan_lookups(runs, ignoreId=self.ignoreId)
+        self.message("Looking up {0} runs, {1} different games".format(len(runs), len(set(lookups.values()))))
+        results, errors = client.fetch(lookups.values(), refresh=options['refresh'])
+        self.message("Made {0} requests to the GiantBomb API".format(client.requests))
+
+        for run in runs:
+            resource, query = lookups[run.pk]
+            if (resource, query) in errors:
+                self.message("Error: {0} for {1}".format(errors[(resource, query)], run))
+            elif resource == 'game':
+                if run.giantbomb_id != int(query):
+                    self.message("Using giantbomb_id {0} for {1}".format(query, run))
+                self.process_query(run, results[(resource, query)])
+            else:
+                cleanedName = giantbomb.clean_game_name(run.name)
+                if cleanedName != run.name:
+                    self.message("Cleaned {0} => {1}".format(run.name, cleanedName), 2)
+                if self.ignoreId and run.giantbomb_id:
+                    self.message("Overriding giantbomb_id {0} for {1}".format(run.giantbomb_id, cleanedName))
+                self.process_search(run, cleanedName, results[(resource, query)])
 
         if self.foundAmbigiousSearched:
             self.message("\nOne or more objects could not be synced due to ambiguous run names. Re-run the command with options -is to resolve these interactively")
-            self.message("(be sure to also set --throttle-rate=0 to preserve your sanity!)")
+            self.message("(the searches are cached, so this will not query the API again)")
 
         self.message("\nDone.")
-
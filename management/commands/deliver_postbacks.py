@@ -0,0 +1,59 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import tracker.commandutil as commandutil
+import tracker.eventutil as eventutil
+
+
+class Command(commandutil.TrackerCommand):
+    help = 'Send queued donation postbacks to their postback URLs'
+    requires_system_checks = False
+
+    def add_arguments(self, parser):
+        parser.add_argument('-c', '--concurrency', help='number of postback URLs to deliver to in parallel',
+                            type=int, default=4)
+        parser.add_argument('-b', '--batch-size', help='number of deliveries to claim from the queue at a time',
+                            type=int, default=200)
+        parser.add_argument('-m', '--max-attempts', help='give up on a delivery after this many failed attempts',
+                            type=int, default=eventutil.POSTBACK_MAX_ATTEMPTS)
+        parser.add_argument('-l', '--loop', help='keep polling the queue instead of exiting once it is empty',
+                            action='store_true')
+        parser.add_argument('-i', '--interval', help='seconds to wait between polls when looping',
+                            type=float, default=0.5)
+        parser.add_argument('-s', '--stats', help='only print delivery stats for each postback URL, then exit',
+                            action='store_true')
+
+    def print_stats(self, verbosity_level=1):
+        for stats in eventutil.postback_delivery_stats().values():
+            line = '{url}: {delivered} delivered, {pending} pending, {failed} failed'.format(**stats)
+            if stats['latency_avg'] is not None:
+                line += ', latency avg {latency_avg:.0f}ms min {latency_min:.0f}ms max {latency_max:.0f}ms'.format(**stats)
+            self.message(line, verbosity_level)
+
+    def handle(self, *args, **options):
+        super(Command, self).handle(*args, **options)
+
+        if options['stats']:
+            self.print_stats(0)
+            return
+
+        # one set of threads for the life of the worker, so their sessions keep their connections open between polls
+        executor = ThreadPoolExecutor(max_workers=options['concurrency']) if options['concurrency'] > 1 else None
+        try:
+            while True:
+                started = time.time()
+                delivered, failed = eventutil.deliver_postbacks(concurrency=options['concurrency'],
+                                                                batchSize=options['batch_size'],
+                                                                maxAttempts=options['max_attempts'],
+                                                                executor=executor)
+                if delivered or failed:
+                    self.message('Delivered {0} postbacks, {1} failed, in {2:.2f}s'.format(delivered, failed, time.time() - started))
+                    self.print_stats(2)
+                if not options['loop']:
+                    break
+                time.sleep(options['interval'])
+        finally:
+            if executor:
+                executor.shutdown()
+
+        self.message("Completed.", 2)
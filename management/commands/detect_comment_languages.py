@@ -0,0 +1,45 @@
+import time
+
+import tracker.commandutil as commandutil
+import tracker.languageutil as languageutil
+
+
+class Command(commandutil.TrackerCommand):
+    help = 'Detect the language of donation comments whose language is not known yet'
+    requires_system_checks = False
+
+    def add_arguments(self, parser):
+        parser.add_argument('-c', '--concurrency', help='number of comments to detect in parallel', type=int,
+                            default=4)
+        parser.add_argument('-b', '--batch-size', help='number of donations to load at a time', type=int,
+                            default=500)
+        parser.add_argument('-r', '--redetect', help='detect every comment again, not just the unknown ones',
+                            action='store_true')
+        parser.add_argument('-l', '--loop', help='keep watching for new donations instead of exiting',
+                            action='store_true')
+        parser.add_argument('-i', '--interval', help='seconds to wait between passes when looping', type=float,
+                            default=5)
+
+    def handle(self, *args, **options):
+        super(Command, self).handle(*args, **options)
+
+        if not languageutil.cld:
+            self.message('cld is not installed, every comment will be marked as unknown', 0)
+
+        redetect = options['redetect']
+        while True:
+            started = time.time()
+            # every pass starts from the beginning, since donations that commit late, or whose comment is added
+            # later, can have a lower id than ones already looked at. Only the unknown comments that have not been
+            # looked at since they last changed are read, so a pass with nothing new reads nothing.
+            updated = languageutil.detect_comment_languages(redetect=redetect, concurrency=options['concurrency'],
+                                                            batchSize=options['batch_size'])[0]
+            if updated:
+                self.message('Detected the language of {0} comments in {1:.2f}s'.format(updated, time.time() - started))
+            if not options['loop']:
+                break
+            # after the first pass, only unknown languages need looking at
+            redetect = False
+            time.sleep(options['interval'])
+
+        self.message("Completed.", 2)
@@ -0,0 +1,49 @@
+import sys
+
+from django.core.management.base import CommandError
+
+import tracker.commandutil as commandutil
+import tracker.exportutil as exportutil
+import tracker.viewutil as viewutil
+
+
+class Command(commandutil.TrackerCommand):
+    help = 'Export donations, donors, bid totals, prize winners or runs as CSV or XLSX'
+    requires_system_checks = False
+
+    def add_arguments(self, parser):
+        parser.add_argument('type', help='what to export', choices=sorted(exportutil.EXPORTS.keys()))
+        parser.add_argument('-e', '--event', help='only export the rows of this event', type=viewutil.get_event)
+        parser.add_argument('-o', '--output', help='file to write to (default: CSV to standard output)')
+        parser.add_argument('-f', '--format', help='file format (default: from the output file name, otherwise CSV)',
+                            choices=['csv', 'xlsx'])
+        parser.add_argument('-p', '--param', help='search parameter to pick the rows with, as name=value, e.g. state=OPENED',
+                            action='append', default=[])
+
+    def handle(self, *args, **options):
+        super(Command, self).handle(*args, **options)
+        params = {}
+        for param in options['param']:
+            name, sep, value = param.partition('=')
+            if not sep:
+                raise CommandError('Expected name=value, got {0}'.format(param))
+            params[name] = value
+        if options['event']:
+            params['event'] = options['event'].id
+
+        output = options['output']
+        exportFormat = options['format'] or ('xlsx' if output and output.endswith('.xlsx') else 'csv')
+        try:
+            if exportFormat == 'xlsx':
+                if not output:
+                    raise CommandError('XLSX exports need an output file')
+                count = exportutil.write_xlsx(options['type'], output, params)
+            elif output:
+                with open(output, 'w', newline='', encoding='utf-8') as out:
+                    count = exportutil.write_csv(options['type'], out, params)
+            else:
+                count = exportutil.write_csv(options['type'], sys.stdout, params)
+        except ValueError as e:
+            raise CommandError(str(e))
+        if output:
+            self.message('Exported {0} rows to {1}'.format(count, output))
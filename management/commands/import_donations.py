@@ -0,0 +1,66 @@
+import csv
+import json
+import os
+
+from django.core.management.base import CommandError
+
+import tracker.commandutil as commandutil
+import tracker.importutil as importutil
+import tracker.viewutil as viewutil
+
+
+def read_csv(file):
+    # the header is line 1, so the first donation is on line 2
+    for line, row in enumerate(csv.DictReader(file), start=2):
+        yield line, row
+
+
+def read_json_lines(file):
+    for line, text in enumerate(file, start=1):
+        if not text.strip():
+            continue
+        try:
+            row = json.loads(text)
+        except ValueError as e:
+            raise CommandError('Line {0} is not valid JSON: {1}'.format(line, e))
+        yield line, row
+
+
+class Command(commandutil.TrackerCommand):
+    help = 'Import donations from a CSV or JSON Lines file, skipping any whose domainId already exists'
+    requires_system_checks = False
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', help='the file to import, with one donation per row or line')
+        parser.add_argument('-e', '--event', help='the event to import the donations into', type=viewutil.get_event,
+                            required=True)
+        parser.add_argument('-f', '--format', help='the format of the file, guessed from its extension by default',
+                            choices=('csv', 'jsonl'))
+        parser.add_argument('-b', '--batch-size', help='number of donations to insert at a time', type=int,
+                            default=500)
+        parser.add_argument('-d', '--dry-run', help='validate the file without importing anything',
+                            action='store_true')
+
+    def progress(self, donationImport):
+        self.message('{0} rows: {1} imported, {2} already present, {3} invalid ({4:.0f} rows/s)'.format(
+            donationImport.processed, donationImport.created, donationImport.skipped, len(donationImport.errors),
+            donationImport.rate))
+
+    def handle(self, *args, **options):
+        super(Command, self).handle(*args, **options)
+
+        fileFormat = options['format']
+        if not fileFormat:
+            fileFormat = 'csv' if os.path.splitext(options['file'])[1].lower() == '.csv' else 'jsonl'
+        reader = read_csv if fileFormat == 'csv' else read_json_lines
+
+        donationImport = importutil.DonationImport(options['event'], chunkSize=options['batch_size'],
+                                                   dryRun=options['dry_run'])
+        with open(options['file'], newline='', encoding='utf-8') as file:
+            donationImport.run(reader(file), progress=self.progress)
+
+        for line, error in donationImport.errors:
+            self.message('Line {0}: {1}'.format(line, error), 0)
+        if options['dry_run']:
+            self.message('Dry run, nothing was imported.')
+        self.message("Completed.", 2)
@@ -0,0 +1,48 @@
+import time
+
+import tracker.commandutil as commandutil
+import tracker.paypalutil as paypalutil
+
+
+class Command(commandutil.TrackerCommand):
+    help = 'Process PayPal IPNs stored by the IPN endpoint'
+    requires_system_checks = False
+
+    def add_arguments(self, parser):
+        parser.add_argument('-c', '--concurrency', help='number of transactions to process in parallel',
+                            type=int, default=1)
+        parser.add_argument('-b', '--batch-size', help='number of IPNs to claim from the queue at a time',
+                            type=int, default=50)
+        parser.add_argument('-m', '--max-attempts', help='give up on an IPN after this many failed attempts',
+                            type=int, default=paypalutil.IPN_QUEUE_MAX_ATTEMPTS)
+        parser.add_argument('-l', '--loop', help='keep polling the queue instead of exiting once it is empty',
+                            action='store_true')
+        parser.add_argument('-i', '--interval', help='seconds to wait between polls when looping',
+                            type=float, default=2.0)
+        parser.add_argument('-s', '--stats', help='only print the queue depth and lag, then exit',
+                            action='store_true')
+
+    def print_stats(self, verbosity_level=1):
+        stats = paypalutil.ipn_queue_stats()
+        self.message('Queue depth {depth} ({PENDING} pending, {PROCESSING} processing), {FAILED} failed, lag {lag:.1f}s'.format(**stats), verbosity_level)
+
+    def handle(self, *args, **options):
+        super(Command, self).handle(*args, **options)
+
+        if options['stats']:
+            self.print_stats(0)
+            return
+
+        while True:
+            started = time.time()
+            succeeded, failed = paypalutil.drain_ipn_queue(concurrency=options['concurrency'],
+                                                           batchSize=options['batch_size'],
+                                                           maxAttempts=options['max_attempts'])
+            if succeeded or failed:
+                self.message('Processed {0} IPNs, {1} failed, in {2:.2f}s'.format(succeeded, failed, time.time() - started))
+                self.print_stats(2)
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+        self.message("Completed.", 2)
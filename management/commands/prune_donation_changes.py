@@ -0,0 +1,19 @@
+from datetime import timedelta
+
+import tracker.commandutil as commandutil
+import tracker.moderationutil as moderationutil
+
+
+class Command(commandutil.TrackerCommand):
+    help = 'Delete old entries from the donation change log that the moderation screens read from'
+    requires_system_checks = False
+
+    def add_arguments(self, parser):
+        parser.add_argument('-a', '--age', help='delete entries older than this many hours', type=float,
+                            default=moderationutil.DONATION_CHANGE_RETENTION.total_seconds() / 3600)
+
+    def handle(self, *args, **options):
+        super(Command, self).handle(*args, **options)
+        deleted = moderationutil.prune_donation_changes(timedelta(hours=options['age']))
+        self.message('Deleted {0} donation changes'.format(deleted))
+        self.message("Completed.", 2)
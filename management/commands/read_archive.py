@@ -0,0 +1,51 @@
+import json
+
+from django.core import serializers
+from django.core.management.base import CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.dateparse import parse_datetime
+
+import tracker.archiveutil as archiveutil
+import tracker.commandutil as commandutil
+
+
+class Command(commandutil.TrackerCommand):
+    help = 'Print archived tracker logs or PayPal IPNs as JSON lines'
+    requires_system_checks = False
+
+    def add_arguments(self, parser):
+        parser.add_argument('policy', help='which table to read the archive of',
+                            choices=sorted(archiveutil.ARCHIVE_POLICIES.keys()))
+        parser.add_argument('-d', '--directory', help='where the archive files are (default: the ARCHIVE_DIRECTORY setting)')
+        parser.add_argument('-s', '--since', help='only rows at or after this time (ISO 8601, with a time zone)')
+        parser.add_argument('-u', '--until', help='only rows before this time (ISO 8601, with a time zone)')
+        parser.add_argument('-f', '--field', help='only rows with this value, as name=value, e.g. category=paypal or event=3',
+                            action='append', default=[])
+
+    def parse_time(self, value):
+        if value is None:
+            return None
+        time = parse_datetime(value)
+        if time is None or time.tzinfo is None:
+            raise CommandError('Not a time with a time zone: {0}'.format(value))
+        return time
+
+    def handle(self, *args, **options):
+        super(Command, self).handle(*args, **options)
+        fields = {}
+        for field in options['field']:
+            name, sep, value = field.partition('=')
+            if not sep:
+                raise CommandError('Expected name=value, got {0}'.format(field))
+            # ids are stored as numbers
+            fields[name] = int(value) if value.isdigit() else value
+
+        try:
+            rows = archiveutil.read_archive(options['policy'], options['directory'],
+                                            self.parse_time(options['since']), self.parse_time(options['until']),
+                                            **fields)
+            for row in rows:
+                self.stdout.write(json.dumps(serializers.serialize('python', [row])[0],
+                                             cls=DjangoJSONEncoder, ensure_ascii=False))
+        except ValueError as e:
+            raise CommandError(str(e))
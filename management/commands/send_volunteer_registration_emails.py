@@ -19,6 +19,9 @@ class Command(commandutil.TrackerCommand):
         parser.add_argument('-t', '--template', help="Email template to use", required=True)
         parser.add_argument('-l', '--volunteers-list', help="CSV file with the volunteer information, must have columns 'name', 'username', 'email', and 'position'", required=True)
         parser.add_argument('-e', '--event', help="The event to use", required=True, type=viewutil.get_event)
+        parser.add_argument('-b', '--batch-size', help="Number of volunteers to save and mail at a time", type=int, default=volunteer.VOLUNTEER_BATCH_SIZE)
+        parser.add_argument('-c', '--checkpoint', help="File to record progress in, and resume from if a previous run stopped partway (default: the volunteers list with .checkpoint appended)")
+        parser.add_argument('-r', '--restart', help="Ignore any progress recorded by a previous run and start from the top of the list", action='store_true', default=False)
  
     def handle(self, *args, **options):
         super(Command, self).handle(*args, **options)
@@ -31,7 +34,16 @@ class Command(commandutil.TrackerCommand):
         sender = options['sender']
         event = options['event']
         
-        volunteers = volunteer.parse_volunteer_info_file(volunteersFile)
-        
-        volunteer.send_volunteer_mail(settings.DOMAIN, event, volunteers, template, sender, verbosity=self.verbosity, dry_run=dryRun)
+        checkpoint = volunteer.VolunteerCheckpoint(options['checkpoint'] or volunteersFile + '.checkpoint', event)
+        if options['restart']:
+            checkpoint.clear()
+            checkpoint = volunteer.VolunteerCheckpoint(checkpoint.path, event)
+
+        volunteers = volunteer.iter_volunteer_info_file(volunteersFile)
+
+        try:
+            volunteer.send_volunteer_mail(settings.DOMAIN, event, volunteers, template, sender, verbosity=self.verbosity, dry_run=dryRun,
+                                          batchSize=options['batch_size'], checkpoint=checkpoint)
+        except ValueError as e:
+            raise CommandError('{0}, use --restart to start over'.format(e))
 
@@ -0,0 +1,208 @@
+"""
+Merging duplicate donors and bids into one.
+
+Every table that references the merged model is found from the model meta, and its rows are re-pointed with a
+single UPDATE per table, rather than by saving each row. Rows that would then collide on a unique constraint
+(the same donation bidding on two bids that are merged, say) are folded into the row they collide with first.
+Cached aggregates are rebuilt once at the end.
+
+A merge is planned before it is run, so the plan can be shown to whoever asked for it first.
+"""
+from django.db import transaction
+from django.db.models import F
+
+import tracker.cacheutil as cacheutil
+import tracker.importutil as importutil
+import tracker.models as models
+
+# fields that are added together when two rows collide, the rest of the row that is kept wins
+MERGE_SUMMED_FIELDS = {
+    models.DonationBid: ('amount',),
+    models.PrizeWinner: ('pendingcount', 'acceptcount', 'declinecount', 'sumcount'),
+    models.DonorPrizeEntry: ('weight',),
+}
+# tables of cached aggregates, which are rebuilt after the merge instead of merged
+MERGE_REBUILT = (models.DonorCache,)
+
+
+class MergeReference(object):
+    """
+    The rows of one table that point at the objects being merged away.
+
+    :ivar model: the referencing model
+    :ivar field: the foreign key field on it
+    :ivar count: how many of its rows point at the merged objects
+    :ivar duplicates: for each row that collides with another once re-pointed, (its pk, the pk of the row that
+        is kept instead)
+    """
+
+    def __init__(self, model, field, count, duplicates=()):
+        self.model = model
+        self.field = field
+        self.count = count
+        self.duplicates = list(duplicates)
+
+    @property
+    def rebuilt(self):
+        return self.model in MERGE_REBUILT
+
+    @property
+    def summed(self):
+        return MERGE_SUMMED_FIELDS.get(self.model, ())
+
+    def describe(self):
+        name = self.model._meta.verbose_name_plural
+        if self.rebuilt:
+            return 'Rebuild {0} {1}'.format(self.count, name)
+        description = 'Move {0} {1} ({2})'.format(self.count, name, self.field.verbose_name)
+        if self.duplicates:
+            if self.summed:
+                action = 'adding up their {0}'.format(', '.join(self.summed))
+            elif self.field.null:
+                action = 'clearing their {0}'.format(self.field.verbose_name)
+            else:
+                action = 'deleting them'
+            description += ', {0} of which are duplicates, {1}'.format(len(self.duplicates), action)
+        return description
+
+
+def _unique_sets(field):
+    """
+    :return: for each unique constraint the field is part of, the other fields in it
+    :rtype: list[tuple[Field]]
+    """
+    model = field.model
+    sets = [()] if field.unique else []
+    for together in model._meta.unique_together:
+        if field.name in together:
+            sets.append(tuple(model._meta.get_field(name) for name in together if name != field.name))
+    return sets
+
+
+def references(Model):
+    """
+    :return: every foreign key pointing at the model, including those of the tables behind many to many fields
+    :rtype: list[Field]
+    """
+    return [rel.field for rel in Model._meta.get_fields(include_hidden=True)
+            if rel.auto_created and not rel.concrete and (rel.one_to_many or rel.one_to_one)]
+
+
+def _find_duplicates(field, root, otherIds):
+    duplicates = []
+    for others in _unique_sets(field):
+        rows = field.model.objects.filter(**{field.name + '__in': [root.pk] + otherIds}).order_by('pk').values_list(
+            'pk', field.attname, *[other.attname for other in others])
+        kept = {}
+        for row in sorted(rows, key=lambda row: (row[1] != root.pk, row[0])):
+            key = row[2:]
+            if None in key:
+                # null values never collide
+                continue
+            if key in kept:
+                duplicates.append((row[0], kept[key]))
+            else:
+                kept[key] = row[0]
+    return duplicates
+
+
+class MergePlan(object):
+    """
+    What merging the objects into the root would do. Nothing is changed until it is executed.
+    """
+
+    def __init__(self, root, others):
+        self.Model = type(root)
+        self.root = root
+        self.others = [other for other in others if other.pk != root.pk]
+        otherIds = [other.pk for other in self.others]
+        self.references = []
+        for field in references(self.Model):
+            if not otherIds:
+                break
+            count = field.model.objects.filter(**{field.name + '__in': otherIds}).count()
+            if count:
+                duplicates = [] if field.model in MERGE_REBUILT else _find_duplicates(field, root, otherIds)
+                self.references.append(MergeReference(field.model, field, count, duplicates))
+        if self.Model == models.Bid and any(reference.field.name == 'parent' for reference in self.references):
+            raise ValueError('Bids with options cannot be merged, merge their options instead')
+
+    def describe(self):
+        """
+        :return: a line for each thing the merge does
+        :rtype: list[str]
+        """
+        lines = [reference.describe() for reference in self.references]
+        if self.others:
+            lines.append('Delete {0} {1}: {2}'.format(
+                len(self.others), self.Model._meta.verbose_name_plural, ', '.join(str(other) for other in self.others)))
+        return lines
+
+    def _fold_duplicates(self, reference):
+        kept = {}
+        for duplicate, keeper in reference.duplicates:
+            kept.setdefault(keeper, []).append(duplicate)
+        if reference.summed:
+            values = {row[0]: row[1:] for row in reference.model.objects.filter(
+                pk__in=[duplicate for duplicate, keeper in reference.duplicates]).values_list('pk', *reference.summed)}
+            for keeper, duplicates in kept.items():
+                reference.model.objects.filter(pk=keeper).update(**{
+                    field: F(field) + sum(values[duplicate][i] for duplicate in duplicates)
+                    for i, field in enumerate(reference.summed)})
+        duplicateIds = [duplicate for duplicate, keeper in reference.duplicates]
+        if reference.field.null and not reference.summed:
+            reference.model.objects.filter(pk__in=duplicateIds).update(**{reference.field.name: None})
+        else:
+            reference.model.objects.filter(pk__in=duplicateIds).delete()
+
+    @transaction.atomic
+    def execute(self):
+        """
+        :return: the root, with everything of the merged objects now pointing at it
+        """
+        otherIds = [other.pk for other in self.others]
+        movedDonations = []
+        for reference in self.references:
+            rows = reference.model.objects.filter(**{reference.field.name + '__in': otherIds})
+            if reference.rebuilt:
+                rows.delete()
+                continue
+            self._fold_duplicates(reference)
+            if reference.model == models.Donation:
+                movedDonations = list(rows.values_list('id', 'event_id'))
+            rows.update(**{reference.field.name: self.root})
+        if movedDonations:
+            # the donor is part of what the moderation screens show
+            models.DonationChange.objects.bulk_create(
+                models.DonationChange(donation_id=donationId, event_id=eventId)
+                for donationId, eventId in movedDonations)
+
+        parentIds = {getattr(other, 'parent_id', None) for other in self.others} - {None}
+        for other in self.others:
+            other.delete()
+        if self.Model == models.Donor:
+            self._rebuild_donor()
+        else:
+            self.root.save()
+        if self.Model == models.Bid:
+            # the bids that lost an option add up what is left
+            for parent in models.Bid.objects.filter(pk__in=parentIds):
+                parent.save()
+        return self.root
+
+    def _rebuild_donor(self):
+        eventIds = set(models.Donation.objects.filter(donor=self.root).values_list('event_id', flat=True))
+        for event in models.Event.objects.filter(pk__in=eventIds):
+            importutil.update_donor_caches(event, [self.root.pk])
+            cacheutil.bump_version('api', event.pk)
+            cacheutil.bump_version('prizes', event.pk)
+        self.root.save()
+
+
+def plan_merge(root, others):
+    """
+    :param root: the object the others are merged into
+    :param others: the objects to merge away, the root is skipped if it is among them
+    :rtype: MergePlan
+    """
+    return MergePlan(root, others)
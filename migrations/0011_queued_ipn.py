@@ -0,0 +1,43 @@
+# Generated by Django 2.1.8 on 2026-10-19 09:37
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ipn', '0008_auto_20181128_1032'),
+        ('tracker', '0010_uk_address_form'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueuedIPN',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('state', models.CharField(choices=[('PENDING', 'Pending'), ('PROCESSING', 'Processing'), ('DONE', 'Done'), ('DUPLICATE', 'Duplicate'), ('FAILED', 'Failed')], default='PENDING', max_length=16, verbose_name='State')),
+                ('body', models.TextField(blank=True, verbose_name='Raw Body')),
+                ('querystring', models.TextField(blank=True, verbose_name='Query String')),
+                ('secure', models.BooleanField(default=False, verbose_name='Received Over SSL')),
+                ('ipaddress', models.CharField(blank=True, max_length=64, verbose_name='IP Address')),
+                ('txn_id', models.CharField(blank=True, db_index=True, max_length=64, verbose_name='Transaction ID')),
+                ('payment_status', models.CharField(blank=True, max_length=32, verbose_name='Payment Status')),
+                ('attempts', models.IntegerField(default=0, editable=False, verbose_name='Attempts')),
+                ('received', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Time Received')),
+                ('nextattempt', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Next Attempt')),
+                ('processed', models.DateTimeField(blank=True, null=True, verbose_name='Time Processed')),
+                ('lasterror', models.TextField(blank=True, verbose_name='Last Error')),
+                ('ipn', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='ipn.PayPalIPN', verbose_name='IPN')),
+            ],
+            options={
+                'verbose_name': 'Queued IPN',
+                'ordering': ('received',),
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='queuedipn',
+            index_together={('state', 'nextattempt')},
+        ),
+    ]
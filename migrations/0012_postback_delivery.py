@@ -0,0 +1,47 @@
+# Generated by Django 2.1.8 on 2026-10-19 09:41
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0011_queued_ipn'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PostbackDelivery',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('payload', models.TextField(verbose_name='Payload')),
+                ('state', models.CharField(choices=[('PENDING', 'Pending'), ('SENDING', 'Sending'), ('DELIVERED', 'Delivered'), ('FAILED', 'Failed')], default='PENDING', max_length=16, verbose_name='State')),
+                ('attempts', models.IntegerField(default=0, editable=False, verbose_name='Attempts')),
+                ('created', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Created')),
+                ('nextattempt', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Next Attempt')),
+                ('delivered', models.DateTimeField(blank=True, null=True, verbose_name='Delivered')),
+                ('latency', models.FloatField(blank=True, help_text='Round trip time of the successful request', null=True, verbose_name='Latency (ms)')),
+                ('lasterror', models.TextField(blank=True, verbose_name='Last Error')),
+            ],
+            options={
+                'verbose_name_plural': 'Postback Deliveries',
+                'ordering': ('created',),
+            },
+        ),
+        migrations.AddField(
+            model_name='postbackurl',
+            name='coalesce',
+            field=models.BooleanField(default=False, help_text='Send donations that queue up while this URL is slow or failing as a single JSON list instead of one at a time', verbose_name='Batch Deliveries'),
+        ),
+        migrations.AddField(
+            model_name='postbackdelivery',
+            name='postback',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='deliveries', to='tracker.PostbackURL', verbose_name='Postback URL'),
+        ),
+        migrations.AlterIndexTogether(
+            name='postbackdelivery',
+            index_together={('state', 'nextattempt')},
+        ),
+    ]
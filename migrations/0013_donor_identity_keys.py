@@ -0,0 +1,46 @@
+# Generated by Django 2.1.8 on 2026-10-19 09:51
+
+from django.db import migrations, models
+from django.db.models.functions import Lower, Trim
+
+
+def fill_keys(apps, schema_editor):
+    Donor = apps.get_model('tracker', 'Donor')
+    Runner = apps.get_model('tracker', 'Runner')
+    Donor.objects.exclude(email=None).update(emailkey=Lower(Trim('email')))
+    Donor.objects.exclude(alias=None).update(aliaskey=Lower(Trim('alias')))
+    Donor.objects.filter(aliaskey='').update(aliaskey=None)
+    Donor.objects.exclude(paypalemail=None).update(paypalemailkey=Lower(Trim('paypalemail')))
+    Donor.objects.filter(paypalemailkey='').update(paypalemailkey=None)
+    Runner.objects.update(namekey=Lower(Trim('name')))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0012_postback_delivery'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='donor',
+            name='aliaskey',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=32, null=True),
+        ),
+        migrations.AddField(
+            model_name='donor',
+            name='emailkey',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=128),
+        ),
+        migrations.AddField(
+            model_name='donor',
+            name='paypalemailkey',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=128, null=True),
+        ),
+        migrations.AddField(
+            model_name='runner',
+            name='namekey',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=64),
+        ),
+        migrations.RunPython(fill_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 2.1.8 on 2026-10-19 09:57
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+# Only a small part of the donation table is ever waiting on moderation, so a partial index over just those rows
+# keeps the moderation feeds cheap however many donations there are. Not every backend supports partial indexes.
+PARTIAL_INDEX_VENDORS = ('postgresql', 'sqlite')
+
+
+def create_moderation_index(apps, schema_editor):
+    if schema_editor.connection.vendor in PARTIAL_INDEX_VENDORS:
+        schema_editor.execute(
+            "CREATE INDEX tracker_donation_moderation ON tracker_donation (event_id, id) "
+            "WHERE transactionstate = 'COMPLETED' AND "
+            "(commentstate = 'PENDING' OR readstate IN ('PENDING', 'READY', 'FLAGGED') OR bidstate = 'FLAGGED')")
+
+
+def drop_moderation_index(apps, schema_editor):
+    if schema_editor.connection.vendor in PARTIAL_INDEX_VENDORS:
+        schema_editor.execute("DROP INDEX tracker_donation_moderation")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0013_donor_identity_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DonationChange',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('time', models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='Time')),
+                ('donation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='changes', to='tracker.Donation')),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='tracker.Event')),
+            ],
+            options={
+                'ordering': ('id',),
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='donationchange',
+            index_together={('event', 'id')},
+        ),
+        migrations.RunPython(create_moderation_index, drop_moderation_index),
+    ]
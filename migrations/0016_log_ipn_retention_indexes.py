@@ -0,0 +1,27 @@
+# Generated by Django 2.1.8 on 2026-10-19 10:33
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0015_log_timestamp_default'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='log',
+            name='timestamp',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now, editable=False, verbose_name='Timestamp'),
+        ),
+        migrations.AlterIndexTogether(
+            name='log',
+            index_together={('event', 'category', 'timestamp')},
+        ),
+        migrations.AlterIndexTogether(
+            name='queuedipn',
+            index_together={('state', 'received'), ('state', 'nextattempt')},
+        ),
+    ]
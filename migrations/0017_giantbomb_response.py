@@ -0,0 +1,31 @@
+# Generated by Django 2.1.8 on 2026-10-19 10:46
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0016_log_ipn_retention_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GiantBombResponse',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resource', models.CharField(choices=[('search', 'Search'), ('game', 'Game')], max_length=16, verbose_name='Resource')),
+                ('query', models.CharField(help_text='The cleaned, lower-cased game name searched for, or the GiantBomb id', max_length=255, verbose_name='Query')),
+                ('results', models.TextField(help_text='The results of the response, as JSON', verbose_name='Results')),
+                ('fetched', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Fetched')),
+            ],
+            options={
+                'verbose_name': 'GiantBomb Response',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='giantbombresponse',
+            unique_together={('resource', 'query')},
+        ),
+    ]
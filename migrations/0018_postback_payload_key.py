@@ -0,0 +1,26 @@
+import json
+
+from django.db import migrations
+
+
+def remove_payload_keys(apps, schema_editor):
+    # the secret key used to be stored with each queued payload, it is now added when the payload is sent
+    PostbackDelivery = apps.get_model('tracker', 'PostbackDelivery')
+    db_alias = schema_editor.connection.alias
+    deliveries = PostbackDelivery.objects.using(db_alias).filter(payload__contains='"key"')
+    for delivery in deliveries.only('id', 'payload').iterator():
+        data = json.loads(delivery.payload)
+        if 'key' in data:
+            del data['key']
+            delivery.payload = json.dumps(data, ensure_ascii=False)
+            delivery.save(update_fields=['payload'])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('tracker', '0017_giantbomb_response'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_payload_keys, lambda a, b: None)
+    ]
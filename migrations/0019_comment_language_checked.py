@@ -0,0 +1,18 @@
+# Generated by Django 2.1.8 on 2026-10-19 11:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0018_postback_payload_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='donation',
+            name='commentlanguagechecked',
+            field=models.BooleanField(db_index=True, default=False, editable=False),
+        ),
+    ]
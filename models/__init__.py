@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 from tracker.validators import *
 
 from .event import *
@@ -11,12 +12,15 @@ from .country import *
 __all__ = [
     'Event',
     'PostbackURL',
+    'PostbackDelivery',
+    'QueuedIPN',
     'Bid',
     'DonationBid',
     'BidSuggestion',
     'Donation',
     'Donor',
     'DonorCache',
+    'DonationChange',
     'Prize',
     'PrizeCategory',
     'PrizeTicket',
@@ -24,6 +28,7 @@ __all__ = [
     'DonorPrizeEntry',
     'SpeedRun',
     'Runner',
+    'GiantBombResponse',
     'Submission',
     'UserProfile',
     'Log',
@@ -45,7 +50,8 @@ class UserProfile(models.Model):
         return str(self.user)
 
 class Log(models.Model):
-  timestamp = models.DateTimeField(auto_now_add=True, verbose_name='Timestamp')
+  # not auto_now_add, so that logs written in bulk later keep the time they were logged at
+  timestamp = models.DateTimeField(default=timezone.now, editable=False, db_index=True, verbose_name='Timestamp')
   category = models.CharField(max_length=64, default='other', blank=False, null=False, verbose_name='Category')
   message = models.TextField(blank=True, null=False, verbose_name='Message' )
   event = models.ForeignKey('Event', blank=True, null=True, on_delete=models.PROTECT)
@@ -57,6 +63,7 @@ class Log(models.Model):
       ('can_change_log', 'Can change tracker logs'),
     )
     ordering = ['-timestamp']
+    index_together = (('event', 'category', 'timestamp'), )
   def __str__(self):
     result = str(self.timestamp)
     if self.event:
@@ -3,6 +3,8 @@ from django.db.models import signals, Sum, Q
 from django.core.exceptions import ValidationError
 from django.dispatch import receiver
 
+import tracker.aggregateutil as aggregateutil
+import tracker.cacheutil as cacheutil
 from tracker.validators import *
 from tracker.models import Event, SpeedRun
 
@@ -193,7 +195,9 @@ class DonationBid(models.Model):
 @receiver(signals.post_save, sender=DonationBid)
 def DonationBidParentUpdate(sender, instance, created, raw, **kwargs):
   if raw: return
-  if instance.donation.transactionstate == 'COMPLETED': instance.bid.save()
+  if instance.donation.transactionstate == 'COMPLETED':
+    if aggregateutil.defer_bids([instance.bid_id]): return
+    instance.bid.save()
 
 class BidSuggestion(models.Model):
   bid = models.ForeignKey('Bid', related_name='suggestions', null=False,on_delete=models.PROTECT)
@@ -209,3 +213,45 @@ class BidSuggestion(models.Model):
   def __str__(self):
     return self.name + " -- " + str(self.bid)
 
+
+# anything shown on the donate page invalidates the donation menus
+@receiver(signals.post_save, sender=Bid)
+@receiver(signals.post_delete, sender=Bid)
+@receiver(signals.post_save, sender=SpeedRun)
+@receiver(signals.post_delete, sender=SpeedRun)
+def DonationMenuUpdate(sender, instance, **kwargs):
+  cacheutil.bump_version('bids', _event_id(sender, instance))
+
+# and the schedule timelines behind the run, bid and prize feeds (see scheduleutil)
+@receiver(signals.post_save, sender=Bid)
+@receiver(signals.post_delete, sender=Bid)
+@receiver(signals.post_save, sender=SpeedRun)
+@receiver(signals.post_delete, sender=SpeedRun)
+def ScheduleUpdate(sender, instance, **kwargs):
+  cacheutil.bump_version('schedule', _event_id(sender, instance))
+
+# and the cached pages of the REST API
+@receiver(signals.post_save, sender=Bid)
+@receiver(signals.post_delete, sender=Bid)
+def BidApiUpdate(sender, instance, **kwargs):
+  cacheutil.bump_version('api', _event_id(sender, instance))
+
+# as do the bids and runs shown on the ticker
+@receiver(signals.post_save, sender=Bid)
+@receiver(signals.post_delete, sender=Bid)
+@receiver(signals.post_save, sender=SpeedRun)
+@receiver(signals.post_delete, sender=SpeedRun)
+def TickerBidsUpdate(sender, instance, **kwargs):
+  from .. import tickerutil
+  tickerutil.ticker_changed(_event_id(sender, instance))
+
+@receiver(signals.m2m_changed, sender=SpeedRun.runners.through)
+def TickerRunnersUpdate(sender, instance, **kwargs):
+  if isinstance(instance, SpeedRun):
+    from .. import tickerutil
+    tickerutil.ticker_changed(instance.event_id)
+
+def _event_id(sender, instance):
+  if sender == Bid and not instance.event_id and instance.speedrun_id:
+    return instance.speedrun.event_id
+  return instance.event_id
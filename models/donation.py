@@ -11,21 +11,19 @@ from django.utils import timezone
 
 from .event import LatestEvent
 from .fields import OneToOneOrNoneField
+import tracker.aggregateutil as aggregateutil
+import tracker.cacheutil as cacheutil
+import tracker.util as util
 from ..validators import *
 from functools import reduce
-
-try:
-  import cld
-except ImportError:
-  import warnings
-  warnings.warn('Could not import cld, chromium_compact_language_detector not installed, language detection will not function')
-  cld = None
 import calendar
 
 __all__ = [
   'Donation',
   'Donor',
   'DonorCache',
+  'DonationChange',
+  'QueuedIPN',
 ]
 
 _currencyChoices = (('GBP', 'Pound Sterling'),('USD','US Dollars'),('CAD', 'Canadian Dollars'))
@@ -63,6 +61,8 @@ class Donation(models.Model):
   requestedemail = models.EmailField(max_length=128, null=True, blank=True, verbose_name='Requested Contact Email')
   requestedsolicitemail = models.CharField(max_length=32, null=False, blank=False, default='CURR', choices=(('CURR', 'Use Existing (Opt Out if not set)'),('OPTOUT', 'Opt Out'), ('OPTIN','Opt In')), verbose_name='Requested Charity Email Opt In')
   commentlanguage = models.CharField(max_length=32, null=False, blank=False, default='un', choices=LanguageChoices, verbose_name='Comment Language')
+  # set once the language job has looked at the comment, so a comment it cannot place is not looked at again
+  commentlanguagechecked = models.BooleanField(default=False, db_index=True, editable=False)
   class Meta:
     app_label = 'tracker'
     permissions = (
@@ -127,22 +127,56 @@ class Donation(models.Model):
     if self.amount and ticketTotal > self.amount:
       raise ValidationError('Prize ticket total is greater than donation amount: %s > %s' % (ticketTotal,self.amount))
 
-    if self.comment and cld:
-      if self.commentlanguage == 'un' or self.commentlanguage == None:
-        detectedLangName, detectedLangCode, isReliable, textBytesFound, details = cld.detect(self.comment.encode('utf-8'), hintLanguageCode ='en')
-        if detectedLangCode in [x[0] for x in LanguageChoices]:
-          self.commentlanguage = detectedLangCode
-        else:
-          self.commentlanguage = 'un'
-    else:
+    # the language of a comment is detected later, by languageutil.detect_comment_languages
+    if not self.comment or not self.commentlanguage:
       self.commentlanguage = 'un'
   def __str__(self):
     return str(self.donor.visible_name() if self.donor else self.donor) + ' (' + str(self.amount) + ') (' + str(self.timereceived) + ')'
 
+# the fields that decide which moderation queues a donation shows up in, or how it is shown there
+_moderationFields = ('transactionstate', 'readstate', 'commentstate', 'bidstate', 'commentlanguage', 'comment', 'amount', 'donor_id')
+
+_unloaded = object()
+
+def _moderation_snapshot(donation):
+  # deferred fields are left out, rather than loaded with a query each
+  return tuple(donation.__dict__.get(field, _unloaded) for field in _moderationFields)
+
+@receiver(signals.post_init, sender=Donation)
+def DonationModerationSnapshot(sender, instance, **kwargs):
+  instance._moderationSnapshot = _moderation_snapshot(instance)
+
+@receiver(signals.pre_save, sender=Donation)
+def DonationCommentChange(sender, instance, raw, **kwargs):
+  if raw: return
+  comment = instance._moderationSnapshot[_moderationFields.index('comment')]
+  if comment is not _unloaded and comment != instance.comment:
+    instance.commentlanguagechecked = False
+
+@receiver(signals.post_save, sender=Donation)
+def DonationModerationChange(sender, instance, created, raw, **kwargs):
+  if raw: return
+  snapshot = _moderation_snapshot(instance)
+  if created or snapshot != instance._moderationSnapshot:
+    DonationChange.objects.create(donation=instance, event_id=instance.event_id)
+  instance._moderationSnapshot = snapshot
+
+@receiver(signals.post_save, sender=Donation)
+@receiver(signals.post_delete, sender=Donation)
+def DonationTickerUpdate(sender, instance, **kwargs):
+  from .. import tickerutil
+  tickerutil.ticker_changed(instance.event_id)
+
+@receiver(signals.post_save, sender=Donation)
+@receiver(signals.post_delete, sender=Donation)
+def DonationApiUpdate(sender, instance, **kwargs):
+  cacheutil.bump_version('api', instance.event_id)
+
 @receiver(signals.post_save, sender=Donation)
 def DonationBidsUpdate(sender, instance, created, raw, **kwargs):
   if raw: return
   if instance.transactionstate == 'COMPLETED':
+    if aggregateutil.defer_bids(instance.bids.values_list('bid_id', flat=True)): return
     for b in instance.bids.all():
       b.save()
 
@@ -171,6 +205,11 @@ class Donor(models.Model):
   paypalemail = models.EmailField(max_length=128,unique=True,null=True,blank=True,verbose_name='Paypal Email')
   solicitemail = models.CharField(max_length=32,choices=(('CURR', 'Use Existing (Opt Out if not set)'),('OPTOUT', 'Opt Out'), ('OPTIN','Opt In')),default='CURR')
 
+  # Normalized copies of the identifying fields, so case-insensitive lookups can use an index (see donorutil)
+  emailkey = models.CharField(max_length=128,blank=True,default='',db_index=True,editable=False)
+  aliaskey = models.CharField(max_length=32,null=True,blank=True,db_index=True,editable=False)
+  paypalemailkey = models.CharField(max_length=128,null=True,blank=True,db_index=True,editable=False)
+
   class Meta:
     app_label = 'tracker'
     permissions = (
@@ -188,6 +227,15 @@ class Donor(models.Model):
     if not self.paypalemail:
       self.paypalemail = None
 
+  def update_keys(self):
+    self.emailkey = util.normalize_key(self.email) or ''
+    self.aliaskey = util.normalize_key(self.alias)
+    self.paypalemailkey = util.normalize_key(self.paypalemail)
+
+  def save(self, *args, **kwargs):
+    self.update_keys()
+    super(Donor, self).save(*args, **kwargs)
+
   def contact_name(self):
     if self.firstname:
       return self.firstname + ' ' + self.lastname
@@ -238,7 +286,9 @@ class DonorCache(models.Model):
   @receiver(signals.post_save, sender=Donation)
   @receiver(signals.post_delete, sender=Donation)
   def donation_update(sender, instance, **args):
-    if not instance.donor:
+    if not instance.donor_id:
+      return
+    if aggregateutil.defer_donor(instance.event_id, instance.donor_id):
       return
     cache,c = DonorCache.objects.get_or_create(event=instance.event,donor=instance.donor)
     cache.update()
@@ -294,3 +344,43 @@ class DonorCache(models.Model):
     ordering = ('donor', )
     unique_together = ('event', 'donor')
 
+
+class DonationChange(models.Model):
+  """An entry in the log of moderation relevant donation changes, which the moderation stream reads from"""
+  donation = models.ForeignKey('Donation', on_delete=models.CASCADE, related_name='changes')
+  event = models.ForeignKey('Event', on_delete=models.CASCADE)
+  time = models.DateTimeField(default=timezone.now, db_index=True, verbose_name='Time')
+
+  class Meta:
+    app_label = 'tracker'
+    ordering = ('id', )
+    index_together = (('event', 'id'), )
+
+  def __str__(self):
+    return '#{0} donation {1}'.format(self.id, self.donation_id)
+
+
+class QueuedIPN(models.Model):
+  """A PayPal IPN as it was received, waiting for a worker to turn it into a donation update"""
+  state = models.CharField(max_length=16, default='PENDING', choices=(('PENDING', 'Pending'), ('PROCESSING', 'Processing'), ('DONE', 'Done'), ('DUPLICATE', 'Duplicate'), ('FAILED', 'Failed')), verbose_name='State')
+  body = models.TextField(blank=True, verbose_name='Raw Body')
+  querystring = models.TextField(blank=True, verbose_name='Query String')
+  secure = models.BooleanField(default=False, verbose_name='Received Over SSL')
+  ipaddress = models.CharField(max_length=64, blank=True, verbose_name='IP Address')
+  txn_id = models.CharField(max_length=64, blank=True, db_index=True, verbose_name='Transaction ID')
+  payment_status = models.CharField(max_length=32, blank=True, verbose_name='Payment Status')
+  ipn = models.ForeignKey('ipn.PayPalIPN', null=True, blank=True, on_delete=models.SET_NULL, verbose_name='IPN')
+  attempts = models.IntegerField(default=0, editable=False, verbose_name='Attempts')
+  received = models.DateTimeField(default=timezone.now, verbose_name='Time Received')
+  nextattempt = models.DateTimeField(default=timezone.now, verbose_name='Next Attempt')
+  processed = models.DateTimeField(null=True, blank=True, verbose_name='Time Processed')
+  lasterror = models.TextField(blank=True, verbose_name='Last Error')
+
+  class Meta:
+    app_label = 'tracker'
+    verbose_name = 'Queued IPN'
+    ordering = ('received', )
+    index_together = (('state', 'nextattempt'), ('state', 'received'), )
+
+  def __str__(self):
+    return '{0} ({1}) {2}'.format(self.txn_id or 'no txn_id', self.payment_status, self.state)
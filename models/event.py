@@ -8,18 +8,24 @@ from django.contrib.auth.models import User
 from django.core import validators
 from django.core.exceptions import ValidationError
 from django.db import models
+from django.db.models import signals
 from django.db.utils import OperationalError
+from django.dispatch import receiver
+from django.utils import timezone
 from django.utils.html import format_html
 from timezone_field import TimeZoneField
 
+import tracker.cacheutil as cacheutil
 import tracker.util as util
 from ..validators import *
 
 __all__ = [
     'Event',
     'PostbackURL',
+    'PostbackDelivery',
     'SpeedRun',
     'Runner',
+    'GiantBombResponse',
     'Submission',
 ]
 
@@ -282,10 +288,40 @@ class PostbackURL(models.Model):
     event = models.ForeignKey('Event', on_delete=models.PROTECT, verbose_name='Event', null=False, blank=False,
                               related_name='postbacks')
     url = models.URLField(blank=False, null=False, verbose_name='URL')
+    coalesce = models.BooleanField(default=False, verbose_name='Batch Deliveries',
+                                   help_text='Send donations that queue up while this URL is slow or failing as a single JSON list instead of one at a time')
 
     class Meta:
         app_label = 'tracker'
 
+    def __str__(self):
+        return self.url
+
+
+class PostbackDelivery(models.Model):
+    postback = models.ForeignKey('PostbackURL', on_delete=models.CASCADE, related_name='deliveries',
+                                 verbose_name='Postback URL')
+    payload = models.TextField(verbose_name='Payload')
+    state = models.CharField(max_length=16, default='PENDING', verbose_name='State',
+                             choices=(('PENDING', 'Pending'), ('SENDING', 'Sending'), ('DELIVERED', 'Delivered'),
+                                      ('FAILED', 'Failed')))
+    attempts = models.IntegerField(default=0, editable=False, verbose_name='Attempts')
+    created = models.DateTimeField(default=timezone.now, verbose_name='Created')
+    nextattempt = models.DateTimeField(default=timezone.now, verbose_name='Next Attempt')
+    delivered = models.DateTimeField(null=True, blank=True, verbose_name='Delivered')
+    latency = models.FloatField(null=True, blank=True, verbose_name='Latency (ms)',
+                                help_text='Round trip time of the successful request')
+    lasterror = models.TextField(blank=True, verbose_name='Last Error')
+
+    class Meta:
+        app_label = 'tracker'
+        verbose_name_plural = 'Postback Deliveries'
+        ordering = ('created',)
+        index_together = (('state', 'nextattempt'),)
+
+    def __str__(self):
+        return '{0} to {1}'.format(self.state, self.postback_id)
+
 
 class SpeedRunManager(models.Manager):
     def get_by_natural_key(self, name, event):
@@ -411,7 +447,7 @@ class SpeedRun(models.Model):
 class Runner(models.Model):
     class _Manager(models.Manager):
         def get_by_natural_key(self, name):
-            return self.get(name__iexact=name)
+            return self.get(namekey=util.normalize_key(name))
 
         def get_or_create_by_natural_key(self, name):
             return self.get_or_create(name=name)
@@ -426,6 +462,12 @@ class Runner(models.Model):
     twitter = models.SlugField(max_length=15, blank=True)
     youtube = models.SlugField(max_length=20, blank=True)
     donor = models.OneToOneField('tracker.Donor', blank=True, null=True, on_delete=models.PROTECT)
+    # lower-cased name, so case-insensitive lookups can use an index
+    namekey = models.CharField(max_length=64, default='', db_index=True, editable=False)
+
+    def save(self, *args, **kwargs):
+        self.namekey = util.normalize_key(self.name) or ''
+        super(Runner, self).save(*args, **kwargs)
 
     def natural_key(self):
         return (self.name,)
@@ -434,6 +476,24 @@ class Runner(models.Model):
         return self.name
 
 
+class GiantBombResponse(models.Model):
+    # what the GiantBomb API returned for a search or a game, so a sync only asks for what it has not seen lately
+    resource = models.CharField(max_length=16, choices=(('search', 'Search'), ('game', 'Game')),
+                                verbose_name='Resource')
+    query = models.CharField(max_length=255, verbose_name='Query',
+                             help_text='The cleaned, lower-cased game name searched for, or the GiantBomb id')
+    results = models.TextField(verbose_name='Results', help_text='The results of the response, as JSON')
+    fetched = models.DateTimeField(default=timezone.now, verbose_name='Fetched')
+
+    class Meta:
+        app_label = 'tracker'
+        verbose_name = 'GiantBomb Response'
+        unique_together = (('resource', 'query'),)
+
+    def __str__(self):
+        return '{0} {1}'.format(self.resource, self.query)
+
+
 class Submission(models.Model):
     class Meta:
         app_label = 'tracker'
@@ -470,3 +530,35 @@ class Submission(models.Model):
             self.run.save()
             ret.append(self.run)
         return ret
+
+
+# anything shown by the REST API invalidates its cached pages of the event
+@receiver(signals.post_save, sender=Event)
+@receiver(signals.post_delete, sender=Event)
+def EventApiUpdate(sender, instance, **kwargs):
+    cacheutil.bump_version('api', instance.id)
+
+
+@receiver(signals.post_save, sender=SpeedRun)
+@receiver(signals.post_delete, sender=SpeedRun)
+def SpeedRunApiUpdate(sender, instance, **kwargs):
+    cacheutil.bump_version('api', instance.event_id)
+
+
+@receiver(signals.m2m_changed, sender=SpeedRun.runners.through)
+def SpeedRunRunnersApiUpdate(sender, instance, **kwargs):
+    if isinstance(instance, SpeedRun):
+        cacheutil.bump_version('api', instance.event_id)
+    else:
+        for event_id in set(SpeedRun.objects.filter(pk__in=kwargs.get('pk_set') or ()).values_list('event_id', flat=True)):
+            cacheutil.bump_version('api', event_id)
+
+
+@receiver(signals.pre_delete, sender=Runner)
+@receiver(signals.post_save, sender=Runner)
+def RunnerApiUpdate(sender, instance, created=False, **kwargs):
+    if created:
+        return
+    # runners are shared between events, so every event they run in is affected
+    for event_id in set(instance.speedrun_set.values_list('event_id', flat=True)):
+        cacheutil.bump_version('api', event_id)
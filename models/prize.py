@@ -7,8 +7,10 @@ from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
 from django.urls import reverse
 from django.db import models
-from django.db.models import Sum, Q
+from django.db.models import signals, Sum, Q
+from django.dispatch import receiver
 
+import tracker.cacheutil as cacheutil
 import tracker.util as util
 from .event import LatestEvent, TimestampField
 from ..irc import TwitchAnnouncer
@@ -399,6 +401,31 @@ class PrizeWinner(models.Model):
     bot.send_message(msg)
 
 
+# anything that can move a prize's eligibility window invalidates the prize window indexes
+@receiver(signals.post_save, sender=Prize)
+@receiver(signals.post_delete, sender=Prize)
+@receiver(signals.post_save, sender=SpeedRun)
+@receiver(signals.post_delete, sender=SpeedRun)
+def PrizeWindowsUpdate(sender, instance, **kwargs):
+  cacheutil.bump_version('prizes', instance.event_id)
+
+@receiver(signals.post_save, sender=PrizeWinner)
+@receiver(signals.post_delete, sender=PrizeWinner)
+def PrizeWinnerWindowsUpdate(sender, instance, **kwargs):
+  cacheutil.bump_version('prizes', instance.prize.event_id)
+
+# as well as the cached pages of the REST API
+@receiver(signals.post_save, sender=Prize)
+@receiver(signals.post_delete, sender=Prize)
+def PrizeApiUpdate(sender, instance, **kwargs):
+  cacheutil.bump_version('api', instance.event_id)
+
+@receiver(signals.post_save, sender=PrizeWinner)
+@receiver(signals.post_delete, sender=PrizeWinner)
+def PrizeWinnerApiUpdate(sender, instance, **kwargs):
+  cacheutil.bump_version('api', instance.prize.event_id)
+
+
 class PrizeCategoryManager(models.Manager):
   def get_by_natural_key(self, name):
     return self.get(name=name)
@@ -0,0 +1,117 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Max, Min
+from django.utils import timezone
+
+import tracker.filters as filters
+import tracker.models as models
+
+# the queues the moderation screens work from
+MODERATION_FEEDS = {
+    'toprocess': filters.toprocess_donations_filter,
+    'toread': filters.toread_donations_filter,
+    'toconfirm': filters.toconfirm_donations_filter,
+}
+MODERATION_POLL_INTERVAL = 1
+# ids are handed out when a change is written, not when it commits, so a change can show up after one with a higher
+# id. The cursor only moves past changes older than this, and the ones after it are sent again until then.
+MODERATION_CURSOR_LAG = timedelta(seconds=10)
+DONATION_CHANGE_RETENTION = timedelta(days=2)
+
+
+class ModerationUpdate(object):
+    """
+    What a moderation screen needs to catch up with the database.
+
+    :ivar cursor: pass this back in to get the changes after this update
+    :ivar donations: the changed donations that are in the feed, or all of the feed if `reset` is set
+    :ivar removed: ids of the changed donations that are no longer in the feed
+    :ivar reset: whether the client has to throw away what it has and start over from `donations`
+    """
+
+    def __init__(self, cursor, donations, removed=(), reset=False):
+        self.cursor = cursor
+        self.donations = donations
+        self.removed = list(removed)
+        self.reset = reset
+
+
+def feed_donations(feed, event=None):
+    donations = models.Donation.objects.filter(MODERATION_FEEDS[feed]())
+    if event:
+        donations = donations.filter(event=event)
+    return donations
+
+
+def settled_change_id():
+    """
+    :return: the id of the latest change older than MODERATION_CURSOR_LAG
+    :rtype: int
+    """
+    changes = models.DonationChange.objects.filter(time__lt=timezone.now() - MODERATION_CURSOR_LAG)
+    return changes.aggregate(latest=Max('id'))['latest'] or 0
+
+
+def max_timeout():
+    # every second of waiting holds a worker, so by default there is none and clients poll instead
+    return getattr(settings, 'MODERATION_MAX_TIMEOUT', 0)
+
+
+def get_moderation_update(feed, event=None, cursor=None, timeout=0):
+    """
+    Returns the donations of a moderation feed that changed after `cursor`, waiting up to `timeout` seconds, but no
+    longer than the MODERATION_MAX_TIMEOUT setting, for something to change. Without a cursor, or with one older
+    than the change log goes back, the whole feed is returned instead. Changes from the last
+    MODERATION_CURSOR_LAG are returned again by the next update, in case one written before them has not committed
+    yet.
+
+    :param feed: one of MODERATION_FEEDS
+    :type feed: str
+    :param event: only look at the donations of this event
+    :type event: Event|int
+    :param cursor: the cursor of the previous update the client got
+    :type cursor: int
+    :param timeout: how many seconds to wait for a change
+    :type timeout: float
+    :rtype: ModerationUpdate
+    """
+    if feed not in MODERATION_FEEDS:
+        raise KeyError(feed)
+    eventId = getattr(event, 'id', event)
+    oldest = models.DonationChange.objects.aggregate(oldest=Min('id'))['oldest']
+    if cursor is None or (oldest is not None and cursor < oldest - 1):
+        # read the cursor first, so that anything changing while the feed is read shows up next time. Without any
+        # settled changes, it goes just before the oldest one, so the next update is not a reset again.
+        latest = max(settled_change_id(), (oldest or 1) - 1)
+        return ModerationUpdate(latest, list(feed_donations(feed, eventId).select_related('donor')), reset=True)
+
+    changes = models.DonationChange.objects.filter(id__gt=cursor)
+    if eventId:
+        changes = changes.filter(event_id=eventId)
+    deadline = time.time() + min(timeout, max_timeout())
+    while True:
+        settledTime = timezone.now() - MODERATION_CURSOR_LAG
+        changed = list(changes.values_list('id', 'donation_id', 'time'))
+        if changed or time.time() >= deadline:
+            break
+        time.sleep(MODERATION_POLL_INTERVAL)
+    if not changed:
+        return ModerationUpdate(cursor, [])
+    donationIds = {donationId for changeId, donationId, changeTime in changed}
+    donations = list(feed_donations(feed, eventId).filter(id__in=donationIds).select_related('donor'))
+    settled = [changeId for changeId, donationId, changeTime in changed if changeTime < settledTime]
+    return ModerationUpdate(max(settled + [cursor]), donations,
+                            removed=sorted(donationIds - {donation.id for donation in donations}))
+
+
+def prune_donation_changes(olderThan=DONATION_CHANGE_RETENTION):
+    """
+    Deletes the change log entries older than `olderThan`. Clients whose cursor is older than that get the whole
+    feed again.
+
+    :return: the number of entries deleted
+    :rtype: int
+    """
+    return models.DonationChange.objects.filter(time__lt=timezone.now() - olderThan).delete()[0]
@@ -2,16 +2,30 @@ from paypal.standard.ipn.forms import PayPalIPNForm
 from paypal.standard.ipn.models import PayPalIPN
 from tracker.models import *
 from datetime import *
+import tracker.donorutil as donorutil
+import tracker.eventutil as eventutil
 import tracker.viewutil as viewutil
-import random
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from itertools import groupby
+
+import tracker.mailutil as mailutil
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, F, Min
+from django.http import QueryDict
+from django.utils import timezone
 
 from decimal import *
 import pytz
 
 def create_ipn(request):
+  return create_ipn_from_data(request.POST, request.GET, request.is_secure(), request.body.decode('ascii'), request.META.get('REMOTE_ADDR', ''))
+
+def create_ipn_from_data(post, get, secure, body, ipaddress):
   flag = None
   ipnObj = None
-  form = PayPalIPNForm(request.POST)
+  form = PayPalIPNForm(post)
   if form.is_valid():
     try:
       ipnObj = form.save(commit=False)
@@ -21,13 +35,15 @@ def create_ipn(request):
     flag = "Invalid form. (%s)" % form.errors
   if ipnObj is None:
     ipnObj = PayPalIPN()
-  ipnObj.initialize(request)
+  # equivalent of PayPalIPN.initialize, which needs the original request
+  ipnObj.query = body
+  ipnObj.ipaddress = ipaddress
   if flag is not None:
     ipnObj.set_flag(flag)
   else:
     # Secrets should only be used over SSL.
-    if request.is_secure() and 'secret' in request.GET:
-      ipnObj.verify_secret(form, request.GET['secret'])
+    if secure and 'secret' in get:
+      ipnObj.verify_secret(form, get['secret'])
     else:
       donation = get_ipn_donation(ipnObj)
       if not donation:
@@ -83,7 +99,7 @@ def initialize_paypal_donation(ipnObj):
     'addresszip'     : ipnObj.address_zip,
     'visibility'      : 'ANON',
   }
-  donor,created = Donor.objects.get_or_create(paypalemail=ipnObj.payer_email.lower(),defaults=defaults)
+  donor,created = donorutil.get_or_create_paypal_donor(ipnObj.payer_email,defaults=defaults)
 
   fill_donor_address(donor, ipnObj)
 
@@ -93,16 +109,8 @@ def initialize_paypal_donation(ipnObj):
     if donation.requestedvisibility != 'CURR':
       donor.visibility = donation.requestedvisibility
     if donation.requestedalias and (not donor.alias or donation.requestedalias.lower() != donor.alias.lower()):
-      foundAResult = False
-      currentAlias = donation.requestedalias
-      while not foundAResult:
-        results = Donor.objects.filter(alias__iexact=currentAlias)
-        if results.exists():
-          currentAlias = donation.requestedalias + str(random.getrandbits(8))
-        else:
-          foundAResult = True
-      donor.alias = currentAlias
-    if donation.requestedemail and donation.requestedemail != donor.email and not Donor.objects.filter(email=donation.requestedemail).exists():
+      donor.alias = donorutil.unique_alias(donation.requestedalias, exclude_donor=donor)
+    if donation.requestedemail and donation.requestedemail != donor.email and not donorutil.find_donor_by_email(donation.requestedemail):
       donor.email = donation.requestedemail
     if donation.requestedsolicitemail != 'CURR':
       donor.solicitemail = donation.requestedsolicitemail
@@ -153,8 +161,8 @@ def get_paypal_donation(paypalemail, amount, transactionid):
   donations = Donation.objects.filter(amount=amount, domain='PAYPAL', domainId=transactionid)
   if donations.exists():
     donation = donations[0]
-    donors = Donor.objects.filter(paypalemail=paypalemail)
-    if donors.exists() and donation.donor.id == donors[0].id:
+    donor = donorutil.find_donor_by_paypal_email(paypalemail)
+    if donor and donation.donor_id == donor.id:
       return donation
   return None
 
@@ -189,3 +197,152 @@ def log_ipn(ipnObj, message=''):
   elif status in ['reversed', 'refunded', 'canceled_reversal', 'denied']:
     message += 'reason  : ' + ipnObj.reason_code
   viewutil.tracker_log('paypal', message, event=donation.event if donation else None)
+
+def process_ipn(ipnObj):
+  """Applies a stored IPN to its donation and sends out whatever the new transaction state calls for"""
+  donation = initialize_paypal_donation(ipnObj)
+  donation.save()
+
+  if donation.transactionstate == 'PENDING':
+    reasonExplanation, ourFault = get_pending_reason_details(ipnObj.pending_reason)
+    if donation.event.pendingdonationemailtemplate:
+      formatContext = {
+        'event': donation.event,
+        'donation': donation,
+        'donor': donation.donor,
+        'pending_reason': ipnObj.pending_reason,
+        'reason_info': reasonExplanation if not ourFault else '',
+      }
+      mailutil.send(recipients=[donation.donor.email], sender=donation.event.donationemailsender, template=donation.event.pendingdonationemailtemplate, context=formatContext)
+    # some pending reasons can be a problem with the receiver account, we should keep track of them
+    if ourFault:
+      log_ipn(ipnObj, 'Unhandled pending error')
+  elif donation.transactionstate == 'COMPLETED':
+    if donation.event.donationemailtemplate != None:
+      formatContext = {
+        'donation': donation,
+        'donor': donation.donor,
+        'event': donation.event,
+        'prizes': viewutil.get_donation_prize_info(donation),
+      }
+      mailutil.send(recipients=[donation.donor.email], sender=donation.event.donationemailsender, template=donation.event.donationemailtemplate, context=formatContext)
+    eventutil.post_donation_to_postbacks(donation)
+  elif donation.transactionstate == 'CANCELLED':
+    # eventually we may want to send out e-mail for some of the possible cases
+    # such as payment reversal due to double-transactions (this has happened before)
+    log_ipn(ipnObj, 'Cancelled/reversed payment')
+  return donation
+
+# how long a worker may hold a claimed IPN before another worker is allowed to pick it up
+IPN_QUEUE_LEASE = timedelta(minutes=10)
+IPN_QUEUE_RETRY_BASE = timedelta(seconds=30)
+IPN_QUEUE_RETRY_MAX = timedelta(hours=1)
+IPN_QUEUE_MAX_ATTEMPTS = 8
+
+def enqueue_ipn(request):
+  """Stores the IPN exactly as PayPal sent it. If PAYPAL_IPN_QUEUE_EAGER is set, also processes it right away,
+  which is meant for tests and small deployments without a queue worker."""
+  queued = QueuedIPN.objects.create(
+    body=request.body.decode('ascii'),
+    querystring=request.META.get('QUERY_STRING', ''),
+    secure=request.is_secure(),
+    ipaddress=request.META.get('REMOTE_ADDR', ''),
+    txn_id=request.POST.get('txn_id', '')[:64],
+    payment_status=request.POST.get('payment_status', '')[:32])
+  if getattr(settings, 'PAYPAL_IPN_QUEUE_EAGER', False):
+    for claimed in claim_queued_ipns(ids=[queued.id]):
+      process_queued_ipn(claimed)
+  return queued
+
+def claim_queued_ipns(limit=50, ids=None):
+  """Marks up to `limit` due IPNs as being processed by the caller and returns them, oldest first.
+  Claims are made with a conditional update, so concurrent workers never get the same IPN."""
+  now = timezone.now()
+  due = QueuedIPN.objects.filter(state__in=('PENDING', 'PROCESSING'), nextattempt__lte=now)
+  candidates = due.filter(pk__in=ids) if ids is not None else due.order_by('received')[:limit]
+  claimed = []
+  for pk in list(candidates.values_list('id', flat=True)):
+    if due.filter(pk=pk).update(state='PROCESSING', nextattempt=now + IPN_QUEUE_LEASE, attempts=F('attempts') + 1):
+      claimed.append(pk)
+  return list(QueuedIPN.objects.filter(pk__in=claimed).order_by('received'))
+
+def ipn_retry_delay(attempts):
+  return min(IPN_QUEUE_RETRY_BASE * (2 ** (attempts - 1)), IPN_QUEUE_RETRY_MAX)
+
+def process_queued_ipn(queued, maxAttempts=IPN_QUEUE_MAX_ATTEMPTS):
+  """Processes a claimed IPN, rescheduling it with exponential backoff if anything goes wrong.
+  Returns True if the IPN is finished with, False if it will be retried or has given up."""
+  if queued.txn_id:
+    # PayPal resends notifications it thinks we missed, the same transaction in the same state is only applied once
+    original = QueuedIPN.objects.filter(txn_id=queued.txn_id, payment_status=queued.payment_status, state='DONE').exclude(pk=queued.pk).first()
+    if original:
+      queued.state = 'DUPLICATE'
+      queued.processed = timezone.now()
+      queued.lasterror = 'Already processed as #{0}'.format(original.id)
+      queued.save()
+      return True
+  ipnObj = None
+  try:
+    with transaction.atomic():
+      ipnObj = create_ipn_from_data(QueryDict(queued.body), QueryDict(queued.querystring), queued.secure, queued.body, queued.ipaddress)
+      process_ipn(ipnObj)
+      queued.ipn = ipnObj
+      queued.state = 'DONE'
+      queued.processed = timezone.now()
+      queued.lasterror = ''
+      queued.save()
+    return True
+  except Exception as inst:
+    queued.ipn = None
+    queued.lasterror = traceback.format_exc()
+    if queued.attempts >= maxAttempts:
+      queued.state = 'FAILED'
+      queued.processed = timezone.now()
+    else:
+      queued.state = 'PENDING'
+      queued.nextattempt = timezone.now() + ipn_retry_delay(queued.attempts)
+    queued.save()
+    message = 'Queued IPN #{0} attempt {1} of {2} failed ({3}): {4}'.format(queued.id, queued.attempts, maxAttempts, queued.state, queued.lasterror)
+    if ipnObj:
+      log_ipn(ipnObj, message)
+    else:
+      viewutil.tracker_log('paypal', message)
+    return False
+
+def _process_queued_ipn_group(group, maxAttempts):
+  try:
+    results = []
+    for queued in group:
+      results.append(process_queued_ipn(queued, maxAttempts=maxAttempts))
+    return results
+  finally:
+    connection.close()
+
+def drain_ipn_queue(concurrency=1, batchSize=50, maxAttempts=IPN_QUEUE_MAX_ATTEMPTS):
+  """Processes queued IPNs until none are due. IPNs for the same transaction are always handled in
+  the order they arrived by a single thread; different transactions are spread over `concurrency` threads.
+  Returns a (succeeded, failed) tuple of counts."""
+  succeeded = failed = 0
+  while True:
+    claimed = claim_queued_ipns(limit=batchSize)
+    if not claimed:
+      break
+    keyfunc = lambda queued: queued.txn_id or 'ipn-{0}'.format(queued.id)
+    groups = [list(g) for k, g in groupby(sorted(claimed, key=keyfunc), keyfunc)]
+    if concurrency > 1:
+      with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = sum(executor.map(lambda g: _process_queued_ipn_group(g, maxAttempts), groups), [])
+    else:
+      results = [process_queued_ipn(queued, maxAttempts=maxAttempts) for g in groups for queued in g]
+    succeeded += results.count(True)
+    failed += results.count(False)
+  return succeeded, failed
+
+def ipn_queue_stats():
+  """Queue depth per state, plus the age in seconds of the oldest IPN that has not been dealt with yet"""
+  stats = {state: 0 for state, name in QueuedIPN._meta.get_field('state').choices}
+  stats.update(QueuedIPN.objects.values_list('state').annotate(Count('id')).order_by())
+  stats['depth'] = stats['PENDING'] + stats['PROCESSING']
+  oldest = QueuedIPN.objects.filter(state__in=('PENDING', 'PROCESSING')).aggregate(oldest=Min('received'))['oldest']
+  stats['lag'] = (timezone.now() - oldest).total_seconds() if oldest else 0
+  return stats
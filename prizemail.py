@@ -2,6 +2,7 @@ import datetime
 import itertools
 
 from django.contrib.auth import get_user_model
+from django.db import transaction
 from django.db.models import Q, F
 from django.urls import reverse
 
@@ -13,8 +14,13 @@ import post_office.models
 from django.conf import settings
 
 from tracker.models import *
+import tracker.cacheutil as cacheutil
+import tracker.mailutil as mailutil
 import tracker.viewutil as viewutil
 
+# how many mails are queued, marked as sent and logged together
+MAIL_BATCH_SIZE = 200
+
 def get_event_default_sender_email(event):
     if event and event.prizecoordinator:
         return event.prizecoordinator.email
@@ -28,6 +34,55 @@ def event_sender_replyto_defaults(event, sender=None, replyTo=None):
         replyTo = sender
     return sender, replyTo
 
+def _prefetch(objects, *related):
+    # querysets fetch what the mails show in the same query, anything else is used as it is
+    if hasattr(objects, 'select_related'):
+        return objects.select_related(*related)
+    return objects
+
+
+def send_mail_batches(event, mails, mailTemplate, sender, replyTo, Model=None, updates=None, verbosity=0, dry_run=False, batchSize=MAIL_BATCH_SIZE):
+    """
+    Sends a mail for each recipient, batchSize at a time. Each batch is queued with a single insert into the mail
+    queue, its objects are marked as mailed with a single UPDATE and its log messages are written together, all in
+    one transaction, so that a batch that fails to be queued is not marked as mailed either.
+
+    :param mails: (recipient address, template context, log message, the objects the mail is about) for each mail
+    :type mails: list[tuple]
+    :param Model: the model of the objects the mails are about
+    :param updates: the fields to set on those objects once they are mailed about, values may be F() of another
+        field of the same object
+    :type updates: dict
+    :return: the number of mails sent
+    :rtype: int
+    """
+    for start in range(0, len(mails), batchSize):
+        batch = mails[start:start + batchSize]
+        if verbosity > 0:
+            for recipient, context, message, objects in batch:
+                print(message)
+        if dry_run:
+            continue
+        with transaction.atomic():
+            mailutil.send_many([dict(recipients=[recipient], sender=sender, template=mailTemplate, context=context,
+                                     headers={'Reply-to': replyTo}) for recipient, context, message, objects in batch])
+            if Model and updates:
+                objects = [obj for mail in batch for obj in mail[3]]
+                Model.objects.filter(pk__in=[obj.pk for obj in objects]).update(**updates)
+                for obj in objects:
+                    for field, value in updates.items():
+                        setattr(obj, field, getattr(obj, value.name) if isinstance(value, F) else value)
+            for recipient, context, message, objects in batch:
+                viewutil.tracker_log('prize', message, event)
+        if verbosity > 0:
+            print('Mailed {0} of {1}'.format(start + len(batch), len(mails)))
+    if mails and Model and updates and not dry_run:
+        # the updates skip the save signals that would have done this
+        cacheutil.bump_version('prizes', event.id)
+        cacheutil.bump_version('api', event.id)
+    return len(mails)
+
+
 def prize_winners_with_email_pending(event):
     return PrizeWinner.objects.filter(prize__event=event, pendingcount__gt=0, emailsent=False)
 
@@ -102,20 +157,13 @@ def automail_prize_winners(event, prizeWinners, mailTemplate, sender=None, reply
     sender, replyTo = event_sender_replyto_defaults(event, sender, replyTo)
 
     winnerDict = {}
-    for prizeWinner in prizeWinners:
-        if prizeWinner.winner.id in list(winnerDict.keys()):
-            winList = winnerDict[prizeWinner.winner.id]
-        else:
-            winList = []
-            winnerDict[prizeWinner.winner.id] = winList
-        winList.append(prizeWinner)
-    for winnerk, prizesWon in winnerDict.items():
+    for prizeWinner in _prefetch(prizeWinners, 'winner', 'prize'):
+        winnerDict.setdefault(prizeWinner.winner_id, []).append(prizeWinner)
+    mails = []
+    for prizesWon in winnerDict.values():
         winner = prizesWon[0].winner
-        prizesList = []
         minAcceptDeadline = min(itertools.chain([x for x in [pw.accept_deadline_date() for pw in prizesWon] if x != None], [datetime.date.max]))
 
-        for prizeWon in prizesWon:
-            prizesList.append(prizeWon.prize)
         formatContext = {
             'event': event,
             'winner': winner,
@@ -125,20 +173,11 @@ def automail_prize_winners(event, prizeWinners, mailTemplate, sender=None, reply
             'reply_address': replyTo,
             'accept_deadline': minAcceptDeadline,
         }
-
-        if not dry_run:
-            post_office.mail.send(recipients=[winner.email], sender=sender,
-                              template=mailTemplate, context=formatContext, headers={'Reply-to': replyTo})
-
         message = 'Mailed donor {0} for prize wins {1}'.format(winner.id, list([pw.id for pw in prizesWon]))
+        mails.append((winner.email, formatContext, message, prizesWon))
 
-        if verbosity > 0:
-            print(message)
-        if not dry_run:
-            viewutil.tracker_log('prize', message, event)
-            for prizeWon in prizesWon:
-                prizeWon.emailsent = True
-                prizeWon.save()
+    send_mail_batches(event, mails, mailTemplate, sender, replyTo, PrizeWinner, {'emailsent': True},
+                      verbosity=verbosity, dry_run=dry_run)
 
 
 def prizes_with_submission_email_pending(event):
@@ -187,8 +226,12 @@ reply_address -- the address to reply to
 
 def automail_inactive_prize_handlers(event, inactiveUsers, mailTemplate, sender=None, replyTo=None, domain=settings.DOMAIN, verbosity=0, dry_run=False):
     sender, replyTo = event_sender_replyto_defaults(event, sender, replyTo)
+    prizesByHandler = {}
+    for prize in Prize.objects.filter(handler__in=inactiveUsers, event=event, state='ACCEPTED'):
+        prizesByHandler.setdefault(prize.handler_id, []).append(prize)
+    mails = []
     for inactiveUser in inactiveUsers:
-        eventPrizes = list(Prize.objects.filter(handler=inactiveUser, event=event, state='ACCEPTED'))
+        eventPrizes = prizesByHandler.get(inactiveUser.id, [])
         formatContext = {
             'event': event,
             'handler': inactiveUser,
@@ -197,14 +240,10 @@ def automail_inactive_prize_handlers(event, inactiveUsers, mailTemplate, sender=
             'prize_count': len(eventPrizes),
             'reply_address': replyTo,
         }
-        if not dry_run:
-            post_office.mail.send(recipients=[inactiveUser.email], sender=sender,
-                template=mailTemplate, context=formatContext, headers={'Reply-to': replyTo})
         message = 'Mailed prize handler {0} (#{1}) for account activation'.format(inactiveUser, inactiveUser.id)
-        if verbosity > 0:
-            print(message)
-        if not dry_run:
-            viewutil.tracker_log('prize', message, event)
+        mails.append((inactiveUser.email, formatContext, message, []))
+
+    send_mail_batches(event, mails, mailTemplate, sender, replyTo, verbosity=verbosity, dry_run=dry_run)
 
 def get_event_inactive_prize_handlers(event):
     return AuthUser.objects.filter(is_active=False, prize__event=event, prize__state='ACCEPTED').distinct()
@@ -285,12 +324,12 @@ def automail_prize_contributors(event, prizes, mailTemplate, domain=settings.DOM
     sender, replyTo = event_sender_replyto_defaults(event, sender, replyTo)
 
     handlerDict = {}
-    for prize in prizes:
+    for prize in _prefetch(prizes, 'handler'):
         if prize.handler:
             prizeList = handlerDict.setdefault(prize.handler, [])
             prizeList.append(prize)
+    mails = []
     for handler, prizeList in handlerDict.items():
-        denied = list([prize for prize in prizeList if prize.state == 'DENIED'])
         formatContext = {
             'user_index_url': domain + reverse('tracker:user_index'),
             'event': event,
@@ -299,17 +338,11 @@ def automail_prize_contributors(event, prizes, mailTemplate, domain=settings.DOM
             'denied_prizes': list([prize for prize in prizeList if prize.state == 'DENIED']),
             'reply_address': replyTo,
         }
-        if not dry_run:
-            post_office.mail.send(recipients=[handler.email], sender=sender,
-                template=mailTemplate, context=formatContext, headers={'Reply-to': replyTo})
         message = 'Mailed prize handler {0} for prizes {1}'.format(handler.id, list([p.id for p in prizeList]))
-        if verbosity > 0:
-            print(message)
-        if not dry_run:
-            viewutil.tracker_log('prize', message, event)
-            for prize in prizeList:
-                prize.acceptemailsent = True
-                prize.save()
+        mails.append((handler.email, formatContext, message, prizeList))
+
+    send_mail_batches(event, mails, mailTemplate, sender, replyTo, Prize, {'acceptemailsent': True},
+                      verbosity=verbosity, dry_run=dry_run)
 
 
 def prizes_with_winner_accept_email_pending(event):
@@ -372,10 +405,11 @@ def automail_winner_accepted_prize(event, prizeWinners, mailTemplate, domain=set
     sender, replyTo = event_sender_replyto_defaults(event, sender, replyTo)
 
     handlerDict = {}
-    for prizeWinner in prizeWinners:
+    for prizeWinner in _prefetch(prizeWinners, 'winner', 'prize', 'prize__handler'):
         if prizeWinner.prize.handler:
             prizeList = handlerDict.setdefault(prizeWinner.prize.handler, [])
             prizeList.append(prizeWinner)
+    mails = []
     for handler, prizeList in handlerDict.items():
         formatContext = {
             'user_index_url': domain + reverse('tracker:user_index'),
@@ -385,17 +419,11 @@ def automail_winner_accepted_prize(event, prizeWinners, mailTemplate, domain=set
             'event': event,
             'reply_address': replyTo,
         }
-        if not dry_run:
-            post_office.mail.send(recipients=[handler.email], sender=sender,
-                template=mailTemplate, context=formatContext, headers={'Reply-to': replyTo})
         message = 'Mailed handler {0} for prize accepts {1}'.format(handler.id, list([pw.id for pw in prizeList]))
-        if verbosity > 0:
-            print(message)
-        if not dry_run:
-            viewutil.tracker_log('prize', message, event)
-            for prizeWinner in prizeList:
-                prizeWinner.acceptemailsentcount = prizeWinner.acceptcount
-                prizeWinner.save()
+        mails.append((handler.email, formatContext, message, prizeList))
+
+    send_mail_batches(event, mails, mailTemplate, sender, replyTo, PrizeWinner,
+                      {'acceptemailsentcount': F('acceptcount')}, verbosity=verbosity, dry_run=dry_run)
 
 
 def prizes_with_shipping_email_pending(event):
@@ -445,9 +473,10 @@ def automail_shipping_email_notifications(event, prizeWinners, mailTemplate, dom
     sender, replyTo = event_sender_replyto_defaults(event, sender, replyTo)
 
     winnerDict = {}
-    for prizeWinner in prizeWinners:
+    for prizeWinner in _prefetch(prizeWinners, 'winner', 'prize'):
         prizeList = winnerDict.setdefault(prizeWinner.winner, [])
         prizeList.append(prizeWinner)
+    mails = []
     for winner, prizeList in winnerDict.items():
         formatContext = {
             'prize_wins': prizeList,
@@ -456,15 +485,8 @@ def automail_shipping_email_notifications(event, prizeWinners, mailTemplate, dom
             'event': event,
             'reply_address': replyTo,
         }
-        if not dry_run:
-            post_office.mail.send(recipients=[winner.email], sender=sender,
-                template=mailTemplate, context=formatContext, headers={'Reply-to': replyTo})
         message = 'Mailed donor {0} for prizes shipped {1}'.format(winner.id, list([pw.id for pw in prizeList]))
-        if verbosity > 0:
-            print(message)
-        if not dry_run:
-            viewutil.tracker_log('prize', message, event)
-            for prizeWinner in prizeList:
-                prizeWinner.shippingemailsent = True
-                prizeWinner.save()
+        mails.append((winner.email, formatContext, message, prizeList))
 
+    send_mail_batches(event, mails, mailTemplate, sender, replyTo, PrizeWinner, {'shippingemailsent': True},
+                      verbosity=verbosity, dry_run=dry_run)
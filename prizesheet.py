@@ -3,16 +3,13 @@ import tracker.models as models
 
 def GetAddress(donor):
   parts = [getattr(donor, 'address' + part, '') for part in ['street', 'city', 'state', 'country', 'zip']]
-  return '\n'.join([_f for _f in parts if _f])
+  return '\n'.join([str(_f) for _f in parts if _f])
 
 def WritePrizeSheet(event, filename):
-  prizes = models.Prize.objects.filter(event=event)
-  csvfile = open(filename, 'wb')
-  writer = csv.writer(csvfile, delimiter=',', quotechar='"')
-  writer.writerow(['Prize', 'Winner', 'Email', 'Address'])
-  for prize in prizes:
-    for prizewinner in prizes.get_winners():
+  prizeWinners = models.PrizeWinner.objects.filter(prize__event=event).select_related('prize', 'winner', 'winner__addresscountry').order_by('prize__name', 'pk')
+  with open(filename, 'w', newline='', encoding='utf-8') as csvfile:
+    writer = csv.writer(csvfile, delimiter=',', quotechar='"')
+    writer.writerow(['Prize', 'Winner', 'Email', 'Address'])
+    for prizewinner in prizeWinners.iterator():
       winner = prizewinner.winner
-      writer.writerow([prize.name.encode('utf-8'), (winner.firstname + ' ' + winner.lastname).encode('utf-8'), winner.email.encode('utf-8'), GetAddress(winner).encode('utf-8')])
-  csvfile.close()
-
+      writer.writerow([prizewinner.prize.name, winner.firstname + ' ' + winner.lastname, winner.email, GetAddress(winner)])
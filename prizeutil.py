@@ -1,9 +1,12 @@
+import bisect
 import datetime
 import pytz
 import random
 
+from . import cacheutil
 from . import util
 from .models import *
+from .models.event import TimestampField
 from functools import reduce
 
 def draw_prize(prize, seed=None):
@@ -58,3 +61,128 @@ def close_past_due_prize_winners(event, verbosity=0, dry_run=False):
             prizewinner.declinecount += prizewinner.pendingcount
             prizewinner.pendingcount = 0
             prizewinner.save()
+
+
+class PrizeWindowIndex(object):
+    """
+    Interval index over the accepted, undrawn prizes of a single event, answering which
+    prizes a donation received at a given time is eligible for without hitting the database.
+
+    A prize's window is the overlap of the span in which it is shown as current and the span
+    in which donations count towards its drawing. Window boundaries are kept sorted, and the
+    prizes active at every boundary and in every gap between two boundaries are precomputed,
+    so a lookup is a bisect plus copying out the matching prizes.
+    """
+
+    def __init__(self, prizes, runs):
+        """
+        :param prizes: the candidate prizes, in display order, with startrun/endrun loaded
+        :type prizes: list[Prize]
+        :param runs: every scheduled run of the event, in running order
+        :type runs: list[SpeedRun]
+        """
+        self.prizes = list(prizes)
+        positions = {run.id: i for i, run in enumerate(runs)}
+        windows = []
+        for prize in self.prizes:
+            windows.append(PrizeWindowIndex._prize_window(prize, runs, positions))
+        self.boundaries = sorted({t for window in windows if window for t in window})
+        # self._at[i] holds the prizes active exactly at boundaries[i], self._between[i] the
+        # prizes active strictly between boundaries[i - 1] and boundaries[i]; the final entry
+        # of _between covers everything after the last boundary
+        self._at = [[] for _ in self.boundaries]
+        self._between = [[] for _ in range(len(self.boundaries) + 1)]
+        for prize, window in zip(self.prizes, windows):
+            if window is False:
+                continue
+            if window is None:
+                for bucket in self._at + self._between:
+                    bucket.append(prize)
+                continue
+            lo = bisect.bisect_left(self.boundaries, window[0])
+            hi = bisect.bisect_left(self.boundaries, window[1])
+            for i in range(lo, hi + 1):
+                self._at[i].append(prize)
+            for i in range(lo + 1, hi + 1):
+                self._between[i].append(prize)
+
+    @staticmethod
+    def _prize_window(prize, runs, positions):
+        """
+        Returns the (start, end) window of the prize, None if it is not time restricted at
+        all, or False if it can never be current.
+        """
+        if prize.startrun_id and prize.endrun_id:
+            startrun, endrun = prize.startrun, prize.endrun
+            if not startrun.starttime or not endrun.endtime:
+                return False
+            shown = (startrun.starttime, endrun.endtime)
+            start_pos = positions.get(startrun.id)
+            end_pos = positions.get(endrun.id)
+            if start_pos:
+                prev_run = runs[start_pos - 1]
+                draw_start = prev_run.endtime - datetime.timedelta(
+                    milliseconds=TimestampField.time_string_to_int(prev_run.setup_time))
+            else:
+                draw_start = startrun.starttime
+            draw_end = endrun.endtime
+            if end_pos is None or end_pos == len(runs) - 1:
+                draw_end += datetime.timedelta(hours=1)  # covers finale speeches
+        elif prize.starttime and prize.endtime:
+            shown = draw_start, draw_end = (prize.starttime, prize.endtime)
+        elif not (prize.startrun_id or prize.endrun_id or prize.starttime or prize.endtime):
+            return None
+        else:
+            return False
+        start = max(shown[0], draw_start).astimezone(pytz.utc)
+        end = min(shown[1], draw_end).astimezone(pytz.utc)
+        if start > end:
+            return False
+        return start, end
+
+    def prizes_at(self, time):
+        """
+        :param time: the moment to look up, usually a donation's received time
+        :type time: datetime.datetime
+        :return: the prizes whose window contains the time, in display order
+        :rtype: list[Prize]
+        """
+        i = bisect.bisect_left(self.boundaries, time)
+        if i < len(self.boundaries) and self.boundaries[i] == time:
+            return list(self._at[i])
+        return list(self._between[i])
+
+
+def _build_prize_window_index(event_id):
+    prizes = Prize.objects.filter(event_id=event_id, state='ACCEPTED', prizewinner__isnull=True).select_related('startrun', 'endrun')
+    runs = SpeedRun.objects.filter(event_id=event_id, order__isnull=False).order_by('order')
+    return PrizeWindowIndex(list(prizes), list(runs))
+
+
+_prize_window_indexes = cacheutil.EventVersionedCache('prizes', _build_prize_window_index)
+
+
+def get_prize_window_index(event):
+    """
+    Returns the window index for the event, rebuilding it if any of the event's prizes,
+    prize winners, or runs have changed since it was last built in this process.
+
+    :param event: the event or its primary key
+    :type event: Event|int
+    :rtype: PrizeWindowIndex
+    """
+    return _prize_window_indexes.get(getattr(event, 'id', event))
+
+
+def get_current_prizes(event, time=None):
+    """
+    :param event: the event or its primary key
+    :type event: Event|int
+    :param time: the moment to look up, defaults to now
+    :type time: datetime.datetime
+    :return: the event's accepted, undrawn prizes that count donations received at the time
+    :rtype: list[Prize]
+    """
+    if time is None:
+        time = datetime.datetime.utcnow().replace(tzinfo=pytz.utc)
+    return get_prize_window_index(event).prizes_at(time)
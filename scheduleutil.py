@@ -0,0 +1,115 @@
+import bisect
+
+from . import cacheutil
+from .models import Bid, SpeedRun
+
+
+class ScheduleTimeline(object):
+    """
+    Sorted start and end times of the scheduled runs of an event, for answering the "which runs are on now / next"
+    questions of the feeds with a bisect instead of a query.
+
+    Runs are kept in schedule order. Runs of an event never overlap, so the end times are sorted as well; if they
+    somehow are not, `ordered` is False and callers should fall back to querying.
+    """
+
+    def __init__(self, runs):
+        """
+        :param runs: (id, starttime, endtime) of each scheduled run, in schedule order
+        :type runs: list[tuple[int, datetime.datetime, datetime.datetime]]
+        """
+        self.ids = [run[0] for run in runs]
+        self.starts = [run[1] for run in runs]
+        self.ends = [run[2] for run in runs]
+        self._positions = {runId: i for i, runId in enumerate(self.ids)}
+        self.ordered = all(self.starts[i] <= self.starts[i + 1] and self.ends[i] <= self.ends[i + 1]
+                           for i in range(len(runs) - 1))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def current_run(self, time):
+        """
+        :return: the id of the run on at the time, or None between runs and outside the schedule
+        :rtype: int|None
+        """
+        i = bisect.bisect_left(self.ends, time)
+        if i < len(self.ids) and self.starts[i] <= time:
+            return self.ids[i]
+        return None
+
+    def upcoming_runs(self, time, includeCurrent=True, maxRuns=None, minRuns=None, delta=None):
+        """
+        The runs that have not finished (or with `includeCurrent` off, not started) at the time, following the same
+        rules as filters.get_upcomming_runs: the runs ending within `delta`, but at least `minRuns` and at most
+        `maxRuns` of them.
+
+        :rtype: list[int]
+        """
+        if includeCurrent:
+            first = bisect.bisect_left(self.ends, time)
+        else:
+            first = bisect.bisect_left(self.starts, time)
+        if delta:
+            last = max(first, bisect.bisect_right(self.ends, time + delta))
+        else:
+            last = len(self.ids)
+        count = last - first
+        if maxRuns is not None and count > maxRuns:
+            last = first + maxRuns
+        elif minRuns is not None and count < minRuns:
+            last = first + minRuns
+        return self.ids[first:last]
+
+    def runs_within(self, start, end):
+        """
+        :return: the runs that are on at any point between the two times
+        :rtype: list[int]
+        """
+        return self.ids[bisect.bisect_left(self.ends, start):bisect.bisect_right(self.starts, end)]
+
+    def span(self, ids):
+        """
+        :return: the start of the first and end of the last of the given runs, or None if there are none
+        :rtype: tuple[datetime.datetime, datetime.datetime]|None
+        """
+        positions = sorted(self._positions[runId] for runId in ids if runId in self._positions)
+        if not positions:
+            return None
+        return self.starts[positions[0]], self.ends[positions[-1]]
+
+
+class EventSchedule(object):
+    """
+    The timeline of every scheduled run of an event, and of the ones that have open bids.
+    """
+
+    def __init__(self, runs, openBidRuns):
+        self.runs = ScheduleTimeline(runs)
+        self.bidRuns = ScheduleTimeline([run for run in runs if run[0] in openBidRuns])
+
+    @property
+    def ordered(self):
+        return self.runs.ordered
+
+
+def _build_event_schedule(event_id):
+    runs = SpeedRun.objects.filter(event_id=event_id, starttime__isnull=False, endtime__isnull=False).order_by(
+        'starttime', 'order').values_list('id', 'starttime', 'endtime')
+    openBidRuns = Bid.objects.filter(speedrun__event_id=event_id, state='OPENED').values_list('speedrun_id', flat=True)
+    return EventSchedule(list(runs), set(openBidRuns))
+
+
+_event_schedules = cacheutil.EventVersionedCache('schedule', _build_event_schedule)
+
+
+def get_event_schedule(event):
+    """
+    Returns the schedule timelines of the event, rebuilding them if any of the event's runs or bids have changed
+    since they were last built in this process.
+
+    :param event: the event or its primary key
+    :type event: Event|int
+    :rtype: EventSchedule
+    """
+    return _event_schedules.get(getattr(event, 'id', event))
@@ -183,6 +183,7 @@ function TrackerAPI(sitePrefix) {
 
   this.adminBaseURL = sitePrefix + "admin/tracker/";
   this.searchURL = sitePrefix + "admin/search_objects";
+  this.moderationStreamURL = sitePrefix + "admin/moderation_stream";
   this.editURL = sitePrefix + "admin/edit_object";
   this.addURL = sitePrefix + "admin/add_object";
   this.deleteURL = sitePrefix + "admin/delete_object";
@@ -203,6 +204,59 @@ function TrackerAPI(sitePrefix) {
     $.ajax(this.searchURL, params);
   };
   
+  /*
+    Follows one of the donation moderation feeds by polling it. getParams is called before each request and
+    should return the feed name and any other parameters (e.g. the event). onupdate is first called with the whole
+    feed and reset set to true, then only with the donations that changed and the ids of the ones that left the feed.
+    Call restart() on the returned object to start over with the whole feed, e.g. after changing the parameters.
+  */
+  this.watchModeration = function(getParams, onupdate, onerror) {
+    onerror = defaultFor(onerror, function(status, response){});
+
+    var self = this;
+    var cursor = null;
+    var current = null;
+
+    function poll() {
+      var data = encodeObjectAsHttp(getParams());
+      if (cursor !== null) {
+        data += "cursor=" + cursor;
+      }
+      var xhr = $.ajax(self.moderationStreamURL, {
+        "data" : data,
+        "dataType" : "json",
+        "success" : function(update) {
+          cursor = update.cursor;
+          onupdate(update.donations, update.removed, update.reset);
+          // the server answers straight away rather than holding a worker until something changes
+          setTimeout(poll, 3000);
+        },
+        "error" : function(xhr, status) {
+          if (status == "abort") {
+            return;
+          }
+          onerror(xhr.status, xhr.responseText);
+          // start over once the server is back, in case we missed anything
+          cursor = null;
+          setTimeout(poll, 5000);
+        },
+      });
+      current = xhr;
+    }
+
+    poll();
+
+    return {
+      "restart" : function() {
+        cursor = null;
+        if (current) {
+          current.abort();
+        }
+        poll();
+      },
+    };
+  };
+
   /*
     Calls the tracker object edit API
   */
@@ -4,6 +4,7 @@ from django.test import TransactionTestCase, RequestFactory
 from django.contrib.auth.models import User, Permission
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.admin.models import LogEntry, ADDITION as LogEntryADDITION, CHANGE as LogEntryCHANGE, DELETION as LogEntryDELETION
+import tracker.aggregateutil as aggregateutil
 import tracker.views.api
 import json
 import pytz
@@ -393,3 +394,65 @@ class TestEvent(APITestCase):
         self.assertEqual(event_data['count'], '1')
         self.assertEqual(event_data['max'], '5.00')
         self.assertEqual(event_data['avg'], '5.0')
+
+
+class TestBatch(APITestCase):
+
+    def batch(self, operations, **kwargs):
+        request = self.factory.post('/api/v1/batch', json.dumps(dict(kwargs, operations=operations)),
+                                    content_type='application/json')
+        request.user = self.super_user
+        return tracker.views.api.batch(request)
+
+    def test_add_and_edit(self):
+        runner = models.Runner.objects.create(name='PJ')
+        data = self.parseJSON(self.batch([
+            dict(action='add', type='runner', name='trihex'),
+            dict(action='edit', type='runner', id=runner.id, stream='https://twitch.tv/pj'),
+        ]))
+        self.assertEqual([200, 200], [result['status'] for result in data['results']])
+        self.assertEqual('trihex', data['results'][0]['objects'][0]['fields']['name'])
+        self.assertEqual('https://twitch.tv/pj', models.Runner.objects.get(pk=runner.pk).stream)
+        self.assertEqual(3, LogEntry.objects.count())
+
+    def test_atomic_failure_rolls_back(self):
+        runner = models.Runner.objects.create(name='PJ')
+        data = self.parseJSON(self.batch([
+            dict(action='delete', type='runner', id=runner.id),
+            dict(action='delete', type='runner', id=runner.id + 100),
+        ]), status_code=400)
+        self.assertEqual(1, data['operation'])
+        self.assertEqual('Foreign Key relation could not be found', data['error'])
+        self.assertTrue(models.Runner.objects.filter(pk=runner.pk).exists())
+        self.assertFalse(LogEntry.objects.exists())
+
+    def test_savepoints(self):
+        runner = models.Runner.objects.create(name='PJ')
+        data = self.parseJSON(self.batch([
+            dict(action='delete', type='runner', id=runner.id + 100),
+            dict(action='delete', type='runner', id=runner.id),
+            dict(action='explode', type='runner', id=runner.id),
+        ], atomic=False))
+        self.assertEqual([400, 200, 400], [result['status'] for result in data['results']])
+        self.assertFalse(models.Runner.objects.filter(pk=runner.pk).exists())
+        entry = LogEntry.objects.get()
+        self.assertEqual(int(entry.object_id), runner.id)
+        self.assertEqual(entry.action_flag, LogEntryDELETION)
+
+    def test_too_many_operations(self):
+        operations = [dict(action='delete', type='runner', id=1)] * (tracker.views.api.BATCH_MAX_OPERATIONS + 1)
+        self.parseJSON(self.batch(operations), status_code=400)
+
+    def test_deferred_aggregates(self):
+        donor = models.Donor.objects.create(email='donor@example.com')
+        bid = models.Bid.objects.create(event=self.event, name='Bid', state='OPENED', istarget=True)
+        with aggregateutil.deferred_aggregates():
+            for amount in (5, 10):
+                donation = models.Donation.objects.create(event=self.event, donor=donor, amount=amount,
+                                                          domainId=str(amount), transactionstate='COMPLETED')
+                models.DonationBid.objects.create(donation=donation, bid=bid, amount=amount)
+            self.assertFalse(models.DonorCache.objects.exists())
+            self.assertEqual(0, models.Bid.objects.get(pk=bid.pk).total)
+        self.assertEqual(15, models.DonorCache.objects.get(event=self.event, donor=donor).donation_total)
+        self.assertEqual(2, models.DonorCache.objects.get(event=None, donor=donor).donation_count)
+        self.assertEqual(15, models.Bid.objects.get(pk=bid.pk).total)
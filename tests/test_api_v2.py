@@ -0,0 +1,151 @@
+import datetime
+from decimal import Decimal
+
+import pytz
+from django.contrib.auth.models import Permission, User
+from django.core.cache import cache
+from django.db import connection
+from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+import tracker.models as models
+
+
+class TestSpeedRunViewSet(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        start = datetime.datetime(2018, 1, 1, 12, tzinfo=pytz.utc)
+        self.event = models.Event.objects.create(short='ev', name='Event', targetamount=5, datetime=start)
+        self.other_event = models.Event.objects.create(short='other', name='Other', targetamount=5,
+                                                       datetime=start + datetime.timedelta(days=30))
+        self.runners = [models.Runner.objects.create(name='runner%d' % i) for i in range(3)]
+        self.runs = []
+        for i in range(5):
+            run = models.SpeedRun.objects.create(event=self.event, name='Run %d' % i, run_time='0:30:00', order=i + 1)
+            run.runners.add(*self.runners[:i % 3 + 1])
+            self.runs.append(run)
+        models.SpeedRun.objects.create(event=self.other_event, name='Other Run', run_time='0:30:00', order=1)
+
+    def get(self, **params):
+        response = self.client.get(reverse('tracker:speedrun-list'), params)
+        self.assertEqual(200, response.status_code)
+        return response.json()
+
+    def test_queries_do_not_grow_with_results(self):
+        # event lookup, page, runners
+        with self.assertNumQueries(3):
+            data = self.get(event=self.event.id)
+        self.assertEqual([run.id for run in self.runs], [run['id'] for run in data['results']])
+        self.assertEqual(['runner0', 'runner1'], [runner['name'] for runner in data['results'][1]['runners']])
+        self.assertEqual('ev', data['results'][0]['event']['short'])
+
+    def test_cursor_pagination(self):
+        data = self.get(limit=4)
+        self.assertEqual(4, len(data['results']))
+        self.assertIsNone(data['previous'])
+        rest = self.client.get(data['next']).json()
+        self.assertEqual(2, len(rest['results']))
+        self.assertIsNone(rest['next'])
+
+    def test_event_filter(self):
+        self.assertEqual(['Other Run'], [run['name'] for run in self.get(event='other')['results']])
+        runners = self.client.get(reverse('tracker:runner-list'), {'event': self.event.id}).json()
+        self.assertEqual(3, len(runners['results']))
+        self.assertEqual(404, self.client.get(reverse('tracker:speedrun-list'), {'event': 'nope'}).status_code)
+
+    def test_pages_are_cached_until_the_event_changes(self):
+        self.get(event=self.event.id)
+        with self.assertNumQueries(1):
+            self.get(event=self.event.id)
+        self.runners[0].name = 'renamed'
+        self.runners[0].save()
+        data = self.get(event=self.event.id)
+        self.assertEqual('renamed', data['results'][0]['runners'][0]['name'])
+        self.runs[0].runners.remove(self.runners[0])
+        self.assertEqual([], self.get(event=self.event.id)['results'][0]['runners'])
+
+    def test_include_sideloads_each_object_once(self):
+        # event lookup, page, event, runners
+        with self.assertNumQueries(4):
+            data = self.get(event=self.event.id, include='runners,event')
+        results = data['results']
+        self.assertEqual([run.id for run in self.runs], [run['id'] for run in results['speedruns']])
+        self.assertEqual([self.runners[0].id, self.runners[1].id], results['speedruns'][1]['runners'])
+        self.assertEqual([self.event.id], results['speedruns'][0]['event'])
+        self.assertEqual([runner.id for runner in self.runners], [runner['id'] for runner in results['runners']])
+        self.assertEqual([self.event.id], [event['id'] for event in results['event']])
+
+        data = self.client.get(reverse('tracker:speedrun-detail', args=(self.runs[2].id,)), {'include': 'runners'})
+        self.assertEqual(3, len(data.json()['runners']))
+        response = self.client.get(reverse('tracker:speedrun-list'), {'include': 'name'})
+        self.assertEqual(400, response.status_code)
+
+
+class TestSearchableViewSets(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        start = datetime.datetime(2018, 1, 1, 12, tzinfo=pytz.utc)
+        self.event = models.Event.objects.create(short='ev', name='Event', targetamount=5, datetime=start)
+        self.run = models.SpeedRun.objects.create(event=self.event, name='Run', run_time='0:30:00', order=1)
+        self.donor = models.Donor.objects.create(email='donor@example.com', alias='Donor', visibility='ALIAS')
+        self.donations = [models.Donation.objects.create(
+            event=self.event, donor=self.donor, amount=Decimal(amount), domainId=amount, currency='GBP',
+            transactionstate='COMPLETED', comment='Hi', commentstate=state, modcomment='secret',
+            timereceived=start + datetime.timedelta(minutes=minutes))
+            for amount, state, minutes in (('5.00', 'APPROVED', 0), ('10.00', 'PENDING', 10), ('15.00', 'DENIED', 20))]
+        models.Donation.objects.create(event=self.event, donor=self.donor, amount=Decimal('1.00'), domainId='pending',
+                                       currency='GBP', transactionstate='PENDING')
+        self.bid = models.Bid.objects.create(speedrun=self.run, name='Bid', state='OPENED')
+        self.option = models.Bid.objects.create(parent=self.bid, speedrun=self.run, name='Option', state='OPENED',
+                                                istarget=True)
+        models.Bid.objects.create(speedrun=self.run, name='Hidden', state='HIDDEN', istarget=True)
+        self.prize = models.Prize.objects.create(event=self.event, name='Prize', state='ACCEPTED', extrainfo='secret')
+
+    def get(self, name, **params):
+        response = self.client.get(reverse('tracker:%s-list' % name), params)
+        self.assertEqual(200, response.status_code, response.content)
+        return response.json()['results']
+
+    def test_donations_are_private(self):
+        donations = self.get('donation', event=self.event.short)
+        self.assertEqual([d.id for d in self.donations], [donation['id'] for donation in donations])
+        self.assertEqual(['Hi', None, None], [donation['comment'] for donation in donations])
+        self.assertNotIn('modcomment', donations[0])
+        self.assertNotIn('domainId', donations[0])
+
+        user = User.objects.create(username='admin')
+        user.user_permissions.add(Permission.objects.get(codename='can_search'))
+        self.client.force_login(user)
+        donations = self.get('donation', event=self.event.short)
+        self.assertEqual(4, len(donations))
+        self.assertEqual('secret', donations[0]['modcomment'])
+
+    def test_sparse_fieldsets(self):
+        with CaptureQueriesContext(connection) as queries:
+            donations = self.get('donation', fields='amount,comment')
+        self.assertEqual({'type', 'id', 'amount', 'comment'}, set(donations[0].keys()))
+        self.assertEqual([None, None], [donations[1]['comment'], donations[2]['comment']])
+        select = queries.captured_queries[-1]['sql']
+        self.assertIn('commentstate', select)
+        self.assertNotIn('modcomment', select)
+
+    def test_since(self):
+        donations = self.get('donation', since=self.donations[0].id)
+        self.assertEqual([d.id for d in self.donations[1:]], [donation['id'] for donation in donations])
+        donations = self.get('donation', since=self.donations[2].timereceived.isoformat())
+        self.assertEqual([self.donations[2].id], [donation['id'] for donation in donations])
+        response = self.client.get(reverse('tracker:prize-list'), {'since': '2018-01-01T00:00:00'})
+        self.assertEqual(400, response.status_code)
+
+    def test_bids_and_prizes(self):
+        bids = self.get('bid', event=self.event.id, fields='name,parent,level')
+        self.assertEqual({'Bid': [None, 0], 'Option': [self.bid.id, 1]},
+                         {bid['name']: [bid['parent'], bid['level']] for bid in bids})
+        prizes = self.get('prize', event=self.event.id)
+        self.assertEqual([self.prize.id], [prize['id'] for prize in prizes])
+        self.assertNotIn('extrainfo', prizes[0])
@@ -0,0 +1,74 @@
+import datetime
+import os
+import shutil
+import tempfile
+from io import StringIO
+
+import pytz
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+
+import tracker.archiveutil as archiveutil
+import tracker.models as models
+
+
+class TestArchive(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.event = models.Event.objects.create(short='ev', name='Event', targetamount=5,
+                                                 datetime=datetime.datetime(2018, 1, 1, 12, tzinfo=pytz.utc))
+        self.now = timezone.now()
+        for days in range(9, -1, -1):
+            models.Log.objects.create(category='paypal' if days % 2 else 'other', message='%d days old' % days,
+                                      event=self.event, timestamp=self.now - datetime.timedelta(days=days))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_archive(self):
+        archived = archiveutil.archive('log', datetime.timedelta(days=4, hours=12), self.directory, chunkSize=2)
+        self.assertEqual(5, archived)
+        self.assertEqual(5, models.Log.objects.count())
+        self.assertFalse(models.Log.objects.filter(timestamp__lt=self.now - datetime.timedelta(days=4)).exists())
+        self.assertEqual(3, len(os.listdir(self.directory)))
+
+        read = list(archiveutil.read_archive('log', self.directory))
+        self.assertEqual(['%d days old' % days for days in range(9, 4, -1)], [log.message for log in read])
+        self.assertEqual(self.event.id, read[0].event_id)
+        self.assertFalse(models.Log.objects.filter(pk=read[0].pk).exists())
+
+    def test_read_filters(self):
+        archiveutil.archive('log', datetime.timedelta(days=0), self.directory)
+        since = self.now - datetime.timedelta(days=6, hours=12)
+        until = self.now - datetime.timedelta(days=2, hours=12)
+        self.assertEqual(['5 days old', '3 days old'], [
+            log.message for log in archiveutil.read_archive('log', self.directory, since, until, category='paypal')])
+        self.assertEqual(5, len(list(archiveutil.read_archive('log', self.directory, event=self.event.id,
+                                                              category='other'))))
+
+    def test_files_by_time(self):
+        archiveutil.archive('log', datetime.timedelta(days=0), self.directory, chunkSize=5)
+        self.assertEqual(2, len(archiveutil.archive_files('log', self.directory)))
+        self.assertEqual(1, len(archiveutil.archive_files('log', self.directory,
+                                                          since=self.now - datetime.timedelta(days=2))))
+        self.assertEqual([], archiveutil.archive_files('ipn', self.directory))
+
+    def test_queued_ipns(self):
+        old = self.now - datetime.timedelta(days=100)
+        for state in ('DONE', 'DUPLICATE', 'FAILED', 'PENDING'):
+            models.QueuedIPN.objects.create(state=state, txn_id=state, received=old)
+        models.QueuedIPN.objects.create(state='DONE', txn_id='recent')
+        self.assertEqual(2, archiveutil.archive('queuedipn', directory=self.directory))
+        self.assertEqual(['FAILED', 'PENDING', 'recent'],
+                         sorted(models.QueuedIPN.objects.values_list('txn_id', flat=True)))
+
+    def test_commands(self):
+        out = StringIO()
+        call_command('archive_records', policy=['log'], age=4.5, dry_run=True, stdout=out)
+        self.assertEqual(10, models.Log.objects.count())
+        call_command('archive_records', policy=['log'], age=4.5, directory=self.directory, verbosity=0)
+        self.assertEqual(5, models.Log.objects.count())
+        call_command('read_archive', 'log', directory=self.directory, field=['category=paypal'], stdout=out)
+        self.assertEqual(3, out.getvalue().count('"tracker.log"'))
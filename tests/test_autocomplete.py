@@ -0,0 +1,60 @@
+import datetime
+
+import pytz
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+import tracker.autocompleteutil as autocompleteutil
+import tracker.models as models
+
+
+class TestAutocomplete(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='admin', is_superuser=True, is_staff=True)
+        self.byLastName = models.Donor.objects.create(email='contains@example.com', firstname='Jimmy', lastname='Sam')
+        self.prefix = models.Donor.objects.create(email='samantha@example.com', firstname='Jo', lastname='Smith')
+        self.exact = models.Donor.objects.create(email='someone@example.com', alias='Sam', firstname='Al')
+        models.Donor.objects.create(email='other@example.com', firstname='Nobody')
+
+    def test_ranking(self):
+        # a last name of 'Sam' is as exact a match as an alias of 'Sam'
+        results = autocompleteutil.autocomplete('donor', ' SAM', user=self.user)
+        self.assertEqual({self.exact, self.byLastName}, set(results[:2]))
+        self.assertEqual(self.prefix, results[2])
+        self.assertEqual(3, len(results))
+
+    def test_substring(self):
+        results = autocompleteutil.autocomplete('donor', 'immy', user=self.user)
+        self.assertEqual([self.byLastName], results)
+
+    @override_settings(AUTOCOMPLETE_MAX_RESULTS=5)
+    def test_cap(self):
+        for i in range(10):
+            models.Donor.objects.create(email='bulk%d@example.com' % i)
+        self.assertEqual(5, len(autocompleteutil.autocomplete('donor', 'bulk', user=self.user)))
+
+    def test_narrowing(self):
+        autocompleteutil.autocomplete('donor', 's', user=self.user)
+        # picking the results out of the last search only takes the query for the objects themselves
+        with self.assertNumQueries(1):
+            results = autocompleteutil.autocomplete('donor', 'sa', user=self.user)
+        self.assertEqual({self.exact, self.byLastName, self.prefix}, set(results))
+        with self.assertNumQueries(1):
+            self.assertEqual([self.prefix], autocompleteutil.autocomplete('donor', 'saman', user=self.user))
+        # other users do their own searches
+        other = User.objects.create(username='other', is_superuser=True, is_staff=True)
+        with self.assertNumQueries(4):
+            autocompleteutil.autocomplete('donor', 'sa', user=other)
+
+    def test_event_filter(self):
+        event = models.Event.objects.create(short='ev', name='Event', targetamount=5,
+                                            datetime=datetime.datetime(2018, 1, 1, 12, tzinfo=pytz.utc))
+        otherEvent = models.Event.objects.create(short='other', name='Other Event', targetamount=5,
+                                                 datetime=datetime.datetime(2018, 2, 1, 12, tzinfo=pytz.utc))
+        run = models.SpeedRun.objects.create(event=event, name='Super Metroid', run_time='1:00:00')
+        otherRun = models.SpeedRun.objects.create(event=otherEvent, name='Metroid Prime', run_time='1:00:00')
+        self.assertEqual([otherRun, run], autocompleteutil.autocomplete('run', 'metroid', user=self.user))
+        self.assertEqual([run], autocompleteutil.autocomplete('run', 'metroid', {'event': event.id}, user=self.user))
@@ -0,0 +1,88 @@
+import datetime
+
+import pytz
+from django.contrib.admin.models import LogEntry
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.urls import reverse
+
+import tracker.bulkutil as bulkutil
+import tracker.models as models
+
+
+class TestBulkStates(TestCase):
+
+    def setUp(self):
+        self.event = models.Event.objects.create(short='ev', name='Event', targetamount=5,
+                                                 datetime=datetime.datetime(2018, 1, 1, 12, tzinfo=pytz.utc))
+        self.run = models.SpeedRun.objects.create(event=self.event, name='Test Run', run_time='0:45:00', order=1)
+        self.donor = models.Donor.objects.create(email='johndoe@example.com', firstname='John', lastname='Doe')
+        self.donation = models.Donation.objects.create(donor=self.donor, event=self.event, amount=5,
+                                                       transactionstate='COMPLETED')
+        self.parent = models.Bid.objects.create(name='Parent', speedrun=self.run, state='OPENED')
+        self.opened = models.Bid.objects.create(name='Opened', istarget=True, parent=self.parent, state='OPENED')
+        self.closed = models.Bid.objects.create(name='Closed', istarget=True, parent=self.parent, state='CLOSED')
+        self.hidden = models.Bid.objects.create(name='Hidden', istarget=True, parent=self.parent, state='HIDDEN')
+        self.denied = models.Bid.objects.create(name='Denied', istarget=True, parent=self.parent, state='DENIED')
+        models.DonationBid.objects.create(donation=self.donation, bid=self.opened, amount=2)
+        models.DonationBid.objects.create(donation=self.donation, bid=self.hidden, amount=3)
+        self.user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+
+    def assertStates(self, **states):
+        for name, state in states.items():
+            self.assertEqual(state, models.Bid.objects.get(pk=getattr(self, name).pk).state, msg=name)
+
+    def parentBids(self):
+        return models.Bid.objects.filter(pk=self.parent.pk)
+
+    def test_close(self):
+        self.parent.refresh_from_db()
+        self.assertEqual(2, self.parent.total)
+        self.assertEqual(1, bulkutil.set_bid_state(self.parentBids(), 'CLOSED'))
+        self.assertStates(parent='CLOSED', opened='CLOSED', closed='CLOSED', hidden='CLOSED', denied='DENIED')
+        self.parent.refresh_from_db()
+        # the formerly hidden option counts now
+        self.assertEqual(5, self.parent.total)
+        self.assertEqual(0, bulkutil.set_bid_state(self.parentBids(), 'CLOSED'))
+
+    def test_hide_and_reveal(self):
+        bulkutil.set_bid_state(self.parentBids(), 'HIDDEN')
+        self.parent.refresh_from_db()
+        self.assertEqual(0, self.parent.total)
+        self.assertEqual(0, self.parent.count)
+        bulkutil.set_bid_state(self.parentBids(), 'OPENED')
+        self.assertStates(parent='OPENED', closed='OPENED', hidden='OPENED', denied='DENIED')
+        self.parent.refresh_from_db()
+        self.assertEqual(5, self.parent.total)
+        self.assertIsNotNone(self.parent.revealedtime)
+
+    def test_open_met_challenge(self):
+        challenge = models.Bid.objects.create(name='Challenge', speedrun=self.run, istarget=True, goal=5,
+                                              state='HIDDEN')
+        models.DonationBid.objects.create(donation=self.donation, bid=challenge, amount=5)
+        bulkutil.set_bid_state(models.Bid.objects.filter(pk=challenge.pk), 'OPENED')
+        self.assertEqual('CLOSED', models.Bid.objects.get(pk=challenge.pk).state)
+
+    def test_bid_admin_action(self):
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('admin:tracker_bid_changelist'),
+                                    {'action': 'bid_close_action', '_selected_action': [self.parent.pk]})
+        self.assertEqual(302, response.status_code)
+        self.assertStates(parent='CLOSED', opened='CLOSED')
+        entry = LogEntry.objects.get()
+        self.assertEqual(self.user, entry.user)
+        self.assertEqual(str(self.parent.pk), entry.object_id)
+
+    def test_donation_admin_action(self):
+        other = models.Donation.objects.create(donor=self.donor, event=self.event, amount=5, domainId='other',
+                                               transactionstate='COMPLETED', readstate='READ')
+        changes = models.DonationChange.objects.count()
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('admin:tracker_donation_changelist'),
+                                    {'action': 'set_readstate_read', '_selected_action': [self.donation.pk, other.pk]})
+        self.assertEqual(302, response.status_code)
+        self.assertEqual('READ', models.Donation.objects.get(pk=self.donation.pk).readstate)
+        # only the donation that changed shows up in the moderation feeds and the log
+        self.assertEqual([self.donation.pk], list(models.DonationChange.objects.order_by('id')[changes:].values_list(
+            'donation_id', flat=True)))
+        self.assertEqual(str(self.donation.pk), LogEntry.objects.get().object_id)
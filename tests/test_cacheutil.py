@@ -0,0 +1,34 @@
+from django.test import SimpleTestCase, override_settings
+
+import tracker.cacheutil as cacheutil
+
+
+class TestEventVersionedCache(SimpleTestCase):
+
+    def setUp(self):
+        self.builds = []
+        self.cache = cacheutil.EventVersionedCache('test', self.build)
+
+    def build(self, eventId):
+        self.builds.append(eventId)
+        return len(self.builds)
+
+    def test_rebuilt_on_version_change(self):
+        self.assertEqual(1, self.cache.get(1))
+        self.assertEqual(1, self.cache.get(1))
+        cacheutil.bump_version('test', 1)
+        self.assertEqual(2, self.cache.get(1))
+
+    def test_rebuilt_once_too_old(self):
+        self.assertEqual(1, self.cache.get(1))
+        # a change another process made that this one never heard of
+        with override_settings(EVENT_CACHE_MAX_AGE=0):
+            self.assertEqual(2, self.cache.get(1))
+        self.assertEqual(2, self.cache.get(1))
+
+    def test_process_local_warning(self):
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            self.assertEqual(['tracker.W001'], [warning.id for warning in cacheutil.check_shared_cache(None)])
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+                                                   'LOCATION': 'cache'}}):
+            self.assertEqual([], cacheutil.check_shared_cache(None))
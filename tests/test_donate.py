@@ -1,3 +1,8 @@
+import datetime
+
+import pytz
+
+import tracker.donateutil as donateutil
 import tracker.models as models
 import tracker.forms as forms
 
@@ -19,3 +24,41 @@ class TestDonorNameAssignment(TransactionTestCase):
         self.assertTrue(form.is_valid())
         self.assertEqual(form.cleaned_data['requestedvisibility'], 'ANON')
         self.assertFalse(bool(form.cleaned_data['requestedalias']))
+
+
+class TestDonationMenu(TransactionTestCase):
+
+    def setUp(self):
+        self.event = models.Event.objects.create(short='ev', name='Event', targetamount=5,
+                                                 datetime=datetime.datetime(2018, 1, 1, 12, tzinfo=pytz.utc))
+        self.run = models.SpeedRun.objects.create(event=self.event, name='Run', run_time='0:30:00', order=1)
+        self.war = models.Bid.objects.create(event=self.event, speedrun=self.run, name='Name File', allowuseroptions=True)
+        self.option_a = models.Bid.objects.create(parent=self.war, event=self.event, speedrun=self.run, name='A', istarget=True)
+        self.option_b = models.Bid.objects.create(parent=self.war, event=self.event, speedrun=self.run, name='B', istarget=True)
+        self.hidden = models.Bid.objects.create(parent=self.war, event=self.event, speedrun=self.run, name='C', istarget=True, state='PENDING')
+        self.challenge = models.Bid.objects.create(event=self.event, name='Challenge', istarget=True, goal=Decimal('100.00'))
+
+    def test_menu_contents(self):
+        menu = donateutil.get_donation_menu(self.event)
+        self.assertEqual([self.challenge, self.war], menu.bids)
+        self.assertEqual([self.option_a, self.option_b], menu.bids[1].options_list)
+        self.assertEqual(['Event Wide', 'Run'], [run.name for run in menu.runs])
+        self.assertEqual({self.war, self.option_a, self.option_b, self.challenge}, set(menu.targets))
+        with self.assertNumQueries(0):
+            menu = donateutil.get_donation_menu(self.event)
+            self.assertEqual('Run : Name File -- B', menu.options[self.option_b.id].full_label(False))
+
+    def test_menu_follows_bid_changes(self):
+        donateutil.get_donation_menu(self.event)
+        self.hidden.state = 'OPENED'
+        self.hidden.save()
+        self.assertEqual([self.option_a, self.option_b, self.hidden], donateutil.get_donation_menu(self.event).bids[1].options_list)
+
+    def test_bid_form_uses_menu(self):
+        menu = donateutil.get_donation_menu(self.event)
+        data = {'bid_amt_{0}'.format(self.option_a.id): '3.00', 'bid_amt_{0}'.format(self.challenge.id): '3.00'}
+        form = forms.DonationBidFormV2(amount=Decimal('5.00'), bids=menu.bids, data=data)
+        self.assertNotIn('bid_amt_{0}'.format(self.hidden.id), form.fields)
+        self.assertFalse(form.is_valid())
+        form = forms.DonationBidFormV2(amount=Decimal('6.00'), bids=menu.bids, data=data)
+        self.assertTrue(form.is_valid())
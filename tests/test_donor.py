@@ -2,7 +2,7 @@ from django.contrib.auth.models import AnonymousUser, User
 from django.urls import reverse
 from django.test import RequestFactory
 
-from .. import models, views, randgen, viewutil
+from .. import models, views, randgen, viewutil, donorutil
 from ..templatetags.donation_tags import donor_link
 
 from django.test import TransactionTestCase
@@ -257,3 +257,50 @@ class TestDonorAdmin(TransactionTestCase):
         self.assertEqual(response.status_code, 200)
         response = self.client.get(reverse('admin:tracker_donation_change', args=(self.donation.id,)))
         self.assertEqual(response.status_code, 200)
+
+
+class TestDonorIdentity(TransactionTestCase):
+    def setUp(self):
+        self.donor = models.Donor.objects.create(
+            alias='SomeBody', email='Some.Body@Example.com', paypalemail='Pay.Body@Example.com')
+
+    def test_keys_are_normalized(self):
+        self.assertEqual('somebody', self.donor.aliaskey)
+        self.assertEqual('some.body@example.com', self.donor.emailkey)
+        self.assertEqual('pay.body@example.com', self.donor.paypalemailkey)
+        self.assertEqual(self.donor, donorutil.find_donor_by_alias(' somebody '))
+        self.assertEqual(self.donor, donorutil.find_donor_by_email('SOME.BODY@example.com'))
+        self.assertEqual(self.donor, donorutil.find_donor_by_paypal_email('pay.body@EXAMPLE.com'))
+        self.assertIsNone(donorutil.find_donor_by_alias(''))
+        self.assertEqual([self.donor], viewutil.find_people(['SOMEBODY', 'nobody']))
+
+    def test_unique_alias(self):
+        self.assertEqual('Nobody', donorutil.unique_alias('Nobody'))
+        self.assertEqual('SomeBody', donorutil.unique_alias('SomeBody', exclude_donor=self.donor))
+        self.assertEqual('somebody1', donorutil.unique_alias('somebody'))
+        models.Donor.objects.create(alias='SOMEBODY1')
+        models.Donor.objects.create(alias='somebody3')
+        self.assertEqual('somebody2', donorutil.unique_alias('somebody'))
+        long_alias = 'x' * 32
+        models.Donor.objects.create(alias=long_alias)
+        self.assertEqual('x' * 31 + '1', donorutil.unique_alias(long_alias))
+
+    def test_get_or_create_paypal_donor(self):
+        self.assertEqual((self.donor, False), donorutil.get_or_create_paypal_donor('PAY.BODY@example.com'))
+        donor, created = donorutil.get_or_create_paypal_donor('New@Example.com', defaults={'email': 'new@example.com'})
+        self.assertTrue(created)
+        self.assertEqual('new@example.com', donor.paypalemail)
+
+    def test_resolve_donors(self):
+        donors = donorutil.resolve_donors([
+            {'email': 'some.body@example.com'},
+            {'alias': 'Newcomer', 'email': 'newcomer@example.com'},
+            {'alias': 'NEWCOMER'},
+            {'firstname': 'No identity'},
+        ])
+        self.assertEqual(self.donor, donors[0])
+        self.assertIsNotNone(donors[1].pk)
+        self.assertIs(donors[1], donors[2])
+        self.assertIsNone(donors[3])
+        self.assertEqual(2, models.Donor.objects.count())
+        self.assertEqual('newcomer', models.Donor.objects.get(pk=donors[1].pk).aliaskey)
@@ -0,0 +1,88 @@
+import csv
+import datetime
+import os
+import tempfile
+
+import pytz
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+import tracker.exportutil as exportutil
+import tracker.models as models
+import tracker.prizesheet as prizesheet
+
+
+class TestExport(TestCase):
+
+    def setUp(self):
+        self.event = models.Event.objects.create(short='ev', name='Event', targetamount=5,
+                                                 datetime=datetime.datetime(2018, 1, 1, 12, tzinfo=pytz.utc))
+        self.donor = models.Donor.objects.create(email='donor@example.com', alias='Alias', firstname='First',
+                                                 lastname='Last', visibility='ALIAS', addresscity='Manchester')
+        for i in range(5):
+            models.Donation.objects.create(donor=self.donor, event=self.event, amount=5 + i, domainId=str(i),
+                                           transactionstate='COMPLETED', comment='Comment %d' % i,
+                                           commentstate='APPROVED' if i % 2 else 'PENDING')
+        self.superuser = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.staff = User.objects.create(username='staff', is_staff=True)
+
+    def read(self, name, user=None, params=None):
+        rows = list(csv.reader(''.join(exportutil.stream_csv(name, params, user)).splitlines()))
+        return [dict(zip(rows[0], row)) for row in rows[1:]]
+
+    def test_donations(self):
+        rows = self.read('donation')
+        self.assertEqual(5, len(rows))
+        self.assertEqual(('donor@example.com', 'Last', 'Comment 0'),
+                         (rows[0]['donor__email'], rows[0]['donor__lastname'], rows[0]['comment']))
+
+    def test_private_fields(self):
+        self.assertNotIn('donor__email', exportutil.export_columns('donation', self.staff))
+        rows = self.read('donation', self.staff)
+        self.assertEqual(5, len(rows))
+        self.assertEqual(('', 'Alias', ''), (rows[0]['donor__lastname'], rows[0]['donor__public'], rows[0]['comment']))
+        self.assertEqual('Comment 1', rows[1]['comment'])
+        self.assertNotIn('domainId', rows[0])
+        self.assertEqual(['id', 'public', 'alias', 'firstname', 'lastname', 'visibility'],
+                         exportutil.export_columns('donor', self.staff))
+
+    def test_chunks(self):
+        rows = list(exportutil.export_rows('donation', {'event': self.event.id}, chunkSize=2))
+        self.assertEqual(['5.00', '6.00', '7.00', '8.00', '9.00'],
+                         [str(row[exportutil.export_columns('donation').index('amount')]) for row in rows])
+
+    def test_runs(self):
+        run = models.SpeedRun.objects.create(event=self.event, name='Run', run_time='0:10:00', order=1)
+        run.runners.add(models.Runner.objects.create(name='Zed'), models.Runner.objects.create(name='Amy'))
+        self.assertEqual('Amy, Zed', self.read('run')[0]['runners'])
+
+    def test_prize_winners(self):
+        prize = models.Prize.objects.create(event=self.event, name='Prize')
+        models.PrizeWinner.objects.create(prize=prize, winner=self.donor)
+        self.assertEqual('Manchester', self.read('prizewinner')[0]['winner__addresscity'])
+        self.assertNotIn('winner__addresscity', self.read('prizewinner', self.staff)[0])
+
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'prizes.csv')
+        prizesheet.WritePrizeSheet(self.event, path)
+        with open(path, newline='', encoding='utf-8') as sheet:
+            self.assertEqual([['Prize', 'Winner', 'Email', 'Address'],
+                              ['Prize', 'First Last', 'donor@example.com', 'Manchester']], list(csv.reader(sheet)))
+        os.remove(path)
+        os.rmdir(directory)
+
+    def test_view(self):
+        self.client.force_login(self.superuser)
+        response = self.client.get('/tracker/api/v1/export', {'type': 'donation', 'event': self.event.id})
+        self.assertEqual(200, response.status_code)
+        self.assertTrue(response.streaming)
+        self.assertIn('attachment; filename="donation.csv"', response['Content-Disposition'])
+        content = b''.join(response.streaming_content).decode('utf-8')
+        self.assertEqual(6, len(content.splitlines()))
+        response = self.client.get('/tracker/api/v1/export', {'type': 'nothing'})
+        self.assertEqual(400, response.status_code)
+
+    def test_view_staff_only(self):
+        self.client.force_login(User.objects.create(username='nobody'))
+        response = self.client.get('/tracker/api/v1/export', {'type': 'donation'})
+        self.assertEqual(302, response.status_code)
@@ -0,0 +1,113 @@
+import datetime
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytz
+from django.core.management import call_command
+from django.test import TestCase
+
+import tracker.giantbomb as giantbomb
+import tracker.models as models
+
+_GAMES = {
+    1: {'id': 1, 'name': 'Super Mario 64', 'original_release_date': '1996-06-23 00:00:00',
+        'platforms': [{'abbreviation': 'N64'}]},
+    2: {'id': 2, 'name': 'Super Mario Sunshine', 'original_release_date': '2002-07-19 00:00:00',
+        'platforms': [{'abbreviation': 'GCN'}]},
+}
+
+
+class _MockGiantBomb(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        self.server.received.append((url.path, params.get('query', [None])[0]))
+        if params.get('api_key') != ['key']:
+            data = {'error': 'Invalid API Key', 'results': []}
+        elif url.path == '/api/search/':
+            query = params['query'][0]
+            data = {'error': 'OK', 'results': [game for game in _GAMES.values() if query in game['name'].lower()]}
+        else:
+            game = _GAMES.get(int(url.path.rstrip('/').split('-')[-1]))
+            data = {'error': 'OK' if game else 'Object Not Found', 'results': game or []}
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestGiantBomb(TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _MockGiantBomb)
+        self.server.received = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:{0}/api/'.format(self.server.server_port)
+        self.events = [models.Event.objects.create(short='ev%d' % i, name='Event %d' % i, targetamount=5,
+                                                   datetime=datetime.datetime(2018 + i, 1, 1, 12, tzinfo=pytz.utc))
+                       for i in range(2)]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def sync(self, *args):
+        with self.settings(GIANTBOMB_API_URL=self.url):
+            call_command('cache_giantbomb_info', '--all', '-k', 'key', '-t', '0', '-c', '2', *args, verbosity=0)
+
+    def test_sync_shares_lookups(self):
+        runs = [
+            models.SpeedRun.objects.create(event=self.events[0], name='Super Mario 64 any%', order=1),
+            models.SpeedRun.objects.create(event=self.events[1], name='super mario 64 120%', order=1),
+            models.SpeedRun.objects.create(event=self.events[1], name='Sunshine', order=2, giantbomb_id=2),
+            models.SpeedRun.objects.create(event=self.events[0], name='Super Mario', order=2),
+        ]
+        self.sync()
+        self.assertEqual([('/api/game/3030-2/', None), ('/api/search/', 'super mario'),
+                          ('/api/search/', 'super mario 64')],
+                         sorted(self.server.received, key=lambda request: request[0]))
+        for run in runs:
+            run.refresh_from_db()
+        self.assertEqual([('Super Mario 64', 1, 1996, 'N64')] * 2 + [('Super Mario Sunshine', 2, 2002, 'GCN')],
+                         [(run.name, run.giantbomb_id, run.release_year, run.console) for run in runs[:3]])
+        # ambiguous, so left alone
+        self.assertEqual((None, None), (runs[3].giantbomb_id, runs[3].release_year))
+
+        # every response is cached now
+        del self.server.received[:]
+        self.sync()
+        self.assertEqual([], self.server.received)
+        # the runs found by search are looked up by their id from now on
+        self.sync('--refresh')
+        self.assertEqual([('/api/game/3030-1/', None), ('/api/game/3030-2/', None), ('/api/search/', 'super mario')],
+                         sorted(self.server.received))
+
+    def test_plan_reuses_known_ids(self):
+        models.SpeedRun.objects.create(event=self.events[0], name='Super Mario 64', order=1, giantbomb_id=1)
+        run = models.SpeedRun.objects.create(event=self.events[1], name='Super Mario 64 race', order=1)
+        self.assertEqual({run.pk: ('game', '1')}, giantbomb.plan_lookups([run]))
+        self.assertEqual({run.pk: ('search', 'super mario 64')}, giantbomb.plan_lookups([run], ignoreId=True))
+
+    def test_errors_are_not_cached(self):
+        client = giantbomb.GiantBombClient('key', rate=None, url=self.url)
+        results, errors = client.fetch([('game', '1'), ('game', '3')])
+        self.assertEqual(['Super Mario 64'], [result['name'] for result in results.values()])
+        self.assertEqual([('game', '3')], list(errors))
+        self.assertEqual(['1'], list(models.GiantBombResponse.objects.values_list('query', flat=True)))
+        client.fetch([('game', '1'), ('game', '3')])
+        self.assertEqual(3, client.requests)
+
+    def test_token_bucket(self):
+        bucket = giantbomb.TokenBucket(rate=50, capacity=2)
+        waits = [bucket.acquire() for i in range(4)]
+        self.assertEqual([0.0, 0.0], waits[:2])
+        self.assertTrue(all(0 < wait <= 0.02 for wait in waits[2:]))
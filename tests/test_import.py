@@ -0,0 +1,72 @@
+import datetime
+import json
+import os
+import tempfile
+from decimal import Decimal
+
+import pytz
+from django.core.management import call_command
+from django.test import TransactionTestCase
+
+import tracker.importutil as importutil
+import tracker.models as models
+
+
+class TestDonationImport(TransactionTestCase):
+
+    def setUp(self):
+        self.event = models.Event.objects.create(short='ev', name='Event', targetamount=5, paypalcurrency='GBP',
+                                                 datetime=datetime.datetime(2018, 1, 1, 12, tzinfo=pytz.utc))
+        self.parent = models.Bid.objects.create(event=self.event, name='Choice', state='OPENED')
+        self.option = models.Bid.objects.create(event=self.event, parent=self.parent, name='Option', istarget=True,
+                                                state='OPENED')
+        self.prize = models.Prize.objects.create(event=self.event, name='Prize', ticketdraw=True, state='ACCEPTED')
+        self.donor = models.Donor.objects.create(email='known@example.com', alias='Known')
+
+    def write(self, suffix, text):
+        handle, path = tempfile.mkstemp(suffix=suffix)
+        with os.fdopen(handle, 'w') as file:
+            file.write(text)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_csv_import_is_idempotent(self):
+        path = self.write('.csv', '\n'.join([
+            'domainId,amount,email,alias,bids,tickets,timereceived',
+            'a,10.00,KNOWN@example.com,,{0}:4.00,{1}:10.00,2018-01-01 13:00'.format(self.option.id, self.prize.id),
+            'b,5.00,new@example.com,Newcomer,,,',
+            'c,5.00,new@example.com,,{0}:6.00,,'.format(self.option.id),
+            'd,-1,new@example.com,,,,',
+            'e,5.00,,,,,',
+        ]))
+        call_command('import_donations', path, '--event', self.event.short, verbosity=0)
+        self.assertEqual(['a', 'b'], sorted(models.Donation.objects.values_list('domainId', flat=True)))
+        a = models.Donation.objects.get(domainId='a')
+        self.assertEqual(self.donor, a.donor)
+        self.assertEqual('COMPLETED', a.transactionstate)
+        self.assertEqual(Decimal('4.00'), models.Bid.objects.get(pk=self.option.pk).total)
+        self.assertEqual(Decimal('4.00'), models.Bid.objects.get(pk=self.parent.pk).total)
+        self.assertEqual(Decimal('10.00'), a.tickets.get().amount)
+        self.assertEqual(Decimal('10.00'), models.DonorCache.objects.get(donor=self.donor, event=self.event).donation_total)
+        self.assertEqual(1, models.DonorCache.objects.get(donor=self.donor, event=None).donation_count)
+        self.assertEqual('newcomer', models.Donation.objects.get(domainId='b').donor.aliaskey)
+
+        call_command('import_donations', path, '--event', self.event.short, verbosity=0)
+        self.assertEqual(2, models.Donation.objects.count())
+        self.assertEqual(Decimal('4.00'), models.Bid.objects.get(pk=self.option.pk).total)
+
+    def test_json_lines_and_errors(self):
+        rows = [
+            {'domainId': 'x', 'amount': '3.00', 'alias': 'Known', 'bids': [{'id': self.option.id, 'amount': '3.00'}]},
+            {'domainId': 'y', 'amount': '3.00', 'alias': 'Someone', 'bids': {str(self.parent.id): '1.00'}},
+            {'domainId': 'x', 'amount': '3.00', 'alias': 'Known'},
+        ]
+        donationImport = importutil.DonationImport(self.event, chunkSize=1)
+        donationImport.run(enumerate(rows, start=1))
+        self.assertEqual(1, donationImport.created)
+        self.assertEqual([2, 3], [line for line, error in donationImport.errors])
+        self.assertEqual(self.donor, models.Donation.objects.get(domainId='x').donor)
+
+        path = self.write('.jsonl', '\n'.join(json.dumps(row) for row in rows[:1]) + '\n')
+        call_command('import_donations', path, '--event', self.event.short, verbosity=0)
+        self.assertEqual(1, models.Donation.objects.count())
@@ -0,0 +1,85 @@
+import datetime
+from decimal import Decimal
+from urllib.parse import urlencode
+from unittest import mock
+
+import pytz
+from django.test import TransactionTestCase, override_settings
+from django.urls import reverse
+from paypal.standard.ipn.models import PayPalIPN
+
+import tracker.models as models
+import tracker.paypalutil as paypalutil
+
+
+class TestIPNQueue(TransactionTestCase):
+
+    def setUp(self):
+        # TransactionTestCase flushes the country records that the migrations create
+        models.Country.objects.get_or_create(alpha2='GB', defaults={'name': 'United Kingdom', 'alpha3': 'GBR', 'numeric': '826'})
+        self.event = models.Event.objects.create(
+            short='ev', name='Event', targetamount=5, paypalemail='receiver@example.com', paypalcurrency='GBP',
+            datetime=datetime.datetime(2018, 1, 1, 12, tzinfo=pytz.utc))
+        self.donation = models.Donation.objects.create(
+            event=self.event, amount=Decimal('5.00'), domain='PAYPAL', domainId='placeholder', currency='GBP',
+            requestedalias='Donor')
+
+    def ipn_data(self, **kwargs):
+        data = {
+            'txn_id': 'TXN1', 'payment_status': 'Completed', 'custom': '{0}:{1}'.format(self.donation.id, 'x'),
+            'business': 'receiver@example.com', 'receiver_email': 'receiver@example.com',
+            'payer_email': 'payer@example.com', 'first_name': 'Pay', 'last_name': 'Er', 'residence_country': 'GB',
+            'mc_gross': '5.00', 'mc_currency': 'GBP', 'mc_fee': '0.50', 'txn_type': 'web_accept',
+        }
+        data.update(kwargs)
+        return data
+
+    def post_ipn(self, **kwargs):
+        # PayPal sends IPNs url-encoded rather than as multipart form data
+        return self.client.post(reverse('tracker:ipn'), urlencode(self.ipn_data(**kwargs)), content_type='application/x-www-form-urlencoded')
+
+    def test_view_only_queues(self):
+        response = self.post_ipn()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(models.QueuedIPN.objects.get().state, 'PENDING')
+        self.assertEqual(models.Donation.objects.get(pk=self.donation.pk).transactionstate, 'PENDING')
+        self.assertEqual(paypalutil.ipn_queue_stats()['depth'], 1)
+
+    @mock.patch.object(PayPalIPN, '_postback', return_value=b'VERIFIED')
+    def test_drain_processes_and_deduplicates(self, postback):
+        self.post_ipn()
+        self.post_ipn()
+        self.assertEqual((2, 0), paypalutil.drain_ipn_queue())
+        donation = models.Donation.objects.get(pk=self.donation.pk)
+        self.assertEqual(donation.transactionstate, 'COMPLETED')
+        self.assertEqual(donation.domainId, 'TXN1')
+        self.assertEqual(donation.donor.alias, 'Donor')
+        self.assertEqual(['DONE', 'DUPLICATE'], [q.state for q in models.QueuedIPN.objects.all()])
+        self.assertEqual(1, PayPalIPN.objects.count())
+        self.assertEqual(paypalutil.ipn_queue_stats()['depth'], 0)
+
+    @mock.patch.object(PayPalIPN, '_postback', side_effect=IOError('PayPal is down'))
+    def test_failure_backs_off_then_gives_up(self, postback):
+        self.post_ipn()
+        self.assertEqual((0, 1), paypalutil.drain_ipn_queue(maxAttempts=2))
+        queued = models.QueuedIPN.objects.get()
+        self.assertEqual(queued.state, 'PENDING')
+        self.assertEqual(queued.attempts, 1)
+        self.assertIn('PayPal is down', queued.lasterror)
+        self.assertGreater(queued.nextattempt, queued.received)
+        # not due yet, so nothing happens
+        self.assertEqual((0, 0), paypalutil.drain_ipn_queue(maxAttempts=2))
+        models.QueuedIPN.objects.update(nextattempt=queued.received)
+        self.assertEqual((0, 1), paypalutil.drain_ipn_queue(maxAttempts=2))
+        self.assertEqual(models.QueuedIPN.objects.get().state, 'FAILED')
+        self.assertEqual(paypalutil.ipn_queue_stats()['FAILED'], 1)
+        self.assertEqual(0, PayPalIPN.objects.count())
+
+    @override_settings(PAYPAL_IPN_QUEUE_EAGER=True)
+    @mock.patch.object(PayPalIPN, '_postback', return_value=b'VERIFIED')
+    def test_eager_mode(self, postback):
+        self.post_ipn(payment_status='Pending', pending_reason='echeck')
+        self.assertEqual(models.QueuedIPN.objects.get().state, 'DONE')
+        self.assertEqual(models.Donation.objects.get(pk=self.donation.pk).transactionstate, 'PENDING')
+        self.post_ipn()
+        self.assertEqual(models.Donation.objects.get(pk=self.donation.pk).transactionstate, 'COMPLETED')
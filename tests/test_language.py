@@ -0,0 +1,97 @@
+import datetime
+from unittest import mock
+
+import pytz
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TransactionTestCase
+
+import tracker.languageutil as languageutil
+import tracker.models as models
+
+
+class FakeCld(object):
+    def __init__(self):
+        self.calls = 0
+
+    def detect(self, text, hintLanguageCode=None):
+        self.calls += 1
+        code = 'fr' if b'bonjour' in text else 'xx'
+        return 'Name', code, True, len(text), []
+
+
+class TestCommentLanguages(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.event = models.Event.objects.create(short='ev', name='Event', targetamount=5,
+                                                 datetime=datetime.datetime(2018, 1, 1, 12, tzinfo=pytz.utc))
+        self.donor = models.Donor.objects.create(email='donor@example.com')
+
+    def make_donation(self, domainId, comment):
+        donation = models.Donation(event=self.event, donor=self.donor, amount=5, domainId=domainId, comment=comment,
+                                     currency='GBP')
+        donation.full_clean()
+        donation.save()
+        return donation
+
+    def test_detection_is_batched_and_cached(self):
+        fake = FakeCld()
+        with mock.patch.object(languageutil, 'cld', fake):
+            french = [self.make_donation('fr{0}'.format(i), 'bonjour') for i in range(3)]
+            other = self.make_donation('other', 'something else')
+            self.make_donation('none', '')
+            # nothing is detected while saving
+            self.assertEqual(0, fake.calls)
+            self.assertEqual({'un'}, set(models.Donation.objects.values_list('commentlanguage', flat=True)))
+
+            updated, since = languageutil.detect_comment_languages(concurrency=1, batchSize=2)
+            self.assertEqual(3, updated)
+            self.assertEqual(2, fake.calls)
+            self.assertEqual({'fr'}, {models.Donation.objects.get(pk=d.pk).commentlanguage for d in french})
+            self.assertEqual('un', models.Donation.objects.get(pk=other.pk).commentlanguage)
+
+            later = self.make_donation('later', 'bonjour')
+            self.assertEqual((1, later.pk), languageutil.detect_comment_languages(since=since))
+            self.assertEqual(2, fake.calls)
+
+    def test_undetectable_comments_are_looked_at_once(self):
+        fake = FakeCld()
+        with mock.patch.object(languageutil, 'cld', fake):
+            donations = [self.make_donation('hi{0}'.format(i), 'hi') for i in range(3)]
+            self.assertEqual(0, languageutil.detect_comment_languages(concurrency=1)[0])
+            self.assertEqual(1, fake.calls)
+
+            # the next pass reads no rows, let alone detects anything
+            with mock.patch.object(languageutil, 'detect_languages') as detect, self.assertNumQueries(1):
+                self.assertEqual((0, 0), languageutil.detect_comment_languages(concurrency=1))
+            detect.assert_not_called()
+
+            # until the comment changes
+            edited = models.Donation.objects.get(pk=donations[0].pk)
+            edited.comment = 'bonjour'
+            edited.save()
+            self.assertEqual((1, edited.pk), languageutil.detect_comment_languages(concurrency=1))
+            self.assertEqual('fr', models.Donation.objects.get(pk=edited.pk).commentlanguage)
+            self.assertEqual(2, fake.calls)
+
+    def test_loop_finds_late_donations(self):
+        class Stop(Exception):
+            pass
+
+        def sleep(interval):
+            if not late:
+                # commits after a donation with a higher id was already looked at
+                late.append(models.Donation.objects.create(pk=1, event=self.event, donor=self.donor, amount=5,
+                                                           domainId='late', comment='bonjour', currency='GBP'))
+            else:
+                raise Stop
+
+        late = []
+        models.Donation.objects.create(pk=10, event=self.event, donor=self.donor, amount=5, domainId='first',
+                                       comment='bonjour', currency='GBP')
+        with mock.patch.object(languageutil, 'cld', FakeCld()), \
+                mock.patch('tracker.management.commands.detect_comment_languages.time.sleep', side_effect=sleep):
+            with self.assertRaises(Stop):
+                call_command('detect_comment_languages', '--loop', verbosity=0)
+        self.assertEqual('fr', models.Donation.objects.get(pk=late[0].pk).commentlanguage)
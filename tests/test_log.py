@@ -0,0 +1,60 @@
+from django.contrib.admin.models import LogEntry
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.test import RequestFactory, TransactionTestCase, override_settings
+
+import tracker.logutil as logutil
+import tracker.models as models
+import tracker.viewutil as viewutil
+
+
+class TestLogSink(TransactionTestCase):
+
+    def setUp(self):
+        self.sink = logutil.LogSink()
+
+    def test_written_at_commit(self):
+        request = RequestFactory().get('/')
+        request.user = User.objects.create(username='admin')
+        with transaction.atomic():
+            for i in range(5):
+                viewutil.tracker_log('test', 'message %d' % i)
+            logutil.change(request, request.user, 'Changed something.')
+            self.assertFalse(models.Log.objects.exists())
+        self.assertEqual(['message %d' % i for i in range(5)],
+                         sorted(models.Log.objects.values_list('message', flat=True)))
+        self.assertEqual('Changed something.', LogEntry.objects.get().change_message)
+
+    def test_rolled_back(self):
+        with transaction.atomic():
+            viewutil.tracker_log('test', 'kept')
+            try:
+                with transaction.atomic():
+                    viewutil.tracker_log('test', 'rolled back')
+                    raise ValueError
+            except ValueError:
+                pass
+            viewutil.tracker_log('test', 'kept too')
+        self.assertEqual(['kept', 'kept too'], sorted(models.Log.objects.values_list('message', flat=True)))
+        try:
+            with transaction.atomic():
+                viewutil.tracker_log('test', 'rolled back')
+                raise ValueError
+        except ValueError:
+            pass
+        with transaction.atomic():
+            viewutil.tracker_log('test', 'after')
+        self.assertEqual(3, models.Log.objects.count())
+
+    def test_outside_transaction(self):
+        # nothing waits in memory, where a killed worker would lose it
+        self.sink.add(models.Log(category='test', message='first'))
+        self.assertEqual(1, models.Log.objects.count())
+        viewutil.tracker_log('test', 'second')
+        self.assertEqual(2, models.Log.objects.count())
+
+    @override_settings(LOG_SINK_EAGER=True)
+    def test_eager(self):
+        with transaction.atomic():
+            viewutil.tracker_log('test', 'now')
+            self.assertTrue(models.Log.objects.exists())
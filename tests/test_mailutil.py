@@ -0,0 +1,39 @@
+from unittest import mock
+
+import post_office.mail
+import post_office.models
+from django.test import TestCase
+
+import tracker.mailutil as mailutil
+
+
+class TestEmailTemplateCache(TestCase):
+
+    def setUp(self):
+        self.template = post_office.models.EmailTemplate.objects.create(
+            name='test', subject='Hello {{ name }}', content='Plain {{ name }}', html_content='<b>{{ name }}</b>')
+
+    def test_compiled_once(self):
+        with mock.patch.object(mailutil, 'Template', wraps=mailutil.Template) as compile:
+            for name in ('a', 'b', 'c'):
+                rendered = mailutil.render_email(self.template, {'name': name})
+            self.assertEqual(3, compile.call_count)
+        self.assertEqual({'subject': 'Hello c', 'message': 'Plain c', 'html_message': '<b>c</b>'}, rendered)
+
+    def test_by_name(self):
+        self.assertEqual('Hello a', mailutil.render_email('test', {'name': 'a'})['subject'])
+
+    def test_recompiled_when_changed(self):
+        mailutil.render_email(self.template, {'name': 'a'})
+        self.template.subject = 'Goodbye {{ name }}'
+        self.template.save()
+        self.assertEqual('Goodbye a', mailutil.render_email(self.template, {'name': 'a'})['subject'])
+
+    def test_same_as_post_office(self):
+        context = {'name': '<Someone & Co>'}
+        ours = mailutil.send(recipients=['someone@example.com'], sender='nobody@example.com',
+                             template=self.template, context=context)
+        theirs = post_office.mail.send(recipients=['someone@example.com'], sender='nobody@example.com',
+                                       template=self.template, context=context)
+        self.assertEqual((theirs.subject, theirs.message, theirs.html_message),
+                         (ours.subject, ours.message, ours.html_message))
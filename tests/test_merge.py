@@ -0,0 +1,106 @@
+import datetime
+
+import pytz
+from django.contrib.auth.models import User
+from django.contrib.messages import get_messages
+from django.test import TestCase
+from django.urls import reverse
+
+import tracker.mergeutil as mergeutil
+import tracker.models as models
+import tracker.viewutil as viewutil
+
+
+class TestMerge(TestCase):
+
+    def setUp(self):
+        self.event = models.Event.objects.create(short='ev', name='Event', targetamount=5,
+                                                 datetime=datetime.datetime(2018, 1, 1, 12, tzinfo=pytz.utc))
+        self.run = models.SpeedRun.objects.create(event=self.event, name='Test Run', run_time='0:45:00', order=1)
+        self.prize = models.Prize.objects.create(event=self.event, name='Prize', maxwinners=3)
+        self.root = models.Donor.objects.create(email='root@example.com', firstname='Root')
+        self.other = models.Donor.objects.create(email='other@example.com', firstname='Other')
+
+    def donate(self, donor, amount, bids=()):
+        donation = models.Donation.objects.create(donor=donor, event=self.event, amount=amount,
+                                                  domainId='%s-%s' % (donor.id, models.Donation.objects.count()),
+                                                  transactionstate='COMPLETED')
+        for bid, bidAmount in bids:
+            models.DonationBid.objects.create(donation=donation, bid=bid, amount=bidAmount)
+        return donation
+
+    def test_merge_donors(self):
+        for amount in (5, 10):
+            self.donate(self.root, amount)
+            self.donate(self.other, amount * 2)
+        models.PrizeWinner.objects.create(prize=self.prize, winner=self.root, pendingcount=1)
+        models.PrizeWinner.objects.create(prize=self.prize, winner=self.other, pendingcount=0, acceptcount=1)
+
+        plan = mergeutil.plan_merge(self.root, [self.root, self.other])
+        description = plan.describe()
+        self.assertIn('Move 2 donations (donor)', description)
+        self.assertIn('Move 1 Prize Winners (winner), 1 of which are duplicates, adding up their pendingcount, '
+                      'acceptcount, declinecount, sumcount', description)
+        # planning changes nothing
+        self.assertEqual(2, models.Donation.objects.filter(donor=self.root).count())
+
+        viewutil.merge_donors(self.root, [self.other])
+        self.assertFalse(models.Donor.objects.filter(pk=self.other.pk).exists())
+        self.assertEqual(4, models.Donation.objects.filter(donor=self.root).count())
+        winner = models.PrizeWinner.objects.get(prize=self.prize)
+        self.assertEqual((self.root.pk, 1, 1), (winner.winner_id, winner.pendingcount, winner.acceptcount))
+        for event in (self.event, None):
+            cache = models.DonorCache.objects.get(donor=self.root, event=event)
+            self.assertEqual((45, 4), (cache.donation_total, cache.donation_count))
+
+    def test_merge_bids(self):
+        parent = models.Bid.objects.create(name='Parent', speedrun=self.run, state='OPENED')
+        root = models.Bid.objects.create(name='Option', istarget=True, parent=parent, state='OPENED')
+        duplicate = models.Bid.objects.create(name='option ', istarget=True, parent=parent, state='OPENED')
+        self.donate(self.root, 5, [(root, 2), (duplicate, 3)])
+        self.donate(self.root, 5, [(duplicate, 5)])
+        models.BidSuggestion.objects.create(bid=duplicate, name='Suggestion')
+
+        plan = mergeutil.plan_merge(root, [duplicate])
+        self.assertEqual(1, len(plan.references[0].duplicates))
+        plan.execute()
+
+        self.assertFalse(models.Bid.objects.filter(pk=duplicate.pk).exists())
+        self.assertEqual([5, 5], sorted(models.DonationBid.objects.filter(bid=root).values_list('amount', flat=True)))
+        self.assertEqual(1, models.BidSuggestion.objects.filter(bid=root).count())
+        root.refresh_from_db()
+        parent.refresh_from_db()
+        self.assertEqual((10, 2), (root.total, root.count))
+        self.assertEqual(10, parent.total)
+
+    def test_bids_with_options(self):
+        parent = models.Bid.objects.create(name='Parent', speedrun=self.run)
+        models.Bid.objects.create(name='Option', istarget=True, parent=parent)
+        other = models.Bid.objects.create(name='Other', speedrun=self.run, istarget=True)
+        with self.assertRaises(ValueError):
+            mergeutil.plan_merge(other, [parent])
+
+    def test_preview_view(self):
+        self.donate(self.other, 5)
+        user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(user)
+        objects = '%d,%d' % (self.root.pk, self.other.pk)
+        response = self.client.get(reverse('admin:merge_donors'), {'objects': objects})
+        self.assertEqual(200, response.status_code)
+        response = self.client.post(reverse('admin:merge_donors'),
+                                    {'objects': objects, 'root': self.root.pk, 'preview': 'Preview'})
+        self.assertContains(response, 'Move 1 donations (donor)')
+        self.assertTrue(models.Donor.objects.filter(pk=self.other.pk).exists())
+
+    def test_merge_view_bids_with_options(self):
+        parent = models.Bid.objects.create(name='Parent', speedrun=self.run)
+        models.Bid.objects.create(name='Option', istarget=True, parent=parent)
+        other = models.Bid.objects.create(name='Other', speedrun=self.run, istarget=True)
+        user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(user)
+        response = self.client.post(reverse('admin:merge_bids'),
+                                    {'objects': '%d,%d' % (other.pk, parent.pk), 'root': other.pk})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(['Bids with options cannot be merged, merge their options instead'],
+                         [str(message) for message in get_messages(response.wsgi_request)])
+        self.assertTrue(models.Bid.objects.filter(pk=parent.pk).exists())
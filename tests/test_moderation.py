@@ -0,0 +1,108 @@
+import datetime
+import json
+import time
+from unittest import mock
+
+import pytz
+from django.contrib.auth.models import Permission, User
+from django.db.models import F
+from django.test import TransactionTestCase
+from django.urls import reverse
+
+import tracker.moderationutil as moderationutil
+import tracker.models as models
+
+
+class TestModerationStream(TransactionTestCase):
+
+    def setUp(self):
+        self.event = models.Event.objects.create(short='ev', name='Event', targetamount=5,
+                                                 datetime=datetime.datetime(2018, 1, 1, 12, tzinfo=pytz.utc))
+        self.donor = models.Donor.objects.create(email='donor@example.com', alias='Donor', visibility='ALIAS')
+
+    def make_donation(self, domainId, **kwargs):
+        return models.Donation.objects.create(event=self.event, donor=self.donor, amount=5, domainId=domainId,
+                                              currency='GBP', transactionstate='COMPLETED', comment='Hello',
+                                              commentstate='PENDING', readstate='PENDING', **kwargs)
+
+    def test_change_log_only_records_moderation_changes(self):
+        donation = self.make_donation('a')
+        self.assertEqual(1, models.DonationChange.objects.count())
+        donation.modcomment = 'not interesting'
+        donation.save()
+        self.assertEqual(1, models.DonationChange.objects.count())
+        donation.readstate = 'READY'
+        donation.save()
+        self.assertEqual(2, models.DonationChange.objects.count())
+
+    @mock.patch.object(moderationutil, 'MODERATION_CURSOR_LAG', datetime.timedelta(0))
+    def test_updates(self):
+        first = self.make_donation('a')
+        update = moderationutil.get_moderation_update('toprocess')
+        self.assertTrue(update.reset)
+        self.assertEqual([first], update.donations)
+
+        # nothing has changed since
+        self.assertEqual([], moderationutil.get_moderation_update('toprocess', cursor=update.cursor).donations)
+
+        second = self.make_donation('b')
+        first.readstate = 'READY'
+        first.commentstate = 'APPROVED'
+        first.save()
+        update = moderationutil.get_moderation_update('toprocess', event=self.event, cursor=update.cursor)
+        self.assertFalse(update.reset)
+        self.assertEqual([second], update.donations)
+        self.assertEqual([first.id], update.removed)
+        self.assertEqual([first], moderationutil.get_moderation_update('toread').donations)
+
+        cursor = update.cursor
+        self.make_donation('c')
+        moderationutil.prune_donation_changes(datetime.timedelta(0))
+        self.make_donation('d')
+        self.assertTrue(moderationutil.get_moderation_update('toprocess', cursor=cursor).reset)
+
+    def test_no_waiting_by_default(self):
+        cursor = moderationutil.get_moderation_update('toprocess').cursor
+        started = time.time()
+        self.assertEqual([], moderationutil.get_moderation_update('toprocess', cursor=cursor, timeout=25).donations)
+        self.assertLess(time.time() - started, moderationutil.MODERATION_POLL_INTERVAL)
+
+    def test_late_commits(self):
+        self.make_donation('z')
+        models.DonationChange.objects.update(time=F('time') - datetime.timedelta(minutes=1))
+        cursor = moderationutil.get_moderation_update('toprocess').cursor
+        first = self.make_donation('a')
+        second = self.make_donation('b')
+        # the first change is written before the second, but only commits after a client has seen the second
+        late = models.DonationChange.objects.get(donation=first)
+        late.delete()
+        update = moderationutil.get_moderation_update('toprocess', cursor=cursor)
+        self.assertEqual([second], update.donations)
+        late.save()
+        update = moderationutil.get_moderation_update('toprocess', cursor=update.cursor)
+        self.assertEqual({first, second}, set(update.donations))
+
+        # once the changes are old enough, the cursor moves past them
+        models.DonationChange.objects.update(time=F('time') - datetime.timedelta(minutes=1))
+        update = moderationutil.get_moderation_update('toprocess', cursor=update.cursor)
+        self.assertEqual({first, second}, set(update.donations))
+        self.assertEqual([], moderationutil.get_moderation_update('toprocess', cursor=update.cursor).donations)
+
+    @mock.patch.object(moderationutil, 'MODERATION_CURSOR_LAG', datetime.timedelta(0))
+    def test_view(self):
+        donation = self.make_donation('a')
+        url = reverse('admin:moderation_stream')
+        user = User.objects.create_user('mod', password='password', is_staff=True)
+        self.client.login(username='mod', password='password')
+        self.assertEqual(403, self.client.get(url, {'feed': 'toprocess'}).status_code)
+        user.user_permissions.add(Permission.objects.get(codename='change_donation'))
+        response = self.client.get(url, {'feed': 'toprocess', 'event': self.event.id})
+        self.assertEqual(200, response.status_code)
+        data = json.loads(response.content.decode('utf-8'))
+        self.assertTrue(data['reset'])
+        self.assertEqual([donation.id], [d['pk'] for d in data['donations']])
+        self.assertEqual('Donor', data['donations'][0]['fields']['donor__public'])
+        response = self.client.get(url, {'feed': 'toprocess', 'cursor': data['cursor']})
+        self.assertEqual({'cursor': data['cursor'], 'reset': False, 'donations': [], 'removed': []},
+                         json.loads(response.content.decode('utf-8')))
+        self.assertEqual(400, self.client.get(url, {'feed': 'nope'}).status_code)
@@ -0,0 +1,121 @@
+import datetime
+import importlib
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from unittest import mock
+
+import pytz
+import requests
+from django.apps import apps
+from django.conf import settings
+from django.db import connection, transaction
+from django.test import TransactionTestCase
+
+import tracker.eventutil as eventutil
+import tracker.models as models
+
+
+class _RecordingHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.received.append(json.loads(body.decode('utf-8')))
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestPostbackDelivery(TransactionTestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _RecordingHandler)
+        self.server.received = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:{0}/postback'.format(self.server.server_port)
+        self.event = models.Event.objects.create(short='ev', name='Event', targetamount=5,
+                                                 datetime=datetime.datetime(2018, 1, 1, 12, tzinfo=pytz.utc))
+        self.donor = models.Donor.objects.create(alias='Somebody', visibility='ALIAS')
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def make_donation(self, amount):
+        return models.Donation.objects.create(event=self.event, donor=self.donor, amount=Decimal(amount),
+                                              domainId=amount, transactionstate='COMPLETED', currency='GBP')
+
+    def test_delivers_to_each_url_and_records_latency(self):
+        good = models.PostbackURL.objects.create(event=self.event, url=self.url)
+        # nothing listens on port 9 of the loopback interface, so this one always fails
+        bad = models.PostbackURL.objects.create(event=self.event, url='http://127.0.0.1:9/postback')
+        donation = self.make_donation('5.00')
+        self.assertEqual(2, len(eventutil.post_donation_to_postbacks(donation)))
+        self.assertEqual((1, 1), eventutil.deliver_postbacks(concurrency=1))
+        self.assertEqual(1, len(self.server.received))
+        self.assertEqual(donation.id, self.server.received[0]['id'])
+        self.assertEqual('Somebody', self.server.received[0]['donor__visiblename'])
+        self.assertEqual(Decimal('5.00'), Decimal(self.server.received[0]['new_total']))
+        stats = eventutil.postback_delivery_stats()
+        self.assertEqual(1, stats[good.id]['delivered'])
+        self.assertIsNotNone(stats[good.id]['latency_avg'])
+        self.assertEqual(1, stats[bad.id]['pending'])
+        failed = models.PostbackDelivery.objects.get(postback=bad)
+        self.assertEqual('PENDING', failed.state)
+        self.assertGreater(failed.nextattempt, failed.created)
+        # not due for a retry yet
+        self.assertEqual((0, 0), eventutil.deliver_postbacks(concurrency=1))
+
+    def test_coalesce(self):
+        models.PostbackURL.objects.create(event=self.event, url=self.url, coalesce=True)
+        first = self.make_donation('5.00')
+        second = self.make_donation('10.00')
+        eventutil.post_donation_to_postbacks(first)
+        eventutil.post_donation_to_postbacks(second)
+        self.assertEqual((2, 0), eventutil.deliver_postbacks(concurrency=1))
+        self.assertEqual(1, len(self.server.received))
+        self.assertEqual([first.id, second.id], [data['id'] for data in self.server.received[0]])
+        self.assertEqual([settings.SECRET_KEY] * 2, [data['key'] for data in self.server.received[0]])
+
+    def test_eager_sends_only_new_deliveries(self):
+        dead = models.PostbackURL.objects.create(event=self.event, url='http://127.0.0.1:9/postback')
+        stale = models.PostbackDelivery.objects.create(postback=dead, payload='{}')
+        good = models.PostbackURL.objects.create(event=self.event, url=self.url)
+        with self.settings(POSTBACK_QUEUE_EAGER=True), transaction.atomic():
+            eventutil.post_donation_to_postbacks(self.make_donation('5.00'))
+        self.assertEqual(1, len(self.server.received))
+        self.assertEqual('DELIVERED', models.PostbackDelivery.objects.get(postback=good).state)
+        stale.refresh_from_db()
+        self.assertEqual(0, stale.attempts)
+
+    def test_executor_keeps_sessions(self):
+        models.PostbackURL.objects.create(event=self.event, url=self.url)
+        with mock.patch.object(eventutil.requests, 'Session', wraps=requests.Session) as Session, \
+                ThreadPoolExecutor(max_workers=1) as executor:
+            for amount in ('5.00', '10.00'):
+                eventutil.post_donation_to_postbacks(self.make_donation(amount))
+                self.assertEqual((1, 0), eventutil.deliver_postbacks(executor=executor))
+        self.assertEqual(1, Session.call_count)
+
+    def test_key_not_stored(self):
+        models.PostbackURL.objects.create(event=self.event, url=self.url)
+        delivery, = eventutil.post_donation_to_postbacks(self.make_donation('5.00'))
+        self.assertNotIn('key', json.loads(delivery.payload))
+        eventutil.deliver_postbacks(concurrency=1)
+        self.assertEqual(settings.SECRET_KEY, self.server.received[0]['key'])
+
+    def test_key_removed_from_queued(self):
+        postback = models.PostbackURL.objects.create(event=self.event, url=self.url)
+        queued = models.PostbackDelivery.objects.create(postback=postback,
+                                                        payload=json.dumps({'key': 'secret', 'id': 1}))
+        migration = importlib.import_module('tracker.migrations.0018_postback_payload_key')
+        migration.remove_payload_keys(apps, SimpleNamespace(connection=connection))
+        queued.refresh_from_db()
+        self.assertEqual({'id': 1}, json.loads(queued.payload))
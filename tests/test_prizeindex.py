@@ -0,0 +1,68 @@
+import datetime
+import random
+from decimal import Decimal
+
+from dateutil.parser import parse as parse_date
+from django.test import TransactionTestCase
+
+import tracker.filters as filters
+import tracker.models as models
+import tracker.prizeutil as prizeutil
+import tracker.randgen as randgen
+import tracker.viewutil as viewutil
+
+
+class TestPrizeWindowIndex(TransactionTestCase):
+
+    def setUp(self):
+        self.eventStart = parse_date('2014-01-01 16:00:00Z')
+        self.rand = random.Random(516273)
+        self.event = randgen.build_random_event(self.rand, startTime=self.eventStart, numRuns=20, numDonors=5)
+        self.runsList = list(models.SpeedRun.objects.filter(event=self.event).order_by('order'))
+
+    def make_prize(self, **kwargs):
+        prize = randgen.generate_prize(self.rand, event=self.event, **kwargs)
+        prize.state = 'ACCEPTED'
+        prize.save()
+        return prize
+
+    def expected_prizes(self, time):
+        query = filters.run_model_query('prize', {'feed': 'current', 'event': self.event.id, 'offset': time, 'noslice': True})
+        return [prize for prize in query if prize.contains_draw_time(time)]
+
+    def test_matches_database_query(self):
+        for i in range(10):
+            start = self.rand.randrange(len(self.runsList))
+            end = self.rand.randrange(start, len(self.runsList))
+            self.make_prize(startRun=self.runsList[start], endRun=self.runsList[end])
+        for i in range(5):
+            startTime = randgen.random_time(self.rand, self.runsList[0].starttime, self.runsList[-1].endtime)
+            endTime = startTime + datetime.timedelta(hours=self.rand.randrange(1, 6))
+            self.make_prize(startTime=startTime, endTime=endTime)
+        self.make_prize()
+        times = [run.starttime for run in self.runsList] + [run.endtime for run in self.runsList]
+        times += [randgen.random_time(self.rand, self.eventStart, self.runsList[-1].endtime + datetime.timedelta(hours=2)) for i in range(30)]
+        times.append(self.eventStart - datetime.timedelta(days=1))
+        index = prizeutil.get_prize_window_index(self.event)
+        for time in times:
+            self.assertEqual(sorted(p.id for p in self.expected_prizes(time)), sorted(p.id for p in index.prizes_at(time)))
+
+    def test_index_follows_changes(self):
+        run = self.runsList[3]
+        prize = self.make_prize(startRun=run, endRun=run)
+        self.assertEqual([prize], prizeutil.get_current_prizes(self.event, run.starttime))
+        prize.startrun = prize.endrun = self.runsList[5]
+        prize.save()
+        self.assertEqual([], prizeutil.get_current_prizes(self.event, run.starttime))
+        self.assertEqual([prize], prizeutil.get_current_prizes(self.event, self.runsList[5].starttime))
+        models.PrizeWinner.objects.create(prize=prize, winner=models.Donor.objects.all()[0])
+        self.assertEqual([], prizeutil.get_current_prizes(self.event, self.runsList[5].starttime))
+
+    def test_donation_prize_info(self):
+        run = self.runsList[2]
+        prize = self.make_prize(startRun=run, endRun=run, sumDonations=False, minAmount=Decimal('5.00'), maxAmount=Decimal('5.00'), ticketDraw=False)
+        donation = randgen.generate_donation(self.rand, event=self.event, minAmount=Decimal('10.00'), maxAmount=Decimal('10.00'), minTime=run.starttime, maxTime=run.endtime)
+        donation.save()
+        self.assertEqual([{'prize': prize, 'amount': donation.amount}], viewutil.get_donation_prize_info(donation))
+        donation.amount = Decimal('1.00')
+        self.assertEqual([], viewutil.get_donation_prize_info(donation))
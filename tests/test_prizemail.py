@@ -5,7 +5,9 @@ import pytz
 
 from dateutil.parser import parse as parse_date
 
+from django.db import connection
 from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth import get_user_model
 
 import post_office.models
@@ -309,3 +311,50 @@ class TestAutomailPrizesShipped(TransactionTestCase):
                     self.assertTrue(prizeWinner.id in mailedPrizeWinnerIds)
                     self.assertTrue(prizeWinner.shippingemailsent)
                 self.assertEqual(self.sender, reply)
+
+
+class TestMailBatches(TransactionTestCase):
+
+    def setUp(self):
+        self.event = models.Event.objects.create(short='ev', name='Event', targetamount=5,
+                                                 datetime=datetime.datetime(2018, 1, 1, 12, tzinfo=pytz.utc))
+        self.templateEmail = post_office.models.EmailTemplate.objects.create(
+            name="testing_batches", description="", subject="You Win!", content="{{ winner.id }}")
+        self.winners = []
+        for i in range(5):
+            donor = models.Donor.objects.create(email='donor%d@example.com' % i)
+            prize = models.Prize.objects.create(event=self.event, name='Prize %d' % i, state='ACCEPTED')
+            self.winners.append(models.PrizeWinner.objects.create(winner=donor, prize=prize))
+
+    def testBatches(self):
+        sent = prizemail.send_mail_batches(
+            self.event, [(w.winner.email, {'winner': w.winner}, 'Mailed %d' % w.id, [w]) for w in self.winners],
+            self.templateEmail, 'nobody@example.com', 'nobody@example.com', models.PrizeWinner, {'emailsent': True},
+            batchSize=2)
+        self.assertEqual(5, sent)
+        self.assertEqual(5, post_office.models.Email.objects.count())
+        self.assertEqual(5, models.PrizeWinner.objects.filter(emailsent=True).count())
+        self.assertTrue(all(w.emailsent for w in self.winners))
+        self.assertEqual(5, models.Log.objects.filter(category='prize').count())
+
+    def testQueriesDoNotGrowWithWinners(self):
+        def automail():
+            prizemail.automail_prize_winners(self.event, prizemail.prize_winners_with_email_pending(self.event),
+                                             self.templateEmail, sender='nobody@example.com')
+        with CaptureQueriesContext(connection) as fewer:
+            automail()
+        models.PrizeWinner.objects.update(emailsent=False)
+        for i in range(5):
+            donor = models.Donor.objects.create(email='more%d@example.com' % i)
+            prize = models.Prize.objects.create(event=self.event, name='More %d' % i, state='ACCEPTED')
+            models.PrizeWinner.objects.create(winner=donor, prize=prize)
+        with CaptureQueriesContext(connection) as more:
+            automail()
+        self.assertEqual(len(fewer), len(more))
+        self.assertEqual(10, models.PrizeWinner.objects.filter(emailsent=True).count())
+
+    def testDryRun(self):
+        prizemail.automail_prize_winners(self.event, prizemail.prize_winners_with_email_pending(self.event),
+                                         self.templateEmail, sender='nobody@example.com', dry_run=True)
+        self.assertFalse(post_office.models.Email.objects.exists())
+        self.assertFalse(models.PrizeWinner.objects.filter(emailsent=True).exists())
@@ -0,0 +1,89 @@
+import datetime
+
+import pytz
+from django.core.cache import cache
+from django.test import TestCase
+
+import tracker.filters as filters
+import tracker.models as models
+import tracker.scheduleutil as scheduleutil
+
+
+class TestScheduleTimeline(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        scheduleutil._event_schedules.clear()
+        self.start = datetime.datetime(2018, 1, 1, 12, tzinfo=pytz.utc)
+        self.event = models.Event.objects.create(short='ev', name='Event', targetamount=5, datetime=self.start)
+        self.runs = [models.SpeedRun.objects.create(event=self.event, name='Run %d' % i, run_time='0:55:00',
+                                                    setup_time='0:05:00', order=i) for i in range(1, 11)]
+        # a run that is not on the schedule
+        models.SpeedRun.objects.create(event=self.event, name='Unscheduled', run_time='1:00:00')
+        for run in self.runs[3:6]:
+            models.Bid.objects.create(speedrun=run, name='Bid', state='OPENED', istarget=True)
+        models.Bid.objects.create(speedrun=self.runs[7], name='Hidden Bid', state='HIDDEN', istarget=True)
+        self.offset = self.start + datetime.timedelta(hours=2, minutes=30)
+
+    def hours(self, hours):
+        return self.start + datetime.timedelta(hours=hours)
+
+    def test_timeline(self):
+        timeline = scheduleutil.get_event_schedule(self.event).runs
+        self.assertTrue(timeline.ordered)
+        self.assertEqual(10, len(timeline))
+        self.assertEqual(self.runs[2].id, timeline.current_run(self.offset))
+        self.assertIsNone(timeline.current_run(self.hours(-1)))
+        self.assertIsNone(timeline.current_run(self.hours(11)))
+        self.assertEqual([run.id for run in self.runs[2:5]], timeline.upcoming_runs(self.offset, maxRuns=3))
+        self.assertEqual([run.id for run in self.runs[3:5]],
+                         timeline.upcoming_runs(self.offset, includeCurrent=False, maxRuns=2))
+        self.assertEqual([run.id for run in self.runs[1:4]], timeline.runs_within(self.hours(1.5), self.hours(3.5)))
+        self.assertEqual((self.hours(3), self.hours(5)), timeline.span([self.runs[4].id, self.runs[3].id]))
+        self.assertIsNone(timeline.span([]))
+
+    def test_rebuilt_on_change(self):
+        schedule = scheduleutil.get_event_schedule(self.event)
+        self.assertIs(schedule, scheduleutil.get_event_schedule(self.event))
+        self.runs[-1].delete()
+        schedule = scheduleutil.get_event_schedule(self.event)
+        self.assertEqual(9, len(schedule.runs))
+        models.Bid.objects.create(speedrun=self.runs[0], name='New Bid', state='OPENED', istarget=True)
+        self.assertEqual(4, len(scheduleutil.get_event_schedule(self.event).bidRuns))
+
+    def assertFeedMatches(self, model, params):
+        # the timeline answers the same as the queries it replaces
+        params = dict(params, offset=self.offset.isoformat())
+        withSchedule = filters.run_model_query(model, dict(params, event=self.event.id))
+        withoutSchedule = filters.run_model_query(model, dict(params, event=str(self.event.id), eventshort='ev')) \
+            if model != 'run' else filters.run_model_query(model, dict(params, eventshort='ev'))
+        self.assertEqual(sorted(o.id for o in withoutSchedule), sorted(o.id for o in withSchedule))
+        return withSchedule
+
+    def test_run_feeds(self):
+        for params in ({'feed': 'current'}, {'feed': 'current', 'maxRuns': 2}, {'feed': 'current', 'minRuns': 8},
+                       {'feed': 'future'}, {'feed': 'future', 'delta': 90}, {'feed': 'current', 'noslice': 'true'}):
+            self.assertFeedMatches('run', params)
+        scheduleutil.get_event_schedule(self.event)
+        with self.assertNumQueries(1):
+            runs = list(filters.run_model_query('run', {'event': self.event.id, 'feed': 'current',
+                                                        'offset': self.offset.isoformat()}))
+        # everything ending in the next 6 hours
+        self.assertEqual([run.id for run in self.runs[2:8]], [run.id for run in runs])
+
+    def test_bid_feeds(self):
+        for params in ({'feed': 'current'}, {'feed': 'current', 'maxRuns': 1}, {'feed': 'future'},
+                       {'feed': 'future', 'delta': 60}):
+            self.assertFeedMatches('bid', params)
+        bids = self.assertFeedMatches('bid', {'feed': 'current', 'maxRuns': 2})
+        self.assertEqual([run.id for run in self.runs[3:5]], sorted(bid.speedrun_id for bid in bids))
+
+    def test_prize_feeds(self):
+        inWindow = models.Prize.objects.create(event=self.event, name='In Window', state='ACCEPTED',
+                                               startrun=self.runs[3], endrun=self.runs[4])
+        models.Prize.objects.create(event=self.event, name='Later', state='ACCEPTED',
+                                    startrun=self.runs[8], endrun=self.runs[9])
+        models.Prize.objects.create(event=self.event, name='Anytime', state='ACCEPTED')
+        prizes = self.assertFeedMatches('prize', {'feed': 'future', 'maxRuns': 3})
+        self.assertIn(inWindow.id, [prize.id for prize in prizes])
+        self.assertEqual(2, len(prizes))
@@ -0,0 +1,106 @@
+import datetime
+import json
+from decimal import Decimal
+from unittest import mock
+
+import pytz
+from django.core.cache import cache
+from django.test import TransactionTestCase, override_settings
+from django.urls import reverse
+
+import tracker.models as models
+import tracker.tickerutil as tickerutil
+
+
+@override_settings(TICKER_SNAPSHOT_EAGER=True)
+class TestTickerStream(TransactionTestCase):
+
+    def setUp(self):
+        self.publisher = tickerutil.TickerPublisher(pollInterval=0.01)
+        patcher = mock.patch.object(tickerutil, 'publisher', self.publisher)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.event = models.Event.objects.create(short='ev', name='Event', targetamount=5,
+                                                 datetime=datetime.datetime(2018, 1, 1, 12, tzinfo=pytz.utc))
+        self.donor = models.Donor.objects.create(email='donor@example.com')
+        self.addCleanup(cache.clear)
+
+    def donate(self, amount):
+        models.Donation.objects.create(event=self.event, donor=self.donor, amount=Decimal(amount),
+                                       domainId=amount, currency='GBP', transactionstate='COMPLETED')
+
+    def read(self, stream):
+        # the next message, skipping heartbeats
+        while True:
+            chunk = next(stream)
+            if not chunk.startswith(':'):
+                return dict(line.split(': ', 1) for line in chunk.strip().split('\n'))
+
+    def test_stream_pushes_only_changes(self):
+        self.donate('5.00')
+        stream = tickerutil.stream_events(self.event.id, heartbeat=0.05, duration=5)
+        self.assertEqual('retry: 3000\n\n', next(stream))
+        initial = [self.read(stream) for i in range(3)]
+        self.assertEqual({'runs', 'bids', 'total'}, {message['event'] for message in initial})
+        total = next(message for message in initial if message['event'] == 'total')
+        self.assertEqual(Decimal('5.00'), Decimal(json.loads(total['data'])))
+
+        self.donate('10.00')
+        message = self.read(stream)
+        self.assertEqual('total', message['event'])
+        self.assertEqual(Decimal('15.00'), Decimal(json.loads(message['data'])))
+        self.assertGreater(int(message['id']), int(total['id']))
+
+        # resuming from the latest id has nothing to catch up on
+        resumed = tickerutil.stream_events(self.event.id, int(message['id']), heartbeat=0.05, duration=5)
+        next(resumed)
+        self.assertEqual(': heartbeat\n\n', next(resumed))
+
+    @override_settings(TICKER_HEARTBEAT=0.05, TICKER_STREAM_DURATION=0.2)
+    def test_view(self):
+        self.donate('5.00')
+        response = self.client.get(reverse('tracker:feed_stream', args=(self.event.short,)), HTTP_LAST_EVENT_ID='0')
+        self.assertEqual('text/event-stream', response['Content-Type'])
+        body = b''.join(response.streaming_content).decode('utf-8')
+        self.assertEqual(1, body.count('event: total'))
+        self.assertEqual(1, body.count('event: runs'))
+        self.assertIn(': heartbeat', body)
+
+    def test_feed_views(self):
+        self.donate('5.00')
+        response = self.client.get(reverse('tracker:feed_current_donations', args=(self.event.short,)))
+        self.assertEqual(Decimal('5.00'), Decimal(json.loads(response.content.decode('utf-8'))['total']))
+        response = self.client.get(reverse('tracker:feed_upcoming_runs', args=(self.event.short,)))
+        self.assertEqual({'results': []}, json.loads(response.content.decode('utf-8')))
+
+    def test_feed_views_are_served_from_the_snapshot(self):
+        self.donate('5.00')
+        self.client.get(reverse('tracker:feed_current_donations', args=(self.event.short,)))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('tracker:feed_upcoming_bids', args=(self.event.short,)))
+        self.assertEqual('application/json', response['Content-Type'])
+        self.assertEqual({'results': []}, json.loads(response.content.decode('utf-8')))
+
+        self.donate('10.00')
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('tracker:feed_current_donations', args=(self.event.short,)))
+        self.assertEqual(Decimal('15.00'), Decimal(json.loads(response.content.decode('utf-8'))['total']))
+
+    @override_settings(TICKER_SNAPSHOT_EAGER=False)
+    def test_rebuilds_are_debounced(self):
+        with mock.patch.object(tickerutil.threading, 'Timer') as timer:
+            # nobody is watching the event yet
+            tickerutil.ticker_changed(self.event.id)
+            self.assertEqual(0, timer.call_count)
+            tickerutil.build_snapshot(self.event.id)
+            for i in range(3):
+                tickerutil.ticker_changed(self.event.id)
+            self.assertEqual(1, timer.call_count)
+            delay, target, args = timer.call_args[0]
+            self.assertEqual(tickerutil.TICKER_SNAPSHOT_DEBOUNCE, delay)
+            with mock.patch.object(tickerutil, 'build_snapshot') as build:
+                target(*args)
+            build.assert_called_once_with(self.event.id)
+            # once the build has started, the next change schedules another one
+            tickerutil.ticker_changed(self.event.id)
+            self.assertEqual(2, timer.call_count)
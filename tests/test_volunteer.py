@@ -0,0 +1,112 @@
+import datetime
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+import post_office.models
+import pytz
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.test import TestCase
+
+import tracker.models as models
+import tracker.volunteer as volunteer
+
+AuthUser = get_user_model()
+
+
+class TestVolunteerMail(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.csv = os.path.join(self.directory, 'volunteers.csv')
+        with open(self.csv, 'w') as csvFile:
+            csvFile.write('Name,Username,Email,Position\n')
+            for i in range(5):
+                csvFile.write('Vol {0},vol{0},vol{0}@example.com,{1}\n'.format(i, 'Head Tracker' if i == 0 else 'Tracker'))
+        self.event = models.Event.objects.create(short='ev', name='Event', targetamount=5,
+                                                 datetime=datetime.datetime(2018, 1, 1, 12, tzinfo=pytz.utc))
+        self.template = post_office.models.EmailTemplate.objects.create(
+            name='volunteer', subject='Hi {{ user.username }}', content='{{ reset_url }} {{ is_head }}')
+        self.existing = AuthUser.objects.create(username='vol1', email='vol1@example.com', is_active=True)
+        self.existing.groups.add(Group.objects.create(name='Bid Admin'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def send(self, **kwargs):
+        return volunteer.send_volunteer_mail('http://testserver', self.event,
+                                             volunteer.iter_volunteer_info_file(self.csv), self.template,
+                                             'nobody@example.com', batchSize=2, **kwargs)
+
+    def test_send(self):
+        self.assertEqual(5, self.send())
+        self.assertEqual(5, AuthUser.objects.filter(username__startswith='vol', is_staff=True).count())
+        self.assertEqual(['vol0'], list(AuthUser.objects.filter(groups__name='Bid Admin').values_list('username', flat=True)))
+        self.assertEqual(4, AuthUser.objects.filter(groups__name='Bid Tracker').count())
+        self.existing.refresh_from_db()
+        self.assertTrue(self.existing.is_active)
+        self.assertEqual(5, post_office.models.Email.objects.count())
+        mail = post_office.models.Email.objects.get(to='vol0@example.com')
+        self.assertEqual('Hi vol0', mail.subject)
+        self.assertIn('uidb64=', mail.message)
+        self.assertIn('True', mail.message)
+
+    def test_dry_run(self):
+        self.assertEqual(5, self.send(dry_run=True))
+        self.assertEqual(1, AuthUser.objects.count())
+        self.assertFalse(post_office.models.Email.objects.exists())
+
+    def test_resume(self):
+        checkpoint = volunteer.VolunteerCheckpoint(self.csv + '.checkpoint', self.event)
+        sendMany = volunteer.mailutil.send_many
+        calls = []
+
+        def failOnSecondBatch(mails):
+            calls.append(mails)
+            if len(calls) == 2:
+                raise IOError('mail queue unavailable')
+            sendMany(mails)
+
+        with mock.patch.object(volunteer.mailutil, 'send_many', side_effect=failOnSecondBatch):
+            with self.assertRaises(IOError):
+                self.send(checkpoint=checkpoint)
+        self.assertEqual(2, post_office.models.Email.objects.count())
+        # the failed batch was rolled back, users and all
+        self.assertFalse(AuthUser.objects.filter(username='vol2').exists())
+
+        checkpoint = volunteer.VolunteerCheckpoint(self.csv + '.checkpoint', self.event)
+        self.assertEqual((2, 'vol1@example.com'), (checkpoint.done, checkpoint.last))
+        self.assertEqual(5, self.send(checkpoint=checkpoint))
+        self.assertEqual(5, post_office.models.Email.objects.count())
+        self.assertEqual(1, post_office.models.Email.objects.filter(to='vol0@example.com').count())
+        self.assertFalse(os.path.exists(checkpoint.path))
+
+    def test_resume_after_commit(self):
+        checkpoint = volunteer.VolunteerCheckpoint(self.csv + '.checkpoint', self.event)
+        save = checkpoint.save
+
+        def dieAfterSecondBatch(done, last):
+            if done == 4:
+                # the batch has committed, but the run dies before the checkpoint says so
+                raise KeyboardInterrupt
+            save(done, last)
+
+        with mock.patch.object(checkpoint, 'save', side_effect=dieAfterSecondBatch):
+            with self.assertRaises(KeyboardInterrupt):
+                self.send(checkpoint=checkpoint)
+        self.assertEqual(4, post_office.models.Email.objects.count())
+
+        checkpoint = volunteer.VolunteerCheckpoint(self.csv + '.checkpoint', self.event)
+        self.assertEqual(2, checkpoint.done)
+        self.assertIsNotNone(checkpoint.pending)
+        self.assertEqual(5, self.send(checkpoint=checkpoint))
+        self.assertEqual([['vol{0}@example.com'.format(i)] for i in range(5)],
+                         sorted(post_office.models.Email.objects.values_list('to', flat=True)))
+
+    def test_checkpoint_mismatch(self):
+        checkpoint = volunteer.VolunteerCheckpoint(self.csv + '.checkpoint', self.event)
+        checkpoint.save(2, 'someone.else@example.com')
+        with self.assertRaises(ValueError):
+            self.send(checkpoint=checkpoint)
@@ -0,0 +1,304 @@
+"""
+Data for the stream overlays and tickers, both as one-off feeds and as a Server-Sent Events stream.
+
+Everything on the ticker for an event is kept in one precomputed snapshot in the cache, with each feed already
+serialized, so serving a feed takes no queries. Model signals bump the 'ticker' version of the event (see
+cacheutil) and schedule a rebuild of the snapshot, which runs in the background at most once per
+TICKER_SNAPSHOT_DEBOUNCE seconds however many changes come in.
+
+The stream is served from a single publisher per process, which watches the snapshot and wakes every connected
+stream when a feed in it changes. Every message carries the full state of one feed, so a client that reconnects
+with a Last-Event-ID only needs the feeds that changed after it.
+"""
+import json
+import logging
+import threading
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+import tracker.cacheutil as cacheutil
+import tracker.filters as filters
+import tracker.viewutil as viewutil
+
+logger = logging.getLogger(__name__)
+
+# how often waiting streams check for a new snapshot
+TICKER_POLL_INTERVAL = 0.5
+# the upcoming runs and bids move on with the clock, so snapshots older than this are rebuilt even if nothing changed
+TICKER_SNAPSHOT_MAX_AGE = 60
+TICKER_SNAPSHOT_DEBOUNCE = 0.5
+# how long a short name in a feed url keeps pointing at the same event
+TICKER_EVENT_TIMEOUT = 60 * 60
+TICKER_HEARTBEAT = 15
+# streams are closed after this long and the browser reconnects, so they never hold a worker forever
+TICKER_STREAM_DURATION = 300
+TICKER_RETRY = 3000
+
+
+def upcoming_runs(event_id):
+    # the next 3 upcoming runs for the event that haven't finished yet
+    params = {
+        'event': event_id,
+        'endtime_gte': timezone.now(),
+    }
+    runs = filters.run_model_query('run', params).prefetch_related('runners')[:3]
+    return [{
+        'game': run.name,
+        'category': run.category,
+        'estimate': str(run.run_time),
+        'runners': [r.name for r in run.runners.all()],
+    } for run in runs]
+
+
+def upcoming_bids(event_id):
+    # the upcoming bids and their public options + totals
+    params = {
+        'event': event_id,
+        'state': 'OPENED',
+    }
+    bids = filters.run_model_query('bid', params).filter(speedrun__endtime__gte=timezone.now()).select_related(
+        'speedrun').prefetch_related('options')
+    return [{
+        'game': bid.speedrun.name,
+        'bid': bid.name,
+        'goal': bid.goal,
+        # the total of a bid with options is already the sum of its public options
+        'amount_raised': bid.total,
+        'options': [{
+            'name': option.name,
+            'amount_raised': option.total,
+        } for option in bid.options.all() if option.state in ('OPENED', 'CLOSED')],
+    } for bid in bids]
+
+
+def current_total(event_id):
+    params = {
+        'event': event_id,
+    }
+    return filters.run_model_query('donation', params).aggregate(amount=Coalesce(Sum('amount'), Decimal('0.00')))['amount']
+
+
+TICKER_FEEDS = {
+    'runs': upcoming_runs,
+    'bids': upcoming_bids,
+    'total': current_total,
+}
+
+
+def _snapshot_key(event_id):
+    return 'tracker:ticker:snapshot:{0}'.format(event_id)
+
+
+def _slug_key(slug):
+    return 'tracker:ticker:event:{0}'.format(slug)
+
+
+def _pending_key(event_id):
+    return 'tracker:ticker:pending:{0}'.format(event_id)
+
+
+def build_snapshot(event_id):
+    """
+    Computes every ticker feed of the event and stores them, serialized, as the event's snapshot.
+
+    :return: the snapshot, a dict with the `id` to use for stream messages, the `version` it was built for, the
+        time it was `built`, each feed's JSON `feeds` and the body of each feed view's `responses`
+    :rtype: dict
+    """
+    # the version is read first, so a change that lands mid-build leaves the snapshot looking out of date
+    version = cacheutil.get_version('ticker', event_id)
+    now = time.time()
+    feeds = {kind: json.dumps(builder(event_id), cls=DjangoJSONEncoder) for kind, builder in TICKER_FEEDS.items()}
+    snapshot = {
+        # the version alone does not move when the clock changes the upcoming feeds
+        'id': max(version or 0, int(now * 1000)),
+        'version': version,
+        'built': now,
+        'feeds': feeds,
+        'responses': {
+            'runs': ('{"results": ' + feeds['runs'] + '}').encode('utf-8'),
+            'bids': ('{"results": ' + feeds['bids'] + '}').encode('utf-8'),
+            'total': ('{"total": ' + feeds['total'] + '}').encode('utf-8'),
+        },
+    }
+    cache.set(_snapshot_key(event_id), snapshot, None)
+    return snapshot
+
+
+def _build_snapshot_in_thread(event_id):
+    # let the next change schedule another build, even one that lands while this one runs
+    cache.delete(_pending_key(event_id))
+    try:
+        build_snapshot(event_id)
+    except Exception:
+        # the old snapshot keeps being served, and the next change or read schedules another try
+        logger.exception('Could not rebuild the ticker snapshot for event %s', event_id)
+    finally:
+        connection.close()
+
+
+def schedule_snapshot_build(event_id):
+    """
+    Rebuilds the event's snapshot in a background thread after TICKER_SNAPSHOT_DEBOUNCE seconds, unless a
+    rebuild is already scheduled in any process, in which case that one will pick up the change.
+    """
+    if getattr(settings, 'TICKER_SNAPSHOT_EAGER', False):
+        build_snapshot(event_id)
+        return
+    delay = getattr(settings, 'TICKER_SNAPSHOT_DEBOUNCE', TICKER_SNAPSHOT_DEBOUNCE)
+    # the key outlives the delay, so that a process dying before its build only holds things up briefly
+    if cache.add(_pending_key(event_id), True, delay + 5):
+        timer = threading.Timer(delay, _build_snapshot_in_thread, (event_id,))
+        timer.daemon = True
+        timer.start()
+
+
+def ticker_changed(event_id):
+    """
+    Called by model signals when something on the event's ticker has changed.
+    """
+    if event_id is None:
+        return
+    cacheutil.bump_version('ticker', event_id)
+    # events nobody has asked for a feed of are left alone, and get built the first time someone does
+    if cache.has_key(_snapshot_key(event_id)):
+        transaction.on_commit(lambda: schedule_snapshot_build(event_id))
+
+
+def get_snapshot(event_id):
+    """
+    Returns the event's snapshot, building it on the spot if there is none yet. A snapshot that is out of date
+    is still returned, but a rebuild is scheduled.
+
+    :rtype: dict
+    """
+    snapshot = cache.get(_snapshot_key(event_id))
+    if snapshot is None:
+        return build_snapshot(event_id)
+    version = cacheutil.get_version('ticker', event_id)
+    if version is None or snapshot['version'] != version or \
+            time.time() - snapshot['built'] > getattr(settings, 'TICKER_SNAPSHOT_MAX_AGE', TICKER_SNAPSHOT_MAX_AGE):
+        schedule_snapshot_build(event_id)
+    return snapshot
+
+
+def get_event_snapshot(event):
+    """
+    Returns the snapshot of an event given its short name or id, as used in the feed urls. Once the event has been
+    seen, this takes no queries.
+
+    :rtype: dict
+    """
+    event_id = cache.get(_slug_key(event))
+    if event_id is None:
+        event_id = viewutil.get_event(event).id
+        cache.set(_slug_key(event), event_id, TICKER_EVENT_TIMEOUT)
+    return get_snapshot(event_id)
+
+
+class _TickerState(object):
+    def __init__(self):
+        self.snapshot = None
+        self.changed = {}
+
+
+class TickerPublisher(object):
+    """
+    Keeps track of the snapshot of each event that someone is streaming, and wakes the streams up when the feeds
+    in it change. Safe to share between the threads of a worker process.
+    """
+
+    def __init__(self, pollInterval=TICKER_POLL_INTERVAL):
+        self.pollInterval = pollInterval
+        self._condition = threading.Condition()
+        self._states = {}
+
+    def refresh(self, event_id):
+        """
+        Picks up the event's current snapshot, noting which feeds changed since the last one.
+        """
+        snapshot = get_snapshot(event_id)
+        with self._condition:
+            state = self._states.setdefault(event_id, _TickerState())
+            previous = state.snapshot
+            if previous is not None and previous['id'] >= snapshot['id']:
+                return
+            for kind, payload in snapshot['feeds'].items():
+                if previous is None or previous['feeds'].get(kind) != payload:
+                    state.changed[kind] = snapshot['id']
+            state.snapshot = snapshot
+            self._condition.notify_all()
+
+    def messages_after(self, event_id, last_id):
+        """
+        :return: (id, feed, json data) of each feed that changed after `last_id`, oldest first
+        :rtype: list[tuple[int, str, str]]
+        """
+        with self._condition:
+            state = self._states.get(event_id)
+            if state is None:
+                return []
+            return sorted((changed, kind, state.snapshot['feeds'][kind]) for kind, changed in state.changed.items()
+                          if changed > last_id)
+
+    def wait(self, event_id, last_id, timeout):
+        """
+        Returns the messages after `last_id`, waiting up to `timeout` seconds for there to be any.
+
+        :rtype: list[tuple[int, str, str]]
+        """
+        deadline = time.time() + timeout
+        while True:
+            self.refresh(event_id)
+            messages = self.messages_after(event_id, last_id)
+            remaining = deadline - time.time()
+            if messages or remaining <= 0:
+                return messages
+            with self._condition:
+                self._condition.wait(min(self.pollInterval, remaining))
+
+
+publisher = TickerPublisher()
+
+
+def format_message(message_id, kind, data):
+    return 'id: {0}\nevent: {1}\ndata: {2}\n\n'.format(message_id, kind, data)
+
+
+def stream_events(event_id, last_id=0, heartbeat=None, duration=None):
+    """
+    Generates the Server-Sent Events stream of an event's ticker feeds, starting with every feed that changed
+    after `last_id`. Sends a comment as a heartbeat when nothing has changed for a while, and ends after
+    `duration` seconds for the browser to reconnect.
+
+    :param event_id: primary key of the event
+    :type event_id: int
+    :param last_id: the Last-Event-ID the client reconnected with, or 0
+    :type last_id: int
+    :rtype: generator[str]
+    """
+    if heartbeat is None:
+        heartbeat = getattr(settings, 'TICKER_HEARTBEAT', TICKER_HEARTBEAT)
+    if duration is None:
+        duration = getattr(settings, 'TICKER_STREAM_DURATION', TICKER_STREAM_DURATION)
+    deadline = time.time() + duration
+    yield 'retry: {0}\n\n'.format(TICKER_RETRY)
+    while True:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            break
+        messages = publisher.wait(event_id, last_id, min(heartbeat, remaining))
+        if messages:
+            for message in messages:
+                yield format_message(*message)
+            last_id = messages[-1][0]
+        else:
+            yield ': heartbeat\n\n'
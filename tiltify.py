@@ -7,6 +7,7 @@ import requests
 from django.conf import settings
 from django.core.exceptions import ValidationError
 
+import tracker.donorutil as donorutil
 from tracker.models import Donor, Donation
 
 TILTIFY_HOST = 'https://tiltify.com'
@@ -115,9 +116,8 @@ def sync_event_donations(event):
         # Get donor based on alias.
         donor = None
         if t_donation['name'] and t_donation['name'] != 'Anonymous':
-            try:
-                donor = Donor.objects.get(alias__iexact=t_donation['name'])
-            except Donor.DoesNotExist:
+            donor = donorutil.find_donor_by_alias(t_donation['name'])
+            if donor is None:
                 donor = Donor(email=t_donation['name'], alias=t_donation['name'])
                 donor.save()
 
@@ -38,9 +38,11 @@ urlpatterns = [
     path('me', api.me),
     path('api/v1', api.api_v1),
     path('api/v1/search', api.search),
+    path('api/v1/export', api.export),
     path('api/v1/add', api.add),
     path('api/v1/edit', api.edit),
     path('api/v1/delete', api.delete),
+    path('api/v1/batch', api.batch),
     path('api/v1/command', api.command),
     path('api/v1/me', api.me),
     path('api/v2/', include('tracker.api.urls')),
@@ -52,6 +54,7 @@ urlpatterns = [
     path('feed/upcoming_runs/<slug:event>', feedviews.UpcomingRunsView.as_view(), name='feed_upcoming_runs'),
     path('feed/upcoming_bids/<slug:event>', feedviews.UpcomingBidsView.as_view(), name='feed_upcoming_bids'),
     path('feed/current_donations/<slug:event>', feedviews.CurrentDonationsView.as_view(), name='feed_current_donations'),
+    path('feed/stream/<slug:event>', feedviews.TickerStreamView.as_view(), name='feed_stream'),
 
     path('user/index', user.user_index, name='user_index'),
     path('user/user_prize/<int:prize>', user.user_prize, name='user_prize'),
@@ -57,6 +57,14 @@ def make_rand(rand_source=None, rand_seed=None):
             rand_source = random.Random(rand_seed)
     return rand_source
     
+def normalize_key(value):
+    """Returns the form of an identifying string (an email, alias or name) used for case-insensitive
+    lookups, or None if there is nothing to match on"""
+    if value is None:
+        return None
+    value = value.strip().lower()
+    return value or None
+
 def make_auth_code(length=64, rand_source=None, rand_seed=None):
     rand_source = make_rand(rand_source, rand_seed)
     result = ''
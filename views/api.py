@@ -1,30 +1,35 @@
 import json
 
 import collections
+import tempfile
 
 import django.core.serializers as serializers
+from django.core.serializers.json import DjangoJSONEncoder
 from django.contrib import admin
 from django.contrib.auth.decorators import user_passes_test
 from django.contrib.auth.models import AnonymousUser
 from django.core.exceptions import FieldError, FieldDoesNotExist, ObjectDoesNotExist, ValidationError, PermissionDenied
 from django.db import transaction, connection
 from django.db.utils import IntegrityError
-from django.http import HttpResponse
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
 from django.http.response import Http404
 from django.views.decorators.cache import never_cache
 from django.views.decorators.csrf import csrf_exempt, csrf_protect
 
 from . import commands
-from .. import filters, viewutil, prizeutil, logutil
+from .. import aggregateutil, exportutil, filters, viewutil, prizeutil, logutil, moderationutil
 from ..models import *
 
 site = admin.site
 
 __all__ = [
     'search',
+    'export',
+    'moderation_stream',
     'add',
     'edit',
     'delete',
+    'batch',
     'command',
     'prize_donors',
     'draw_prize',
@@ -105,42 +110,41 @@ def donation_privacy_filter(model, fields):
     prefix = ''
     if not primary:
         prefix = 'donation__'
-    if fields[prefix + 'commentstate'] != 'APPROVED':
+    if fields.get(prefix + 'commentstate') != 'APPROVED':
         fields[prefix + 'comment'] = None
-    del fields[prefix + 'modcomment']
-    del fields[prefix + 'fee']
-    del fields[prefix + 'requestedalias']
-    if prefix + 'requestedemail' in fields:
-        del fields[prefix + 'requestedemail']
-    del fields[prefix + 'requestedvisibility']
-    del fields[prefix + 'requestedsolicitemail']
-    del fields[prefix + 'testdonation']
-    del fields[prefix + 'domainId']
+    fields.pop(prefix + 'modcomment', None)
+    fields.pop(prefix + 'fee', None)
+    fields.pop(prefix + 'requestedalias', None)
+    fields.pop(prefix + 'requestedemail', None)
+    fields.pop(prefix + 'requestedvisibility', None)
+    fields.pop(prefix + 'requestedsolicitemail', None)
+    fields.pop(prefix + 'testdonation', None)
+    fields.pop(prefix + 'domainId', None)
 
 def prize_privacy_filter(model, fields):
     if model != 'prize':
         return
-    del fields['extrainfo']
-    del fields['acceptemailsent']
-    del fields['state']
-    del fields['reviewnotes']
+    fields.pop('extrainfo', None)
+    fields.pop('acceptemailsent', None)
+    fields.pop('state', None)
+    fields.pop('reviewnotes', None)
 
 # honestly, I wonder if prizewinner as a whole should not be publicly visible
 # REALLY need that whitelist system soon
 def prizewinner_privacy_filter(model, fields):
     if model != 'prizewinner':
         return
-    del fields['couriername']
-    del fields['trackingnumber']
-    del fields['shippingstate']
-    del fields['shippingcost']
-    del fields['winnernotes']
-    del fields['shippingnotes']
-    del fields['emailsent']
-    del fields['acceptemailsentcount']
-    del fields['shippingemailsent']
-    del fields['auth_code']
-    del fields['shipping_receipt_url']
+    fields.pop('couriername', None)
+    fields.pop('trackingnumber', None)
+    fields.pop('shippingstate', None)
+    fields.pop('shippingcost', None)
+    fields.pop('winnernotes', None)
+    fields.pop('shippingnotes', None)
+    fields.pop('emailsent', None)
+    fields.pop('acceptemailsentcount', None)
+    fields.pop('shippingemailsent', None)
+    fields.pop('auth_code', None)
+    fields.pop('shipping_receipt_url', None)
 
 class Filters:
     @staticmethod
@@ -148,6 +152,47 @@ class Filters:
         if not user.has_perm('tracker.can_view_tech_notes'):
             del fields['tech_notes']
 
+def serialize_objects(searchtype, qs, user, authorizedUser):
+    """
+    Serializes search results the way the search API returns them, with related fields and the public name
+    flattened in, and private fields removed for unauthorized users.
+
+    :rtype: list[dict]
+    """
+    jsonData = json.loads(serializers.serialize('json', qs, ensure_ascii=False))
+    objs = dict([(o.id,o) for o in qs])
+    for o in jsonData:
+        baseObj = objs[int(o['pk'])]
+        if isinstance(baseObj, Donor):
+            o['fields']['public'] = baseObj.visible_name()
+        else:
+            o['fields']['public'] = str(baseObj)
+        for a in viewutil.ModelAnnotations.get(searchtype,{}):
+            o['fields'][a] = str(getattr(objs[int(o['pk'])],a))
+        for r in related.get(searchtype,[]):
+            ro = objs[int(o['pk'])]
+            for f in r.split('__'):
+                if not ro: break
+                ro = getattr(ro,f)
+            if not ro: continue
+            relatedData = json.loads(serializers.serialize('json', [ro], ensure_ascii=False))[0]
+            for f in ro.__dict__:
+                if f[0] == '_' or f.endswith('id') or f in defer.get(searchtype,[]): continue
+                v = relatedData["fields"][f]
+                o['fields'][r + '__' + f] = relatedData["fields"][f]
+            if isinstance(ro, Donor):
+                o['fields'][r + '__public'] = ro.visible_name()
+            else:
+                o['fields'][r + '__public'] = str(ro)
+        if not authorizedUser:
+            donor_privacy_filter(searchtype, o['fields'])
+            donation_privacy_filter(searchtype, o['fields'])
+            prize_privacy_filter(searchtype, o['fields'])
+        clean_fields = getattr(Filters, searchtype, None)
+        if clean_fields:
+            clean_fields(user, o['fields'])
+    return jsonData
+
 @never_cache
 def search(request):
     authorizedUser = request.user.has_perm('tracker.can_search')
@@ -163,38 +208,7 @@ def search(request):
         qs = qs.annotate(**viewutil.ModelAnnotations.get(searchtype,{}))
         if qs.count() > 1000:
             qs = qs[:1000]
-        jsonData = json.loads(serializers.serialize('json', qs, ensure_ascii=False))
-        objs = dict([(o.id,o) for o in qs])
-        for o in jsonData:
-            baseObj = objs[int(o['pk'])]
-            if isinstance(baseObj, Donor):
-                o['fields']['public'] = baseObj.visible_name()
-            else:
-                o['fields']['public'] = str(baseObj)
-            for a in viewutil.ModelAnnotations.get(searchtype,{}):
-                o['fields'][a] = str(getattr(objs[int(o['pk'])],a))
-            for r in related.get(searchtype,[]):
-                ro = objs[int(o['pk'])]
-                for f in r.split('__'):
-                    if not ro: break
-                    ro = getattr(ro,f)
-                if not ro: continue
-                relatedData = json.loads(serializers.serialize('json', [ro], ensure_ascii=False))[0]
-                for f in ro.__dict__:
-                    if f[0] == '_' or f.endswith('id') or f in defer.get(searchtype,[]): continue
-                    v = relatedData["fields"][f]
-                    o['fields'][r + '__' + f] = relatedData["fields"][f]
-                if isinstance(ro, Donor):
-                    o['fields'][r + '__public'] = ro.visible_name()
-                else:
-                    o['fields'][r + '__public'] = str(ro)
-            if not authorizedUser:
-                donor_privacy_filter(searchtype, o['fields'])
-                donation_privacy_filter(searchtype, o['fields'])
-                prize_privacy_filter(searchtype, o['fields'])
-            clean_fields = getattr(Filters, searchtype, None)
-            if clean_fields:
-                clean_fields(request.user, o['fields'])
+        jsonData = serialize_objects(searchtype, qs, request.user, authorizedUser)
         resp = HttpResponse(json.dumps(jsonData,ensure_ascii=False),content_type='application/json;charset=utf-8')
         if 'queries' in request.GET and request.user.has_perm('tracker.view_queries'):
             return HttpResponse(json.dumps(connection.queries, ensure_ascii=False, indent=1),content_type='application/json;charset=utf-8')
@@ -214,6 +228,62 @@ def search(request):
         return HttpResponse(json.dumps(d, ensure_ascii=False), status=400, content_type='application/json;charset=utf-8')
 
 
+@never_cache
+@user_passes_test(lambda u: u.is_staff)
+def export(request):
+    """
+    A whole table as CSV (streamed as it is read) or XLSX, picked with the same parameters as search, with `type` one
+    of exportutil.EXPORTS and `format` either csv (the default) or xlsx.
+    """
+    params = viewutil.request_params(request)
+    exportType = params.get('type')
+    exportFormat = params.get('format', 'csv')
+    if exportType not in exportutil.EXPORTS or exportFormat not in ('csv', 'xlsx'):
+        return HttpResponse(json.dumps({'error': 'Key Error, malformed export parameters'}, ensure_ascii=False), status=400, content_type='application/json;charset=utf-8')
+    filterParams = {key: value for key, value in params.items() if key not in ('type', 'format')}
+    fileName = '{0}.{1}'.format(exportType, exportFormat)
+    if exportFormat == 'xlsx':
+        if exportutil.openpyxl is None:
+            return HttpResponse(json.dumps({'error': 'XLSX exports are not available'}, ensure_ascii=False), status=400, content_type='application/json;charset=utf-8')
+        # a workbook is a zip file, which cannot be sent before it is finished
+        out = tempfile.TemporaryFile()
+        exportutil.write_xlsx(exportType, out, filterParams, request.user)
+        out.seek(0)
+        resp = FileResponse(out, content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+    else:
+        resp = StreamingHttpResponse(exportutil.stream_csv(exportType, filterParams, request.user), content_type='text/csv;charset=utf-8')
+    resp['Content-Disposition'] = 'attachment; filename="{0}"'.format(fileName)
+    return resp
+
+
+@never_cache
+def moderation_stream(request):
+    """
+    Polling endpoint for the donation moderation screens. Without a `cursor`, returns the whole `feed`;
+    with one, returns only the donations that changed since, along with the ids of changed donations that have
+    left the feed. Either way the response has the cursor to use next. It only waits for changes, up to `timeout`
+    seconds, where the MODERATION_MAX_TIMEOUT setting allows it, since a waiting request holds a worker.
+    """
+    if not request.user.has_perm('tracker.change_donation'):
+        raise PermissionDenied
+    try:
+        params = viewutil.request_params(request)
+        cursor = int(params['cursor']) if params.get('cursor') else None
+        update = moderationutil.get_moderation_update(params['feed'], event=params.get('event') or None,
+                                                      cursor=cursor, timeout=float(params.get('timeout', 0)))
+    except ValueError:
+        return HttpResponse(json.dumps({'error': 'Value Error, malformed moderation parameters'}, ensure_ascii=False), status=400, content_type='application/json;charset=utf-8')
+    except KeyError:
+        return HttpResponse(json.dumps({'error': 'Key Error, malformed moderation parameters'}, ensure_ascii=False), status=400, content_type='application/json;charset=utf-8')
+    output = {
+        'cursor': update.cursor,
+        'reset': update.reset,
+        'donations': serialize_objects('donation', update.donations, request.user,
+                                       request.user.has_perm('tracker.can_search')),
+        'removed': update.removed,
+    }
+    return HttpResponse(json.dumps(output, ensure_ascii=False), content_type='application/json;charset=utf-8')
+
 def to_natural_key(key):
     return key if type(key) == list else [key]
 
@@ -296,50 +366,111 @@ def filter_fields(fields, model_admin, request, obj=None):
             (field in writable_fields and field not in readonly_fields)]
 
 
-def generic_error_json(pretty_error, exception, pretty_exception=None, status=400, additional_keys=()):
+class ModelAccess(object):
+    """
+    The admin of a model and what the requesting user may do with it, looked up once and reused for every
+    object of the model a request touches.
+    """
+
+    def __init__(self, request, Model):
+        self.request = request
+        self.Model = Model
+        self.model_admin = get_admin(Model)
+        self._can_add = None
+        self._writable_fields = None
+        self._readonly_fields = None
+
+    def can_add(self):
+        if self._can_add is None:
+            self._can_add = self.model_admin.has_add_permission(self.request)
+        return self._can_add
+
+    def filter_fields(self, fields):
+        # same as filter_fields, the admins do not vary their fields by object
+        if self._writable_fields is None:
+            self._writable_fields = set(flatten(self.model_admin.get_fields(self.request)))
+            self._readonly_fields = set(self.model_admin.get_readonly_fields(self.request))
+        return [field for field in fields if
+                (field in self._writable_fields and field not in self._readonly_fields)]
+
+
+def model_access(request, typename, accessCache=None):
+    """
+    :param accessCache: ModelAccess already looked up for this request, by model, which the new one is added to
+    :type accessCache: dict
+    :rtype: ModelAccess
+    """
+    Model = modelmap.get(typename, None)
+    if Model is None:
+        raise KeyError('%s is not a recognized model type' % typename)
+    if accessCache is None:
+        return ModelAccess(request, Model)
+    if Model not in accessCache:
+        accessCache[Model] = ModelAccess(request, Model)
+    return accessCache[Model]
+
+
+def generic_error_data(pretty_error, exception, pretty_exception=None, additional_keys=()):
     error = {'error': pretty_error, 'exception': pretty_exception or str(exception)}
     for key in additional_keys:
         value = getattr(exception, key, None)
         if value:
             error[key] = value
+    return error
+
+
+def generic_error_json(pretty_error, exception, pretty_exception=None, status=400, additional_keys=()):
+    error = generic_error_data(pretty_error, exception, pretty_exception, additional_keys)
     return HttpResponse(json.dumps(error, ensure_ascii=False), status=status, content_type='application/json;charset=utf-8')
 
 
+# the exceptions the write endpoints report back as errors, in the order they are checked
+API_ERRORS = (
+    (PermissionDenied, 'Permission Denied', 403, {}),
+    (IntegrityError, 'Integrity Error', 400, {}),
+    (ValidationError, 'Validation Error', 400, {
+        'pretty_exception': 'See message_dict and/or messages for details',
+        'additional_keys': ('message_dict', 'messages'),
+    }),
+    ((AttributeError, KeyError, FieldError, ValueError), 'Malformed Add Parameters', 400, {}),
+    (FieldDoesNotExist, 'Field does not exist', 400, {}),
+    (ObjectDoesNotExist, 'Foreign Key relation could not be found', 400, {}),
+)
+
+
+def api_error(exception):
+    """
+    :return: the error body and status to report the exception with, or None if it is not one the api reports
+    :rtype: tuple[dict, int]|None
+    """
+    for types, pretty_error, status, options in API_ERRORS:
+        if isinstance(exception, types):
+            return generic_error_data(pretty_error, exception, **options), status
+    return None
+
+
 def generic_api_view(view_func):
     def wrapped_view(request, *args, **kwargs):
         try:
             return view_func(request, *args, **kwargs)
-        except PermissionDenied as e:
-            return generic_error_json('Permission Denied', e, status=403)
-        except IntegrityError as e:
-            return generic_error_json('Integrity Error', e)
-        except ValidationError as e:
-            return generic_error_json('Validation Error', e,
-                                      pretty_exception='See message_dict and/or messages for details',
-                                      additional_keys=('message_dict', 'messages'))
-        except (AttributeError, KeyError, FieldError, ValueError) as e:
-            return generic_error_json('Malformed Add Parameters', e)
-        except FieldDoesNotExist as e:
-            return generic_error_json('Field does not exist', e)
-        except ObjectDoesNotExist as e:
-            return generic_error_json('Foreign Key relation could not be found', e)
+        except Exception as e:
+            error = api_error(e)
+            if error is None:
+                raise
+            body, status = error
+            return HttpResponse(json.dumps(body, ensure_ascii=False), status=status, content_type='application/json;charset=utf-8')
     return wrapped_view
 
 
-@csrf_exempt
-@generic_api_view
-@never_cache
-@transaction.atomic
-def add(request):
-    addParams = viewutil.request_params(request)
-    addtype = addParams['type']
-    Model = modelmap.get(addtype, None)
-    if Model is None:
-        raise KeyError('%s is not a recognized model type' % addtype)
-    model_admin = get_admin(Model)
-    if not model_admin.has_add_permission(request):
+def add_object(request, addParams, access, logger):
+    """
+    :return: the new object and whatever else saving it created
+    :rtype: list[Model]
+    """
+    Model = access.Model
+    if not access.can_add():
         raise PermissionDenied('You do not have permission to add a model of the requested type')
-    good_fields = filter_fields(list(addParams.keys()), model_admin, request)
+    good_fields = access.filter_fields(list(addParams.keys()))
     bad_fields = set(good_fields) - set(addParams.keys())
     if bad_fields:
         raise PermissionDenied('You do not have permission to set the following field(s) on new objects: %s' %
@@ -354,49 +485,34 @@ def add(request):
         changed_fields.append('Set %s to "%s".' % (k, new_value))
     newobj.full_clean()
     models = newobj.save() or [newobj]
-    logutil.addition(request, newobj)
-    logutil.change(request, newobj, ' '.join(changed_fields))
-    resp = HttpResponse(serializers.serialize('json', models, ensure_ascii=False),content_type='application/json;charset=utf-8')
-    if 'queries' in request.GET and request.user.has_perm('tracker.view_queries'):
-        return HttpResponse(json.dumps(connection.queries, ensure_ascii=False, indent=1),content_type='application/json;charset=utf-8')
-    return resp
-
-
-@csrf_exempt
-@generic_api_view
-@never_cache
-@transaction.atomic
-def delete(request):
-    deleteParams = viewutil.request_params(request)
-    deltype = deleteParams['type']
-    Model = modelmap.get(deltype, None)
-    if Model is None:
-        raise KeyError('%s is not a recognized model type' % deltype)
-    obj = Model.objects.get(pk=deleteParams['id'])
-    model_admin = get_admin(Model)
-    if not model_admin.has_delete_permission(request, obj):
+    logger.log_addition(newobj)
+    logger.log_change(newobj, ' '.join(changed_fields))
+    return models
+
+
+def delete_object(request, deleteParams, access, logger):
+    """
+    :return: a description of what was deleted
+    :rtype: str
+    """
+    obj = access.Model.objects.get(pk=deleteParams['id'])
+    if not access.model_admin.has_delete_permission(request, obj):
         raise PermissionDenied('You do not have permission to delete that model')
-    logutil.deletion(request, obj)
+    logger.log_deletion(obj)
     obj.delete()
-    return HttpResponse(json.dumps({'result': 'Object %s of type %s deleted' % (deleteParams['id'], deleteParams['type'])}, ensure_ascii=False), content_type='application/json;charset=utf-8')
+    return 'Object %s of type %s deleted' % (deleteParams['id'], deleteParams['type'])
 
 
-@csrf_exempt
-@generic_api_view
-@never_cache
-@transaction.atomic
-def edit(request):
-    editParams = viewutil.request_params(request)
-    edittype = editParams['type']
-    Model = modelmap.get(edittype, None)
-    if Model is None:
-        raise KeyError('%s is not a recognized model type' % edittype)
-    Model = modelmap[edittype]
-    model_admin = get_admin(Model)
+def edit_object(request, editParams, access, logger):
+    """
+    :return: the changed object and whatever else saving it changed
+    :rtype: list[Model]
+    """
+    Model = access.Model
     obj = Model.objects.get(pk=editParams['id'])
-    if not model_admin.has_change_permission(request, obj):
+    if not access.model_admin.has_change_permission(request, obj):
         raise PermissionDenied('You do not have permission to change that object')
-    good_fields = filter_fields(list(editParams.keys()), model_admin, request)
+    good_fields = access.filter_fields(list(editParams.keys()))
     bad_fields = set(good_fields) - set(editParams.keys())
     if bad_fields:
         raise PermissionDenied('You do not have permission to set the following field(s) on the requested object: %s' %
@@ -422,13 +538,151 @@ def edit(request):
     obj.full_clean()
     models = obj.save() or [obj]
     if changed_fields:
-        logutil.change(request, obj, ' '.join(changed_fields))
+        logger.log_change(obj, ' '.join(changed_fields))
+    return models
+
+
+@csrf_exempt
+@generic_api_view
+@never_cache
+@transaction.atomic
+def add(request):
+    addParams = viewutil.request_params(request)
+    access = model_access(request, addParams['type'])
+    models = add_object(request, addParams, access, logutil.AdminLogger(request))
+    resp = HttpResponse(serializers.serialize('json', models, ensure_ascii=False),content_type='application/json;charset=utf-8')
+    if 'queries' in request.GET and request.user.has_perm('tracker.view_queries'):
+        return HttpResponse(json.dumps(connection.queries, ensure_ascii=False, indent=1),content_type='application/json;charset=utf-8')
+    return resp
+
+
+@csrf_exempt
+@generic_api_view
+@never_cache
+@transaction.atomic
+def delete(request):
+    deleteParams = viewutil.request_params(request)
+    access = model_access(request, deleteParams['type'])
+    result = delete_object(request, deleteParams, access, logutil.AdminLogger(request))
+    return HttpResponse(json.dumps({'result': result}, ensure_ascii=False), content_type='application/json;charset=utf-8')
+
+
+@csrf_exempt
+@generic_api_view
+@never_cache
+@transaction.atomic
+def edit(request):
+    editParams = viewutil.request_params(request)
+    access = model_access(request, editParams['type'])
+    models = edit_object(request, editParams, access, logutil.AdminLogger(request))
     resp = HttpResponse(serializers.serialize('json', models, ensure_ascii=False),content_type='application/json;charset=utf-8')
     if 'queries' in request.GET and request.user.has_perm('tracker.view_queries'):
         return HttpResponse(json.dumps(connection.queries, ensure_ascii=False, indent=1),content_type='application/json;charset=utf-8')
     return resp
 
 
+BATCH_ACTIONS = {
+    'add': add_object,
+    'edit': edit_object,
+    'delete': delete_object,
+}
+BATCH_MAX_OPERATIONS = 500
+
+
+class BatchFailed(Exception):
+    def __init__(self, index, body, status):
+        super(BatchFailed, self).__init__(body['error'])
+        self.index = index
+        self.body = body
+        self.status = status
+
+
+def batch_value(value):
+    # values are taken the same way the single endpoints take their parameters
+    if isinstance(value, str):
+        return value
+    if value is None:
+        return 'None'
+    if isinstance(value, (list, dict)):
+        return json.dumps(value)
+    return str(value)
+
+
+def run_batch_operation(request, operation, accessCache, logger):
+    """
+    :return: the result of the operation, the objects it added or changed or a description of what it deleted
+    :rtype: dict
+    """
+    if not isinstance(operation, dict):
+        raise ValueError('Each operation must be an object')
+    params = {k: batch_value(v) for k, v in operation.items() if k != 'action'}
+    action = BATCH_ACTIONS.get(operation.get('action'), None)
+    if action is None:
+        raise KeyError('%s is not a recognized action' % operation.get('action'))
+    access = model_access(request, params['type'], accessCache)
+    result = action(request, params, access, logger)
+    if isinstance(result, str):
+        return {'result': result}
+    return {'objects': serializers.serialize('python', result)}
+
+
+@csrf_exempt
+@generic_api_view
+@never_cache
+@transaction.atomic
+def batch(request):
+    """
+    Runs a list of add, edit and delete operations in order, in one transaction, e.g.
+    `{"operations": [{"action": "edit", "type": "bid", "id": 1, "state": "CLOSED"}, ...], "atomic": true}`
+    as the request body or the `data` parameter. Each operation takes the same parameters as its single endpoint.
+
+    With `atomic` (the default) the first failing operation rolls back the whole batch and its error is returned,
+    along with its `operation` index. Otherwise each operation gets a savepoint of its own, the failing ones are
+    rolled back on their own and the rest are kept, and the result of each is returned.
+
+    The donor totals and bid totals the operations affect are recomputed once at the end instead of after every
+    save, and the admin log entries are written in one go.
+    """
+    if request.content_type == 'application/json':
+        data = json.loads(request.body.decode('utf-8') or '{}')
+    else:
+        data = json.loads(viewutil.request_params(request).get('data', '{}'))
+    operations = data.get('operations', None)
+    if not isinstance(operations, list):
+        raise ValueError('operations must be a list')
+    if len(operations) > BATCH_MAX_OPERATIONS:
+        raise ValueError('A batch can have at most %d operations' % BATCH_MAX_OPERATIONS)
+    atomic = data.get('atomic', True)
+    accessCache = {}
+    logger = logutil.BufferedAdminLogger(request)
+    results = []
+    try:
+        with aggregateutil.deferred_aggregates():
+            for index, operation in enumerate(operations):
+                mark = logger.savepoint()
+                try:
+                    with transaction.atomic():
+                        result = run_batch_operation(request, operation, accessCache, logger)
+                except Exception as e:
+                    error = api_error(e)
+                    if error is None:
+                        raise
+                    logger.rollback(mark)
+                    body, status = error
+                    if atomic:
+                        raise BatchFailed(index, body, status)
+                    results.append(dict(body, status=status))
+                else:
+                    results.append(dict(result, status=200))
+    except BatchFailed as e:
+        transaction.set_rollback(True)
+        return HttpResponse(json.dumps(dict(e.body, operation=e.index), ensure_ascii=False), status=e.status,
+                            content_type='application/json;charset=utf-8')
+    logger.flush()
+    return HttpResponse(json.dumps({'results': results}, cls=DjangoJSONEncoder, ensure_ascii=False),
+                        content_type='application/json;charset=utf-8')
+
+
 @never_cache
 def prize_donors(request):
     try:
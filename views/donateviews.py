@@ -1,11 +1,9 @@
-import collections
 import datetime
 import json
 import random
 import traceback
 from decimal import Decimal
 
-import post_office.mail
 import pytz
 from django.conf import settings
 from django.core import serializers
@@ -17,11 +15,11 @@ from django.views.decorators.cache import never_cache, cache_page
 from django.views.decorators.csrf import csrf_exempt
 from django.views.generic import TemplateView, FormView
 
-import tracker.eventutil as eventutil
-import tracker.filters as filters
+import tracker.donateutil as donateutil
 import tracker.forms as forms
 import tracker.models as models
 import tracker.paypalutil as paypalutil
+import tracker.prizeutil as prizeutil
 import tracker.viewutil as viewutil
 from . import common as views_common
 
@@ -135,23 +133,23 @@ def donate_orig(request, event):
       result['label'] += ' (select and add a name next to "New Option Name")'
     return result
 
-  bids = filters.run_model_query('bidtarget', {'state':'OPENED', 'event':event.id }, user=request.user).distinct().select_related('parent').prefetch_related('suggestions')
+  bids = donateutil.get_donation_menu(event).targets
 
-  allPrizes = filters.run_model_query('prize', {'feed': 'current', 'event': event.id })
+  allPrizes = prizeutil.get_current_prizes(event)
 
-  prizes = allPrizes.filter(ticketdraw=False)
+  prizes = [prize for prize in allPrizes if not prize.ticketdraw]
 
   dumpArray = [bid_info(o) for o in bids]
 
   bidsJson = json.dumps(dumpArray, ensure_ascii=False, cls=serializers.json.DjangoJSONEncoder)
 
-  ticketPrizes = allPrizes.filter(ticketdraw=True, auto_tickets=False)
+  ticketPrizes = [prize for prize in allPrizes if prize.ticketdraw and not prize.auto_tickets]
 
   def prize_info(prize):
     result = {'id': prize.id, 'name': prize.name, 'description': prize.description, 'minimumbid': prize.minimumbid, 'maximumbid': prize.maximumbid, 'sumdonations': prize.sumdonations}
     return result
 
-  dumpArray = [prize_info(o) for o in ticketPrizes.all()]
+  dumpArray = [prize_info(o) for o in ticketPrizes]
   ticketPrizesJson = json.dumps(dumpArray, ensure_ascii=False, cls=serializers.json.DjangoJSONEncoder)
 
   return views_common.tracker_response(request, "tracker/donate.html", {
@@ -159,9 +157,9 @@ def donate_orig(request, event):
     'bidsform': bidsform,
     'prizesform': prizesform,
     'commentform': commentform,
-    'hasBids': bids.count() > 0,
+    'hasBids': len(bids) > 0,
     'bidsJson': bidsJson,
-    'hasTicketPrizes': ticketPrizes.count() > 0,
+    'hasTicketPrizes': len(ticketPrizes) > 0,
     'ticketPrizesJson': ticketPrizesJson,
     'prizes': prizes,
     'site_name': settings.SITE_NAME,
@@ -189,27 +187,14 @@ class DonateViewV2(TemplateView):
     else:
       amount = Decimal('0.00')
 
-    # Bid selection form
-    bids = filters.run_model_query(
-      'bid', {'state': 'OPENED', 'event': event.id}, user=self.request.user).select_related(
-      'speedrun').prefetch_related('options')
-    context['bidsform'] = forms.DonationBidFormV2(amount=amount, bids=bids, data=self.request.POST or None)
-    context['hasBids'] = bids.count() > 0
-    context['bids'] = bids
+    # Bid selection form, the bids and their options come from the shared donation menu
+    menu = donateutil.get_donation_menu(event)
+    context['bidsform'] = forms.DonationBidFormV2(amount=amount, bids=menu.bids, data=self.request.POST or None)
+    context['hasBids'] = len(menu.bids) > 0
+    context['bids'] = menu.bids
 
-    # Group bids by run for the revamped donate page display.
-    bids_by_run = collections.OrderedDict()
-    for bid in bids:
-      if bid.speedrun not in bids_by_run:
-        bids_by_run[bid.speedrun] = []
-
-      bid.options_list = list(bid.options.filter(state='OPENED').order_by('-total', 'name'))
-      bids_by_run[bid.speedrun].append(bid)
-
-    context['bids_by_run'] = []
-    for run, bids in bids_by_run.items():
-      run.bid_list = bids
-      context['bids_by_run'].append(run)
+    # Bids grouped by run for the revamped donate page display.
+    context['bids_by_run'] = menu.runs
 
     return context
 
@@ -246,10 +231,10 @@ class DonateViewV2(TemplateView):
 
             if bids_form.cleaned_data.get(amt_field) and bids_form.cleaned_data.get(opt_field):
               try:
-                option = models.Bid.objects.get(event=bid.event, speedrun=bid.speedrun,
+                option = models.Bid.objects.get(event_id=bid.event_id, speedrun_id=bid.speedrun_id,
                                                 name__iexact=bids_form.cleaned_data[opt_field], parent=bid)
               except models.Bid.DoesNotExist:
-                option = models.Bid.objects.create(event=bid.event, speedrun=bid.speedrun,
+                option = models.Bid.objects.create(event_id=bid.event_id, speedrun_id=bid.speedrun_id,
                                                    name=bids_form.cleaned_data[opt_field], parent=bid,
                                                   state='PENDING', istarget=True)
               donation.bids.add(models.DonationBid(bid=option, amount=Decimal(bids_form.cleaned_data[amt_field])),
@@ -262,7 +247,7 @@ class DonateViewV2(TemplateView):
                                 bulk=False)
 
           # Check any of its children if they are targets.
-          for option in bid.options.all():
+          for option in bid.options_list:
             opt_amt_field = 'bid_amt_{}'.format(option.id)
             if option.istarget and bids_form.cleaned_data.get(opt_amt_field):
               donation.bids.add(models.DonationBid(bid=option, amount=Decimal(bids_form.cleaned_data[opt_amt_field])),
@@ -304,54 +289,15 @@ else:
 @csrf_exempt
 @never_cache
 def ipn(request):
-  ipnObj = None
-
   if request.method == 'GET' or len(request.POST) == 0:
     return views_common.tracker_response(request, "tracker/badobject.html", {})
 
+  # only store the notification here, the queue worker does the actual processing so that
+  # PayPal gets its answer right away no matter how busy we are
   try:
-    ipnObj = paypalutil.create_ipn(request)
-    ipnObj.save()
-
-    donation = paypalutil.initialize_paypal_donation(ipnObj)
-    donation.save()
-
-    if donation.transactionstate == 'PENDING':
-      reasonExplanation, ourFault = paypalutil.get_pending_reason_details(ipnObj.pending_reason)
-      if donation.event.pendingdonationemailtemplate:
-        formatContext = {
-          'event': donation.event,
-          'donation': donation,
-          'donor': donation.donor,
-          'pending_reason': ipnObj.pending_reason,
-          'reason_info': reasonExplanation if not ourFault else '',
-        }
-        post_office.mail.send(recipients=[donation.donor.email], sender=donation.event.donationemailsender, template=donation.event.pendingdonationemailtemplate, context=formatContext)
-      # some pending reasons can be a problem with the receiver account, we should keep track of them
-      if ourFault:
-        paypalutil.log_ipn(ipnObj, 'Unhandled pending error')
-    elif donation.transactionstate == 'COMPLETED':
-      if donation.event.donationemailtemplate != None:
-        formatContext = {
-          'donation': donation,
-          'donor': donation.donor,
-          'event': donation.event,
-          'prizes': viewutil.get_donation_prize_info(donation),
-        }
-        post_office.mail.send(recipients=[donation.donor.email], sender=donation.event.donationemailsender, template=donation.event.donationemailtemplate, context=formatContext)
-        
-      eventutil.post_donation_to_postbacks(donation)
-  
-    elif donation.transactionstate == 'CANCELLED':
-      # eventually we may want to send out e-mail for some of the possible cases
-      # such as payment reversal due to double-transactions (this has happened before)
-      paypalutil.log_ipn(ipnObj, 'Cancelled/reversed payment')
-
+    paypalutil.enqueue_ipn(request)
   except Exception as inst:
-    # just to make sure we have a record of it somewhere
-    print("ERROR IN IPN RESPONSE, FIX IT")
-    if ipnObj:
-      paypalutil.log_ipn(ipnObj, "{0} \n {1}. POST data : {2}".format(inst, traceback.format_exc(inst), request.POST))
-    else:
-      viewutil.tracker_log('paypal', 'IPN creation failed: {0} \n {1}. POST data : {2}'.format(inst, traceback.format_exc(inst), request.POST))
+    viewutil.tracker_log('paypal', 'IPN queueing failed: {0} \n {1}. POST data : {2}'.format(inst, traceback.format_exc(), request.POST))
+    # let PayPal know it should try again later
+    return HttpResponse("ERROR", status=500)
   return HttpResponse("OKAY")
@@ -1,81 +1,46 @@
 # Views for the public data feed for our tickers.
 
-from decimal import Decimal
-
-from django.db.models import Sum
-from django.db.models.functions import Coalesce
-from django.http import JsonResponse
-from django.utils import timezone
+from django.http import HttpResponse, StreamingHttpResponse
 from django.views.generic.base import View
 
-from tracker import viewutil, filters
+from tracker import viewutil, tickerutil
 
 
-class UpcomingRunsView(View):
-    def get(self, request, event, *args, **kwargs):
-        # Get the next 3 upcoming runs for the event that haven't finished yet.
-        event = viewutil.get_event(event)
-        now = timezone.now()
-        params = {
-            'event': event.id,
-            'endtime_gte': now,
-        }
-        runs = filters.run_model_query('run', params)[:3]
+def _snapshot_response(event, kind):
+    # served straight from the precomputed snapshot, see tickerutil
+    return HttpResponse(tickerutil.get_event_snapshot(event)['responses'][kind], content_type='application/json')
 
-        results = []
-        for run in runs:
-            results.append({
-                'game': run.name,
-                'category': run.category,
-                'estimate': str(run.run_time),
-                'runners': [r.name for r in run.runners.all()],
-            })
 
-        return JsonResponse({'results': results})
+class UpcomingRunsView(View):
+    def get(self, request, event, *args, **kwargs):
+        return _snapshot_response(event, 'runs')
 
 
 class UpcomingBidsView(View):
     def get(self, request, event, *args, **kwargs):
-        # Get the upcoming bids and their options + totals.
-        event = viewutil.get_event(event)
-        now = timezone.now()
-        params = {
-            'event': event.id,
-            'state': 'OPENED',
-        }
-        bids = filters.run_model_query('bid', params).filter(speedrun__endtime__gte=now).select_related(
-            'speedrun').prefetch_related('options')
-        results = []
+        return _snapshot_response(event, 'bids')
 
-        for bid in bids:
-            result = {
-                'game': bid.speedrun.name,
-                'bid': bid.name,
-                'goal': bid.goal,
-                'amount_raised': bid.total,
-                'options': [],
-            }
-            for option in bid.options.all():
-                result['options'].append({
-                    'name': option.name,
-                    'amount_raised': option.total,
-                })
-                result['amount_raised'] += option.total
 
-            results.append(result)
+class CurrentDonationsView(View):
+    def get(self, request, event, *args, **kwargs):
+        return _snapshot_response(event, 'total')
 
-        return JsonResponse({'results': results})
 
+class TickerStreamView(View):
+    """
+    Server-Sent Events stream of the runs, bids and total feeds above, pushed whenever they change. Each message is
+    named after its feed and holds the same data as the feed's own view.
+    """
 
-class CurrentDonationsView(View):
     def get(self, request, event, *args, **kwargs):
         event = viewutil.get_event(event)
-        params = {
-            'event': event.id,
-        }
-        agg = filters.run_model_query('donation', params).aggregate(amount=Coalesce(Sum('amount'), Decimal('0.00')))
-
-        return JsonResponse({
-            'total': agg['amount'],
-        })
-
+        try:
+            last_id = int(request.META.get('HTTP_LAST_EVENT_ID') or request.GET.get('lastEventId') or 0)
+        except ValueError:
+            last_id = 0
+        response = StreamingHttpResponse(tickerutil.stream_events(event.id, last_id),
+                                         content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # stop nginx from buffering the stream
+        response['X-Accel-Buffering'] = 'no'
+        return response
@@ -12,6 +12,10 @@ from django.urls import reverse
 
 from .models import *
 from . import filters
+from . import logutil
+from . import mergeutil
+from . import prizeutil
+from . import util
 from functools import reduce
 
 
@@ -119,14 +123,11 @@ ModelAnnotations = {
 }
 
 def find_people(people_list):
-  result = []
-  for person in people_list:
-      try:
-        d = Donor.objects.get(alias__iequals=person)
-        result.append(d)
-      except:
-        pass
-  return result
+  keys = [util.normalize_key(person) for person in people_list]
+  donors = {}
+  for donor in Donor.objects.filter(aliaskey__in=[key for key in keys if key]):
+    donors.setdefault(donor.aliaskey, donor)
+  return [donors[key] for key in keys if key in donors]
 
 def prizecmp(a,b):
   # if both prizes are run-linked, sort them that way
@@ -179,40 +180,23 @@ def get_donation_prize_info(donation):
     contribAmount = get_donation_prize_contribution(ticket.prize, donation, ticket.amount)
     if contribAmount != None:
       prizeList.append({'prize': ticket.prize, 'amount': contribAmount})
-  for timeprize in filters.run_model_query( 'prize', params={ 'feed': 'current', 'ticketdraw': False, 'offset': donation.timereceived, 'noslice': True } ):
-    contribAmount = get_donation_prize_contribution(timeprize, donation)
-    if contribAmount != None:
-      prizeList.append({'prize': timeprize, 'amount': contribAmount})
+  # the window index only returns prizes whose draw window contains the donation already
+  for timeprize in prizeutil.get_current_prizes(donation.event_id, donation.timereceived):
+    if timeprize.ticketdraw:
+      continue
+    if timeprize.sumdonations or donation.amount >= timeprize.minimumbid:
+      prizeList.append({'prize': timeprize, 'amount': donation.amount})
   return prizeList
 
 def tracker_log(category, message='', event=None, user=None):
-  Log.objects.create(category=category, message=message, event=event, user=user)
+  # written in bulk with whatever else gets logged around it, see logutil.LogSink
+  logutil.sink.add(Log(category=category, message=message, event=event, user=user))
 
 def merge_bids(rootBid, bids):
-  for bid in bids:
-    if bid != rootBid:
-      for donationBid in bid.bids.all():
-        donationBid.bid = rootBid
-        donationBid.save()
-      for suggestion in bid.suggestions.all():
-        suggestion.bid = rootBid
-        suggestion.save()
-      bid.delete()
-  rootBid.save()
-  return rootBid
+  return mergeutil.plan_merge(rootBid, bids).execute()
 
 def merge_donors(rootDonor, donors):
-  for other in donors:
-    if other != rootDonor:
-      for donation in other.donation_set.all():
-        donation.donor = rootDonor
-        donation.save()
-      for prizewin in other.prizewinner_set.all():
-        prizewin.winner = rootDonor
-        prizewin.save()
-      other.delete()
-  rootDonor.save()
-  return rootDonor
+  return mergeutil.plan_merge(rootDonor, donors).execute()
 
 def autocreate_donor_user(donor):
     AuthUser = get_user_model()
@@ -1,26 +1,32 @@
 import csv
+import json
+import os
+from itertools import islice
 
 from django.contrib.auth import *
 from django.contrib.auth.models import *
 from django.contrib.auth.tokens import default_token_generator
 from django.db import transaction
+from django.db.models import Q
 from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 
-import post_office.mail
 import post_office.models
 
 from django.conf import settings
 
 from tracker.models import *
 from tracker import auth
+from tracker import mailutil
 from tracker import viewutil
 
 AuthUser = get_user_model()
 
 _targetColumns = ['name', 'username', 'email', 'position', ]
 
-class DryRunException(Exception):
-    pass
+# how many volunteers are looked up, saved and mailed together
+VOLUNTEER_BATCH_SIZE = 100
 
 class VolunteerInfo:
     def __init__(self, firstname, lastname, username, email, is_head):
@@ -54,59 +60,183 @@ def parse_volunteer_row(row, mapping):
     return VolunteerInfo(firstname=firstname, lastname=lastname, username=username, email=email, is_head=isHead)
 
 
-def parse_volunteer_info_file(csvFilename):
-    csvFile = open(csvFilename, 'r')
-    csvReader = csv.reader(csvFile)
-    header = True
-    volunteers = []
-    mapping = {}
-    for row in csvReader:
-        if header:
-            header = False
-            mapping = parse_header_row(row)
-        else:
-            volunteers.append(parse_volunteer_row(row, mapping))
-    csvFile.close()
-    return volunteers
+def iter_volunteer_info_file(csvFilename):
+    """Reads the volunteers from the file one row at a time"""
+    with open(csvFilename, 'r') as csvFile:
+        csvReader = csv.reader(csvFile)
+        mapping = None
+        for row in csvReader:
+            if not row:
+                continue
+            if mapping is None:
+                mapping = parse_header_row(row)
+            else:
+                yield parse_volunteer_row(row, mapping)
 
 
-def send_volunteer_mail(domain, event, volunteers, template, sender=None, token_generator=default_token_generator, verbosity=0, dry_run=False):
+def parse_volunteer_info_file(csvFilename):
+    return list(iter_volunteer_info_file(csvFilename))
+
+
+class VolunteerCheckpoint(object):
+    """
+    How far through a volunteer list a run has got, kept in a file after every batch, so that a run that fails
+    halfway can pick up after the last batch that went through instead of mailing everyone again.
+
+    The file cannot be written in the same transaction as a batch, so it also says when the batch after the last
+    one recorded was started. A run that dies after that batch commits, but before the file says so, leaves that
+    time behind, and the batch is not mailed again to anyone who has been mailed since.
+    """
+    def __init__(self, path, event):
+        self.path = path
+        self.eventId = event.id
+        self.done = 0
+        self.last = None
+        self.pending = None
+        if os.path.exists(path):
+            with open(path, 'r') as checkpointFile:
+                data = json.load(checkpointFile)
+            # a checkpoint of another event is a different run
+            if data.get('event') == self.eventId:
+                self.done = data['done']
+                self.last = data['last']
+                self.pending = parse_datetime(data['pending']) if data.get('pending') else None
+
+    def _write(self):
+        with open(self.path + '.tmp', 'w') as checkpointFile:
+            json.dump({'event': self.eventId, 'done': self.done, 'last': self.last,
+                       'pending': self.pending.isoformat() if self.pending else None}, checkpointFile)
+        os.replace(self.path + '.tmp', self.path)
+
+    def begin(self):
+        """
+        Records that the next batch is about to be sent.
+
+        :return: when an earlier attempt at the batch began, if there was one
+        :rtype: datetime
+        """
+        # an earlier attempt keeps its time, since some of its mails may have gone out
+        if self.pending is None:
+            self.pending = timezone.now()
+            self._write()
+        return self.pending
+
+    def save(self, done, last):
+        self.done = done
+        self.last = last
+        self.pending = None
+        self._write()
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def _assign_groups(users, volunteers, adminGroup, trackerGroup):
+    # heads are bid admins and everyone else bid trackers, set straight through the membership table
+    Membership = AuthUser.groups.through
+    heads = [users[email].id for email, volunteer in volunteers.items() if volunteer.isHead]
+    others = [users[email].id for email, volunteer in volunteers.items() if not volunteer.isHead]
+    Membership.objects.filter(Q(user_id__in=heads, group=trackerGroup) | Q(user_id__in=others, group=adminGroup)).delete()
+    wanted = {(userId, adminGroup.id) for userId in heads} | {(userId, trackerGroup.id) for userId in others}
+    existing = set(Membership.objects.filter(user_id__in=heads + others, group__in=[adminGroup, trackerGroup]).values_list('user_id', 'group_id'))
+    Membership.objects.bulk_create([Membership(user_id=userId, group_id=groupId) for userId, groupId in wanted - existing])
+
+
+def _send_volunteer_batch(domain, event, batch, template, sender, groups, token_generator, verbosity, dry_run, mailedSince=None):
+    volunteers = {}
+    for volunteer in batch:
+        volunteers[volunteer.email] = volunteer
+    existing = {user.email: user for user in AuthUser.objects.filter(email__in=list(volunteers.keys()))}
+    # the volunteers an earlier attempt at this batch already mailed
+    mailed = set()
+    if mailedSince:
+        for to in post_office.models.Email.objects.filter(
+                to__in=list(volunteers.keys()), created__gte=mailedSince).values_list('to', flat=True):
+            mailed.update(to)
+
+    if verbosity > 0:
+        for email, volunteer in volunteers.items():
+            if email in existing:
+                print("Found existing user {0} with email {1}".format(volunteer.username, email))
+            else:
+                print("Created user {0} with email {1}".format(volunteer.username, email))
+    if dry_run:
+        return
+
+    with transaction.atomic():
+        AuthUser.objects.bulk_create([
+            AuthUser(email=email, username=volunteer.username, first_name=volunteer.firstname,
+                     last_name=volunteer.lastname, is_active=False, is_staff=True)
+            for email, volunteer in volunteers.items() if email not in existing])
+        AuthUser.objects.filter(email__in=list(existing.keys()), is_staff=False).update(is_staff=True)
+        # read back, for the ids of the new users, which the tokens are made from
+        users = {user.email: user for user in AuthUser.objects.filter(email__in=list(volunteers.keys()))}
+        _assign_groups(users, volunteers, *groups)
+
+        mails = []
+        for email, volunteer in volunteers.items():
+            if email in mailed:
+                if verbosity > 0:
+                    print("Already sent email to {0}".format(volunteer.username))
+                continue
+            user = users[email]
+            if verbosity > 0:
+                print("Sending email to {0}, active = {1}, head = {2}".format(
+                    volunteer.username, user.is_active, volunteer.isHead))
+            context = dict(
+                event=event,
+                is_head=volunteer.isHead,
+                password_reset_url=domain + reverse('tracker:password_reset'),
+                registration_url=domain + reverse('tracker:register'))
+            mails.append(dict(recipients=[email], sender=sender, template=template,
+                              context=auth.auth_token_mail_context(domain, user, reverse('tracker:confirm_registration'),
+                                                                   token_generator, extra_context=context)))
+        mailutil.send_many(mails)
+
+
+def send_volunteer_mail(domain, event, volunteers, template, sender=None, token_generator=default_token_generator, verbosity=0, dry_run=False, batchSize=VOLUNTEER_BATCH_SIZE, checkpoint=None):
+    """
+    Creates or updates the staff accounts of the volunteers and queues their registration mails, a batch at a time:
+    each batch looks up its users with one query, creates the missing ones and sets their groups in bulk, and
+    queues its mails with a single insert, all in one transaction.
+
+    :param volunteers: any iterable of VolunteerInfo, e.g. iter_volunteer_info_file, which is only read as far as needed
+    :param checkpoint: where to record each batch that went through, and to resume from
+    :type checkpoint: VolunteerCheckpoint
+    :return: how many volunteers were processed, including any skipped by the checkpoint
+    :rtype: int
+    """
     if not sender:
         sender = viewutil.get_default_email_from_user()
-    adminGroup, created = Group.objects.get_or_create(name='Bid Admin')
-    trackerGroup, created = Group.objects.get_or_create(name='Bid Tracker')
-    for volunteer in volunteers:
-        try:
-            with transaction.atomic():
-                user,created = AuthUser.objects.get_or_create(email=volunteer.email, defaults=dict(username=volunteer.username, first_name=volunteer.firstname, last_name=volunteer.lastname, is_active=False))
-                user.is_staff = True
-                if volunteer.isHead:
-                    user.groups.add(adminGroup)
-                    user.groups.remove(trackerGroup)
-                else:
-                    user.groups.remove(adminGroup)
-                    user.groups.add(trackerGroup)
-                user.save()
-
-                if verbosity > 0:
-                    if created:
-                        print("Created user {0} with email {1}".format(volunteer.username, volunteer.email))
-                    else:
-                        print("Found existing user {0} with email {1}".format(volunteer.username, volunteer.email))
-
-                context = dict(
-                    event=event,
-                    is_head=volunteer.isHead,
-                    password_reset_url=domain + reverse('tracker:password_reset'),
-                    registration_url=domain + reverse('tracker:register'))
-
-                if verbosity > 0:
-                    print("Sending email to {0}, active = {1}, head = {2}".format(
-                        volunteer.username, user.is_active, volunteer.isHead))
-
-                if not dry_run:
-                    auth.send_registration_mail(domain, user, template, sender, token_generator, extra_context=context)
-                else:
-                    raise DryRunException
-        except DryRunException:
-            pass # do not commit anything to the db in dry run mode
+    template = template or mailutil.get_email_template(
+        auth.default_registration_template_name(),
+        auth.default_registration_template())
+    groups = (Group.objects.get_or_create(name='Bid Admin')[0], Group.objects.get_or_create(name='Bid Tracker')[0])
+
+    volunteers = iter(volunteers)
+    done = 0
+    if checkpoint and checkpoint.done:
+        skipped = list(islice(volunteers, checkpoint.done))
+        if len(skipped) < checkpoint.done or skipped[-1].email != checkpoint.last:
+            raise ValueError('The volunteer list does not match the checkpoint in {0}'.format(checkpoint.path))
+        done = checkpoint.done
+        if verbosity > 0:
+            print("Resuming after {0} volunteers".format(done))
+
+    while True:
+        batch = list(islice(volunteers, batchSize))
+        if not batch:
+            break
+        mailedSince = checkpoint.begin() if checkpoint and not dry_run else None
+        _send_volunteer_batch(domain, event, batch, template, sender, groups, token_generator, verbosity, dry_run,
+                              mailedSince)
+        done += len(batch)
+        if checkpoint and not dry_run:
+            checkpoint.save(done, batch[-1].email)
+        if verbosity > 0:
+            print("Processed {0} volunteers".format(done))
+
+    if checkpoint and not dry_run:
+        checkpoint.clear()
+    return done